@@ -3,6 +3,7 @@ from rest_framework.routers import DefaultRouter
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
 
 from apps.sub import views as sub_views
+from apps.sub import async_views as sub_async_views
 
 router = DefaultRouter()
 
@@ -19,8 +20,26 @@ router.register(
     basename="sub",
 )
 
+async_sub_urlpatterns = [
+    path("create_subscription/", sub_async_views.create_subscription),
+    path(
+        "renew_subscription_through_payment/",
+        sub_async_views.renew_subscription_through_payment,
+    ),
+    path("cancel_subscription/", sub_async_views.cancel_subscription),
+    path(
+        "get_subscription_by_user_uuid/",
+        sub_async_views.get_subscription_by_user_uuid,
+    ),
+    path("check_subscriptions/", sub_async_views.check_subscriptions),
+    path("check_entitlements/", sub_async_views.check_entitlements),
+    path("payment_notification/", sub_async_views.payment_notification),
+]
+
 urlpatterns = [
     path("", include(router.urls)),  # Регистрация роутов
+    path("async/sub/", include(async_sub_urlpatterns)),  # Асинхронные ручки
+    path("export/<str:dataset>/", sub_views.export_data),  # Выгрузка для аналитики
     path("schema/", SpectacularAPIView.as_view(), name="schema"),
     path(
         "swagger/",
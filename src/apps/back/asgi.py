@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "apps.back.settings")
 
 application = get_asgi_application()
+
+# Справочник планов загружается при старте воркера, а не первым запросом
+from apps.sub.cache import PlanCatalog  # noqa: E402
+
+PlanCatalog.warm()
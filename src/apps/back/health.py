@@ -0,0 +1,31 @@
+import os
+
+from django.conf import settings
+from django.http import HttpRequest, HttpResponse, JsonResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+from apps.sub.metrics import build_registry
+from lib.django_utils.db_pool import get_pool_stats
+
+
+def db_pool(request: HttpRequest) -> JsonResponse:
+    """
+    Статистика пула соединений с БД процесса, обработавшего запрос
+    """
+    return JsonResponse(
+        {
+            "process_type": settings.PROCESS_TYPE,
+            "pid": os.getpid(),
+            "mode": settings.DB_CONN_MODE,
+            "pools": get_pool_stats(),
+        }
+    )
+
+
+def metrics(request: HttpRequest) -> HttpResponse:
+    """
+    Метрики Prometheus
+    """
+    return HttpResponse(
+        generate_latest(build_registry()), content_type=CONTENT_TYPE_LATEST
+    )
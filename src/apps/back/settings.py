@@ -10,9 +10,12 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 
+import json
 import os
 from pathlib import Path
 
+from celery.schedules import crontab
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -94,9 +97,59 @@ DATABASES = {
         "PASSWORD": os.getenv("DB_PASS"),
         "HOST": os.getenv("DB_HOST"),
         "PORT": os.getenv("DB_PORT"),
+        "CONN_HEALTH_CHECKS": True,
+        "OPTIONS": {},
     },
 }
 
+# Тип процесса: web (gunicorn + uvicorn) или worker (celery)
+PROCESS_TYPE = os.getenv("PROCESS_TYPE", "web")
+
+# Режим соединений с БД:
+#   pool - пул соединений psycopg на процесс
+#   persistent - одно постоянное соединение на поток (CONN_MAX_AGE)
+#   pgbouncer - соединения через PgBouncer в режиме transaction pooling
+DB_CONN_MODE = os.getenv("DB_CONN_MODE", "pool")
+
+# Размеры пула (min, max) на один процесс. Итоговое число соединений с Postgres:
+# воркеры gunicorn * max web + процессы celery * max worker. Воркеру с пулом
+# threads или gevent scripts/celery.py поднимает max worker до concurrency
+DB_POOL_SIZES = {
+    "web": (
+        int(os.getenv("DB_POOL_WEB_MIN_SIZE", 1)),
+        int(os.getenv("DB_POOL_WEB_MAX_SIZE", 4)),
+    ),
+    "worker": (
+        int(os.getenv("DB_POOL_WORKER_MIN_SIZE", 1)),
+        int(os.getenv("DB_POOL_WORKER_MAX_SIZE", 2)),
+    ),
+}
+if PROCESS_TYPE not in DB_POOL_SIZES:
+    raise ImproperlyConfigured(
+        f"PROCESS_TYPE={PROCESS_TYPE!r} is not supported, "
+        f"expected one of: {', '.join(DB_POOL_SIZES)}"
+    )
+
+if DB_CONN_MODE == "pool":
+    db_pool_min_size, db_pool_max_size = DB_POOL_SIZES[PROCESS_TYPE]
+    DATABASES["default"]["OPTIONS"]["pool"] = {
+        "min_size": db_pool_min_size,
+        "max_size": db_pool_max_size,
+        # Сколько ждать свободное соединение, сек
+        "timeout": float(os.getenv("DB_POOL_TIMEOUT", 10)),
+        # Через сколько закрывать простаивающие соединения сверх min_size, сек
+        "max_idle": float(os.getenv("DB_POOL_MAX_IDLE", 300)),
+        "name": PROCESS_TYPE,
+    }
+elif DB_CONN_MODE == "persistent":
+    DATABASES["default"]["CONN_MAX_AGE"] = int(os.getenv("DB_CONN_MAX_AGE", 60))
+elif DB_CONN_MODE == "pgbouncer":
+    DATABASES["default"]["CONN_MAX_AGE"] = int(os.getenv("DB_CONN_MAX_AGE", 60))
+    # Серверные курсоры и подготовленные запросы не переживают смену
+    # серверного соединения между транзакциями
+    DATABASES["default"]["DISABLE_SERVER_SIDE_CURSORS"] = True
+    DATABASES["default"]["OPTIONS"]["prepare_threshold"] = None
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -162,20 +215,269 @@ CELERY_BEAT_SCHEDULER = "django_celery_beat.schedulers:DatabaseScheduler"
 # Необходимо указывать путь к битам, иначе они не запустятся
 CELERY_IMPORTS = ("apps.sub.beats",)
 
+# Очереди списаний автоплатежей. При CHARGE_QUEUE_SHARDS > 1 пачки списаний
+# раскладываются по шардам charges_<N> по хэшу user_uuid, у каждого шарда свой
+# воркер, и медленная пачка одного шарда не задерживает остальные
+CHARGE_QUEUE_SHARDS = int(os.getenv("CHARGE_QUEUE_SHARDS", 1))
+CHARGE_QUEUES = (
+    [f"charges_{shard}" for shard in range(CHARGE_QUEUE_SHARDS)]
+    if CHARGE_QUEUE_SHARDS > 1
+    else ["charges"]
+)
+# Повторные списания (end_date прошел больше CHARGE_PRIORITY_OVERDUE_SECONDS
+# назад) и попытки dunning у конца льготного периода (меньше
+# DUNNING_PRIORITY_GRACE_SECONDS) идут в отдельную очередь впереди первых попыток
+CHARGE_PRIORITY_QUEUE = "charges_priority"
+CHARGE_PRIORITY_OVERDUE_SECONDS = int(
+    os.getenv(
+        "CHARGE_PRIORITY_OVERDUE_SECONDS",
+        os.getenv("RENEWAL_SWEEP_LOCK_SECONDS", 3600),
+    )
+)
+
+# Очереди по умолчанию. Очередь списаний выбирает свип при отправке таски
 task_routes = {
     "apps.sub.beats.test_celery_work": {"queue": "test"},
-    "apps.sub.tasks.make_autopayment": {"queue": "payment"},
-    "apps.sub.tasks.stop_subscription": {"queue": "payment"},
+    "apps.sub.beats.renewal_sweep": {"queue": "sweep"},
+    "apps.sub.tasks.make_autopayment": {"queue": CHARGE_QUEUES[0]},
+    "apps.sub.beats.expiry_sweep": {"queue": "expiries"},
+    "apps.sub.beats.dunning_sweep": {"queue": "sweep"},
+    "apps.sub.beats.cleanup_provider_operations": {"queue": "sweep"},
+    "apps.sub.tasks.retry_autopayment": {"queue": CHARGE_QUEUES[0]},
+    "apps.sub.tasks.process_payment_events": {"queue": "webhook"},
+    "apps.sub.tasks.sync_provider_payments": {"queue": "provider"},
+    "apps.sub.tasks.reconcile_payments": {"queue": "provider"},
 }
+# Все очереди, которые должны разбирать воркеры
+task_queues = list(
+    dict.fromkeys(
+        [
+            *(route["queue"] for route in task_routes.values()),
+            *CHARGE_QUEUES,
+            CHARGE_PRIORITY_QUEUE,
+        ]
+    )
+)
+# Процессы воркеров по очередям для scripts/celery.py: processes процессов
+# celery worker, у каждого concurrency потоков выполнения пула pool
+# (prefork, threads или gevent - нужен пакет gevent).
+# Переопределяется JSON в CELERY_WORKER_PROCESSES по очередям, например
+# {"charges": {"processes": 2, "concurrency": 8, "pool": "threads"}}
+# Потоки threads и gevent делят пул соединений своего процесса, поэтому
+# max_size пула такого воркера не меньше concurrency: в примере это
+# 2 * 8 соединений с Postgres вместо 2 * DB_POOL_WORKER_MAX_SIZE
+worker_processes = {
+    queue: {"processes": 1, "concurrency": 4, "pool": "prefork"}
+    for queue in task_queues
+}
+worker_processes["test"]["concurrency"] = 1
+for queue, options in json.loads(os.getenv("CELERY_WORKER_PROCESSES", "{}")).items():
+    worker_processes[queue] = {**worker_processes.get(queue, {}), **options}
+# Порт HTTP ручки здоровья супервизора воркеров, пустое значение отключает ручку
+CELERY_SUPERVISOR_HEALTH_PORT = (
+    int(os.getenv("CELERY_SUPERVISOR_HEALTH_PORT"))
+    if os.getenv("CELERY_SUPERVISOR_HEALTH_PORT")
+    else None
+)
+
 task_groups = {
     "main": {
         "test_celery_work": {
             "task": "apps.sub.beats.test_celery_work",
             "schedule": 5000000.0,
         },
+        "renewal_sweep": {
+            "task": "apps.sub.beats.renewal_sweep",
+            "schedule": float(os.getenv("RENEWAL_SWEEP_INTERVAL", 60)),
+        },
+        "expiry_sweep": {
+            "task": "apps.sub.beats.expiry_sweep",
+            "schedule": float(os.getenv("EXPIRY_SWEEP_INTERVAL", 60)),
+        },
+        "dunning_sweep": {
+            "task": "apps.sub.beats.dunning_sweep",
+            "schedule": float(os.getenv("DUNNING_SWEEP_INTERVAL", 300)),
+        },
+        # Добирает уведомления, которые не были обработаны сразу после приема
+        "process_payment_events": {
+            "task": "apps.sub.tasks.process_payment_events",
+            "schedule": float(os.getenv("PAYMENT_EVENTS_INTERVAL", 10)),
+        },
+        "sync_provider_payments": {
+            "task": "apps.sub.tasks.sync_provider_payments",
+            "schedule": float(os.getenv("PROVIDER_SYNC_INTERVAL", 300)),
+        },
+        # Удаление завершенных операций в ЮKassa старше PROVIDER_OPERATION_RETENTION_DAYS
+        "cleanup_provider_operations": {
+            "task": "apps.sub.beats.cleanup_provider_operations",
+            "schedule": crontab(
+                hour=os.getenv("PROVIDER_OPERATION_CLEANUP_HOUR", "4"),
+                minute=os.getenv("PROVIDER_OPERATION_CLEANUP_MINUTE", "0"),
+            ),
+        },
+        # Ночная сверка платежей с ЮKassa
+        "reconcile_payments": {
+            "task": "apps.sub.tasks.reconcile_payments",
+            "schedule": crontab(
+                hour=os.getenv("RECONCILE_HOUR", "3"),
+                minute=os.getenv("RECONCILE_MINUTE", "0"),
+            ),
+        },
     }
 }
 
+# Свип продления подписок
+RENEWAL_SWEEP_CHUNK_SIZE = int(os.getenv("RENEWAL_SWEEP_CHUNK_SIZE", 500))
+# Максимум пачек за один запуск свипа
+RENEWAL_SWEEP_MAX_CHUNKS = int(os.getenv("RENEWAL_SWEEP_MAX_CHUNKS", 100))
+# Через сколько секунд забранная, но не обработанная подписка вернется в свип
+RENEWAL_SWEEP_LOCK_SECONDS = int(os.getenv("RENEWAL_SWEEP_LOCK_SECONDS", 3600))
+# Сколько подписок без автопродления свип истечения переводит в expired
+# одним UPDATE
+EXPIRY_SWEEP_CHUNK_SIZE = int(os.getenv("EXPIRY_SWEEP_CHUNK_SIZE", 1000))
+# Сколько подписок продлевает одна таска make_autopayment
+RENEWAL_TASK_BATCH_SIZE = int(os.getenv("RENEWAL_TASK_BATCH_SIZE", 200))
+# Сколько автоплатежей одна таска выполняет одновременно
+AUTOPAYMENT_CONCURRENCY = int(os.getenv("AUTOPAYMENT_CONCURRENCY", 20))
+# Лимит автоплатежей в секунду на все воркеры, 0 - без лимита
+AUTOPAYMENT_RATE_LIMIT = float(os.getenv("AUTOPAYMENT_RATE_LIMIT", 50))
+AUTOPAYMENT_RATE_LIMIT_BURST = float(os.getenv("AUTOPAYMENT_RATE_LIMIT_BURST", 50))
+# Сколько раз свип повторяет автоплатеж, завершившийся временной ошибкой ЮKassa,
+# прежде чем считать его отказом (ошибка 4xx - отказ сразу)
+AUTOPAYMENT_MAX_ATTEMPTS = int(os.getenv("AUTOPAYMENT_MAX_ATTEMPTS", 5))
+
+# Сколько дней хранятся завершенные операции в ЮKassa (provider_operation).
+# ЮKassa помнит ключ идемпотентности сутки, после этого запись нужна только
+# для разбора инцидентов. Незавершенные (pending) операции не удаляются
+PROVIDER_OPERATION_RETENTION_DAYS = int(
+    os.getenv("PROVIDER_OPERATION_RETENTION_DAYS", 7)
+)
+# Сколько операций удаляется одним DELETE
+PROVIDER_OPERATION_CLEANUP_CHUNK_SIZE = int(
+    os.getenv("PROVIDER_OPERATION_CLEANUP_CHUNK_SIZE", 5000)
+)
+
+# Повторные списания отклоненных автоплатежей (dunning). Задержки в секундах
+# через запятую: после N-го отказа следующая попытка через N-ю задержку.
+# Пусто - подписка отменяется после первого отказа, как без повторов
+DUNNING_RETRY_SCHEDULE = [
+    int(delay)
+    for delay in os.getenv("DUNNING_RETRY_SCHEDULE", "3600,21600,86400,259200").split(
+        ","
+    )
+    if delay.strip()
+]
+# Льготный период после end_date: подписка в past_due сохраняет доступ,
+# попытки позже его конца не планируются и подписка отменяется
+DUNNING_GRACE_SECONDS = int(os.getenv("DUNNING_GRACE_SECONDS", 7 * 24 * 3600))
+# Попытки, у которых до конца льготного периода осталось меньше этого,
+# идут в CHARGE_PRIORITY_QUEUE, остальные - в шард по user_uuid
+DUNNING_PRIORITY_GRACE_SECONDS = int(
+    os.getenv("DUNNING_PRIORITY_GRACE_SECONDS", 24 * 3600)
+)
+
+# Уведомления ЮKassa
+PAYMENT_EVENTS_BATCH_SIZE = int(os.getenv("PAYMENT_EVENTS_BATCH_SIZE", 200))
+# Максимум пачек за один запуск таски
+PAYMENT_EVENTS_MAX_BATCHES = int(os.getenv("PAYMENT_EVENTS_MAX_BATCHES", 50))
+
+# Синхронизация платежей ЮKassa в локальное зеркало
+# Размер страницы списка платежей, в ЮKassa не больше 100
+PROVIDER_SYNC_PAGE_SIZE = int(os.getenv("PROVIDER_SYNC_PAGE_SIZE", 100))
+# Максимум страниц за один запуск таски, остаток прохода заберет следующий запуск
+PROVIDER_SYNC_MAX_PAGES = int(os.getenv("PROVIDER_SYNC_MAX_PAGES", 50))
+# Насколько раньше водяного знака начинается проход: платеж может появиться
+# в списке позже своего created_at
+PROVIDER_SYNC_OVERLAP_SECONDS = int(os.getenv("PROVIDER_SYNC_OVERLAP_SECONDS", 600))
+# Через сколько секунд блокировка упавшего запуска истечет
+PROVIDER_SYNC_LEASE_SECONDS = int(os.getenv("PROVIDER_SYNC_LEASE_SECONDS", 900))
+
+# Сверка платежей с ЮKassa
+# За сколько дней проверяются все платежи. Последние платежи подписок в pending
+# проверяются независимо от даты
+RECONCILE_LOOKBACK_DAYS = int(os.getenv("RECONCILE_LOOKBACK_DAYS", 3))
+# Платежи моложе стольких секунд не проверяются, вебхук по ним может быть в пути
+RECONCILE_GRACE_SECONDS = int(os.getenv("RECONCILE_GRACE_SECONDS", 900))
+# Платежей в пачке: одна пачка - один запрос в БД и параллельные запросы в ЮKassa
+RECONCILE_BATCH_SIZE = int(os.getenv("RECONCILE_BATCH_SIZE", 500))
+# Сколько запросов в ЮKassa выполняется одновременно
+RECONCILE_CONCURRENCY = int(os.getenv("RECONCILE_CONCURRENCY", 10))
+# Аренда продлевается после каждой пачки
+RECONCILE_LEASE_SECONDS = int(os.getenv("RECONCILE_LEASE_SECONDS", 900))
+
+# Выгрузка подписок и платежей
+# Строк, читаемых из курсора БД за раз (и строк в row group parquet)
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", 5000))
+# Строки моложе стольких секунд не выгружаются: их транзакции могли еще не закоммититься
+EXPORT_WATERMARK_LAG_SECONDS = int(os.getenv("EXPORT_WATERMARK_LAG_SECONDS", 60))
+# Токен ручки выгрузки (Authorization: Bearer <токен>), без токена ручка отключена
+EXPORT_API_TOKEN = os.getenv("EXPORT_API_TOKEN")
+
+# Массовый импорт подписок: подписок в пачке (одна транзакция)
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", 5000))
+
+# CACHE
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        # БД 0 занята брокером Celery
+        "LOCATION": f"redis://{REDIS_HOST}:{REDIS_PORT}/1",
+    },
+}
+
+# Redis для общих между воркерами лимитов запросов к ЮKassa
+AUTOPAYMENT_RATE_LIMIT_REDIS = f"redis://{REDIS_HOST}:{REDIS_PORT}/1"
+
+# Время жизни подписки в кэше, сек
+SUBSCRIPTION_CACHE_TTL = int(os.getenv("SUBSCRIPTION_CACHE_TTL", 300))
+# Время жизни отметки "подписка не найдена", сек
+SUBSCRIPTION_CACHE_NEGATIVE_TTL = int(os.getenv("SUBSCRIPTION_CACHE_NEGATIVE_TTL", 30))
+# Как часто процесс сверяет версию справочника планов в Redis, сек
+PLAN_CATALOG_CHECK_INTERVAL = float(os.getenv("PLAN_CATALOG_CHECK_INTERVAL", 5))
+
+# Максимум UUID в одном запросе массовой проверки подписок
+BULK_CHECK_MAX_UUIDS = int(os.getenv("BULK_CHECK_MAX_UUIDS", 10000))
+# Размер пачки UUID для одного multi-get в кэш и запроса в БД
+BULK_CHECK_CHUNK_SIZE = int(os.getenv("BULK_CHECK_CHUNK_SIZE", 1000))
+
+# YOOKASSA
+
+YOOKASSA_API_URL = os.getenv("YOOKASSA_API_URL", "https://api.yookassa.ru/v3")
+# Пул HTTP соединений клиентов ЮKassa (синхронного - на процесс, асинхронного - на event loop)
+YOOKASSA_HTTP_MAX_CONNECTIONS = int(os.getenv("YOOKASSA_HTTP_MAX_CONNECTIONS", 100))
+YOOKASSA_HTTP_MAX_KEEPALIVE = int(os.getenv("YOOKASSA_HTTP_MAX_KEEPALIVE", 20))
+YOOKASSA_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("YOOKASSA_HTTP_KEEPALIVE_EXPIRY", 30))
+# Таймаут запроса по умолчанию, секунды
+YOOKASSA_HTTP_TIMEOUT = float(os.getenv("YOOKASSA_HTTP_TIMEOUT", 30))
+# Таймауты по операциям, секунды
+YOOKASSA_TIMEOUTS = {
+    "create_payment": float(os.getenv("YOOKASSA_TIMEOUT_CREATE_PAYMENT", 10)),
+    "charge_autopayment": float(os.getenv("YOOKASSA_TIMEOUT_CHARGE_AUTOPAYMENT", 30)),
+    "get_payment": float(os.getenv("YOOKASSA_TIMEOUT_GET_PAYMENT", 5)),
+    "list_payments": float(os.getenv("YOOKASSA_TIMEOUT_LIST_PAYMENTS", 10)),
+    "cancel_payment": float(os.getenv("YOOKASSA_TIMEOUT_CANCEL_PAYMENT", 10)),
+    "create_refund": float(os.getenv("YOOKASSA_TIMEOUT_CREATE_REFUND", 15)),
+}
+# Попыток на запрос, включая первую, и границы экспоненциальной задержки между ними
+YOOKASSA_RETRY_ATTEMPTS = int(os.getenv("YOOKASSA_RETRY_ATTEMPTS", 3))
+YOOKASSA_RETRY_BASE_DELAY = float(os.getenv("YOOKASSA_RETRY_BASE_DELAY", 0.2))
+YOOKASSA_RETRY_MAX_DELAY = float(os.getenv("YOOKASSA_RETRY_MAX_DELAY", 5))
+# Circuit breaker: после CIRCUIT_FAILURES временных ошибок за CIRCUIT_WINDOW секунд
+# запросы к ЮKassa не выполняются CIRCUIT_OPEN_SECONDS секунд
+YOOKASSA_CIRCUIT_FAILURES = int(os.getenv("YOOKASSA_CIRCUIT_FAILURES", 20))
+YOOKASSA_CIRCUIT_WINDOW = int(os.getenv("YOOKASSA_CIRCUIT_WINDOW", 60))
+YOOKASSA_CIRCUIT_OPEN_SECONDS = int(os.getenv("YOOKASSA_CIRCUIT_OPEN_SECONDS", 30))
+
+# METRICS
+
+# Порт HTTP сервера метрик воркера Celery, пустое значение отключает сервер
+CELERY_METRICS_PORT = (
+    int(os.getenv("CELERY_METRICS_PORT")) if os.getenv("CELERY_METRICS_PORT") else None
+)
+# Время жизни в кэше количества подписок по статусам, сек
+METRICS_SUBSCRIPTIONS_TTL = int(os.getenv("METRICS_SUBSCRIPTIONS_TTL", 60))
+
 # LOGGS
 
 LOGS_FILE_PATH = os.getenv("LOGS_FILE_PATH")
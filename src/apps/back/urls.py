@@ -3,11 +3,13 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import include, path
 
-from apps.back import api_urls
+from apps.back import api_urls, health
 
 urlpatterns = [
     path("api/admin/", admin.site.urls),
     path("api/", include(api_urls)),
+    path("api/health/db_pool/", health.db_pool),
+    path("metrics", health.metrics),
 ]
 
 if settings.DEBUG:
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "apps.back.settings")
 
 application = get_wsgi_application()
+
+# Справочник планов загружается при старте воркера, а не первым запросом
+from apps.sub.cache import PlanCatalog  # noqa: E402
+
+PlanCatalog.warm()
@@ -5,3 +5,10 @@ class InfrastructureConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "apps.sub"
     verbose_name = "Подписочный сервис"
+
+    def ready(self) -> None:
+        # Подключает сигналы Celery для метрик тасок
+        from . import metrics  # noqa: F401
+
+        # Подключает сигналы смены версии справочника планов
+        from . import cache  # noqa: F401
@@ -0,0 +1,327 @@
+import asyncio
+import os
+import weakref
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .models import Plan, Subscription, Payment as PaymentModel
+from . import sub_types, yookassa_api
+from .cache import PlanCatalog
+from .logic import ProviderOperationLogic, SubscriptionLogic
+from .metrics import observe_provider
+from .resilience import RetryPolicy
+
+
+class AsyncYooKassaClient:
+    """
+    Асинхронный клиент API ЮKassa.
+
+    В отличие от SDK, который открывает новое соединение на каждый запрос,
+    держит пул keep-alive соединений httpx. Клиент привязан к event loop,
+    поэтому для получения общего клиента используйте for_current_loop().
+    Запросы и разбор ответов общие с YooKassaClient (yookassa_api), запросы
+    выполняются через RetryPolicy.
+    """
+
+    _loop_clients: (
+        "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncYooKassaClient]"
+    ) = weakref.WeakKeyDictionary()
+
+    def __init__(self, account_id: str, secret_key: str):
+        self.http = httpx.AsyncClient(
+            **yookassa_api.http_options(account_id, secret_key)
+        )
+        self.policy = RetryPolicy.from_settings()
+
+    @classmethod
+    def for_current_loop(cls) -> "AsyncYooKassaClient":
+        """
+        Возвращает общий клиент для текущего event loop, создавая его при необходимости.
+        """
+        loop = asyncio.get_running_loop()
+        client = cls._loop_clients.get(loop)
+        if client is None:
+            client = cls(
+                os.getenv("YOOKASSA_ACCOUNT_ID", ""),
+                os.getenv("YOOKASSA_SECRET_KEY", ""),
+            )
+            cls._loop_clients[loop] = client
+        return client
+
+    async def __aenter__(self) -> "AsyncYooKassaClient":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        await self.http.aclose()
+
+    async def _request(self, request: yookassa_api.ApiRequest) -> dict:
+        async def attempt(timeout: float) -> dict:
+            return yookassa_api.parse_response(
+                await self.http.request(
+                    request.method,
+                    request.path,
+                    json=request.body,
+                    params=request.params,
+                    headers=request.headers,
+                    timeout=timeout,
+                )
+            )
+
+        return await self.policy.acall(request.operation, attempt)
+
+    @observe_provider
+    async def create_payment(
+        self,
+        amount: float,
+        currency: str,
+        return_url: str,
+        user_id: str,
+        save_payment_method: bool = False,
+        description: str = None,
+        idempotence_key: str | None = None,
+    ) -> dict:
+        """
+        Создает платеж, возвращает URL для оплаты и данные о платеже.
+
+        Параметры описаны в yookassa_api.create_payment
+        """
+        payment = await self._request(
+            yookassa_api.create_payment(
+                amount,
+                currency,
+                return_url,
+                user_id,
+                save_payment_method,
+                description,
+                idempotence_key,
+            )
+        )
+        return yookassa_api.checkout_info(payment)
+
+    @observe_provider
+    async def cancel_payment(
+        self, payment_id: str, idempotence_key: str | None = None
+    ) -> dict:
+        """
+        Отменяет платеж в статусе waiting_for_capture.
+        """
+        return yookassa_api.cancellation_info(
+            await self._request(
+                yookassa_api.cancel_payment(payment_id, idempotence_key)
+            )
+        )
+
+    @observe_provider
+    async def list_payments(
+        self, limit: int = 100, cursor: str | None = None, **filters
+    ) -> tuple[list[dict], str | None]:
+        """
+        Возвращает страницу списка платежей магазина и курсор следующей страницы.
+
+        Параметры описаны в yookassa_api.list_payments
+        """
+        return yookassa_api.payments_page(
+            await self._request(yookassa_api.list_payments(limit, cursor, **filters))
+        )
+
+    @observe_provider
+    async def get_payment(self, payment_id: str) -> dict:
+        """
+        Получает информацию о платеже по его идентификатору.
+        """
+        return yookassa_api.payment_info(
+            await self._request(yookassa_api.get_payment(payment_id))
+        )
+
+    @observe_provider
+    async def get_payment_object(self, payment_id: str) -> dict:
+        """
+        Получает платеж в формате API ЮKassa, как в объекте уведомления.
+        """
+        return await self._request(yookassa_api.get_payment(payment_id))
+
+    @observe_provider
+    async def charge_autopayment(
+        self,
+        user_id: str,
+        amount: float,
+        currency: str,
+        payment_method_id: str,
+        description: str,
+        idempotence_key: str | None = None,
+    ) -> dict:
+        """
+        Совершает автоплатеж с сохраненным способом оплаты.
+
+        Параметры описаны в yookassa_api.charge_autopayment
+        """
+        payment = await self._request(
+            yookassa_api.charge_autopayment(
+                user_id,
+                amount,
+                currency,
+                payment_method_id,
+                description,
+                idempotence_key,
+            )
+        )
+        return yookassa_api.autopayment_info(payment)
+
+    @observe_provider
+    async def refund_payment(
+        self,
+        payment_id: str,
+        amount: float,
+        currency: str = "RUB",
+        idempotence_key: str | None = None,
+    ) -> sub_types.RefundResponse:
+        """
+        Возврат платежа.
+
+        Параметры описаны в yookassa_api.refund_payment
+        """
+        refund = await self._request(
+            yookassa_api.refund_payment(payment_id, amount, currency, idempotence_key)
+        )
+        return yookassa_api.refund_info(refund)
+
+
+class AsyncSubscriptionLogic:
+    """
+    Асинхронные версии операций SubscriptionLogic, которые ходят в ЮKassa.
+
+    Работа с БД выполняется через async ORM, запросы к ЮKassa - через
+    общий пул соединений AsyncYooKassaClient, поэтому воркер uvicorn
+    не блокируется на время ответа провайдера. Изменения подписки пишутся
+    транзакциями SubscriptionLogic через sync_to_async: async ORM
+    не поддерживает транзакции.
+    """
+
+    @classmethod
+    async def create_subscription(
+        cls, plan_id: int, user_uuid: str, auto_renew: bool, return_url: str
+    ) -> str:
+        """
+        Создать новую подписку и инициировать платеж.
+
+        :param plan_id: ID тарифного плана
+        :param user_uuid: UUID пользователя
+        :param auto_renew: нужно ли автопродление
+        :param return_url: URL, на который пользователь вернется после оплаты
+        :return: URL для оплаты через YooKassa
+        """
+        plan = await PlanCatalog.aget(plan_id)
+        if plan is None:
+            raise Plan.DoesNotExist(f"Plan {plan_id} not found")
+
+        payment_data = await ProviderOperationLogic.arun(
+            "checkout",
+            ProviderOperationLogic.attempt_reference(f"{user_uuid}:{plan_id}"),
+            lambda key: AsyncYooKassaClient.for_current_loop().create_payment(
+                amount=float(plan.price),
+                currency="RUB",
+                return_url=return_url,
+                user_id=user_uuid,
+                save_payment_method=auto_renew,
+                description=f"Subscription for user {user_uuid}",
+                idempotence_key=key,
+            ),
+        )
+
+        # Запись подписки, платежа и доступа - одна транзакция
+        await sync_to_async(SubscriptionLogic.store_new_subscription)(
+            plan, user_uuid, auto_renew, payment_data
+        )
+
+        return payment_data["confirmation_url"]
+
+    @classmethod
+    async def renew_subscription_through_payment(
+        cls, subscription: Subscription, return_url: str, auto_renew: bool
+    ) -> str:
+        """
+        Продлить cancelled, expired или past_due подписку за счёт обычной оплаты.
+
+        :param subscription: объект БД Subscription
+        :param return_url: URL для возвращения после оплаты
+        :param auto_renew: Автоплатеж
+        :return: URL для оплаты
+        """
+        plan = await PlanCatalog.aget(subscription.plan_id)
+
+        payment_data = await ProviderOperationLogic.arun(
+            "renewal_checkout",
+            ProviderOperationLogic.attempt_reference(
+                f"{subscription.pk}:{subscription.end_date.isoformat()}"
+            ),
+            lambda key: AsyncYooKassaClient.for_current_loop().create_payment(
+                amount=float(plan.price),
+                currency="RUB",
+                return_url=return_url,
+                user_id=str(subscription.user_uuid),
+                save_payment_method=auto_renew,
+                description=f"Manual renewal for subscription {subscription.pk} user {subscription.user_uuid}",
+                idempotence_key=key,
+            ),
+        )
+
+        await sync_to_async(SubscriptionLogic.store_renewal_checkout)(
+            subscription, plan, auto_renew, payment_data
+        )
+
+        return payment_data["confirmation_url"]
+
+    @classmethod
+    async def cancel_subscription(cls, subscription: Subscription) -> bool:
+        """
+        Отмена подписки с возвратом последнего платежа.
+
+        :param subscription: объект БД Subscription
+        :return: True, если возврат произошел, иначе False
+        """
+        import logging
+
+        logger = logging.getLogger("sub")
+        logger.info(f"Отменяем подписку пользователю {subscription.user_uuid}")
+
+        if subscription.status == "past_due":
+            await sync_to_async(SubscriptionLogic.store_cancelled_past_due)(
+                subscription
+            )
+            return True
+
+        plan = await PlanCatalog.aget(subscription.plan_id)
+
+        last_payment = (
+            await PaymentModel.objects.filter(subscription=subscription)
+            .exclude(yk_payment_method_id__isnull=True)
+            .order_by("-id")
+            .afirst()
+        )
+
+        if last_payment:
+            refund = await ProviderOperationLogic.arun(
+                "refund",
+                ProviderOperationLogic.attempt_reference(last_payment.yk_payment_id),
+                lambda key: AsyncYooKassaClient.for_current_loop().refund_payment(
+                    payment_id=last_payment.yk_payment_id,
+                    amount=float(plan.price),
+                    idempotence_key=key,
+                ),
+                id_field="refund_id",
+            )
+
+            logger.info(f"Статус возврата: {refund['status']}")
+
+            if refund["status"] != "succeeded":
+                logger.info("Возврат не удался")
+                return False
+
+        await sync_to_async(SubscriptionLogic.store_cancelled)(subscription)
+
+        return True
@@ -0,0 +1,300 @@
+"""
+Асинхронные версии ручек SubcriptionViewSet: ручки, которые ходят в ЮKassa,
+ручки чтения подписок и доступов и вебхук ЮKassa.
+
+DRF не поддерживает async представления, поэтому ручки реализованы как
+нативные async views Django и переиспользуют сериализаторы DRF для валидации.
+Под uvicorn они выполняются в event loop без переключения в поток на весь
+запрос, запросы в ЮKassa идут через httpx.AsyncClient и не блокируют loop.
+"""
+
+import json
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpRequest, JsonResponse, HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework import status
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import Subscription
+from . import serializers, sub_types, async_logic, logic, tasks
+from .cache import PlanCatalog, SubscriptionCache
+from .metrics import observe_view
+
+
+def _parse_body(request: HttpRequest) -> dict | None:
+    try:
+        return json.loads(request.body)
+    except json.JSONDecodeError:
+        return None
+
+
+@csrf_exempt
+@require_POST
+@observe_view
+async def create_subscription(request: HttpRequest) -> HttpResponse:
+    """
+    Ручка для создания подписки
+    """
+    request_serializer = serializers.CreateSubscriptionRequestSerializer(
+        data=_parse_body(request),
+    )
+    if not request_serializer.is_valid():
+        return JsonResponse(
+            request_serializer.errors, status=status.HTTP_400_BAD_REQUEST
+        )
+    create_sub_body: sub_types.CreateSubscription = (
+        request_serializer.validated_data
+    )  # type: ignore
+
+    if await Subscription.objects.filter(
+        user_uuid=create_sub_body["user_uuid"]
+    ).aexists():
+        return JsonResponse(
+            {"detail": "user with the same uuid already has the subscription"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    if await PlanCatalog.aget(create_sub_body["plan_id"]) is None:
+        return JsonResponse(
+            {"detail": "plan not found"},
+            status=status.HTTP_404_NOT_FOUND,
+        )
+
+    create_sub_response = await async_logic.AsyncSubscriptionLogic.create_subscription(
+        plan_id=create_sub_body["plan_id"],
+        user_uuid=create_sub_body["user_uuid"],
+        auto_renew=create_sub_body["auto_renew"],
+        return_url=create_sub_body["return_url"],
+    )
+
+    response_serializer = serializers.CreateSubscriptionResponseSerializer(
+        {"payment_url": create_sub_response}
+    )
+    return JsonResponse(response_serializer.data, status=status.HTTP_200_OK)
+
+
+@csrf_exempt
+@require_POST
+@observe_view
+async def renew_subscription_through_payment(request: HttpRequest) -> HttpResponse:
+    """
+    Ручка для ручного продления подписки
+
+    Можно продлить только cancelled, expired или past_due подписку
+    """
+    request_serializer = serializers.RenewSubscriptionRequestSerializer(
+        data=_parse_body(request),
+    )
+    if not request_serializer.is_valid():
+        return JsonResponse(
+            request_serializer.errors, status=status.HTTP_400_BAD_REQUEST
+        )
+
+    renew_subscription: sub_types.RenewSubscription = (
+        request_serializer.validated_data
+    )  # type: ignore
+
+    subscription = await Subscription.objects.filter(
+        user_uuid=renew_subscription["user_uuid"]
+    ).afirst()
+    if subscription is None:
+        return JsonResponse(
+            {"detail": "Subscription not found"}, status=status.HTTP_404_NOT_FOUND
+        )
+
+    if subscription.status not in ("cancelled", "expired", "past_due"):
+        return JsonResponse(
+            {"detail": "Subscription is not cancelled, expired or past due"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    create_sub_response = (
+        await async_logic.AsyncSubscriptionLogic.renew_subscription_through_payment(
+            subscription=subscription,
+            auto_renew=renew_subscription["auto_renew"],
+            return_url=renew_subscription["return_url"],
+        )
+    )
+
+    response_serializer = serializers.RenewSubscriptionResponseSerializer(
+        {"payment_url": create_sub_response}
+    )
+    return JsonResponse(response_serializer.data, status=status.HTTP_200_OK)
+
+
+@csrf_exempt
+@require_POST
+@observe_view
+async def cancel_subscription(request: HttpRequest) -> HttpResponse:
+    """
+    Ручка для отмены подписки
+
+    Можно отменить только активную подписку или подписку в past_due
+    """
+    user_uuid = request.GET.get("user_uuid", None)
+    if user_uuid is None:
+        return JsonResponse(
+            {"detail": "user_uuid is required"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    subscription = await Subscription.objects.filter(user_uuid=user_uuid).afirst()
+
+    if subscription is None:
+        return JsonResponse(
+            {"detail": "subscription not found"},
+            status=status.HTTP_404_NOT_FOUND,
+        )
+
+    if subscription.status not in ("active", "past_due"):
+        return JsonResponse(
+            {"detail": "subscription is not active or past_due"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    is_canceled = await async_logic.AsyncSubscriptionLogic.cancel_subscription(
+        subscription
+    )
+
+    if is_canceled is False:
+        return JsonResponse(
+            {"detail": "couldn't issue refund"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    return HttpResponse(status=status.HTTP_200_OK)
+
+
+@require_GET
+@observe_view
+async def get_subscription_by_user_uuid(request: HttpRequest) -> HttpResponse:
+    """
+    Ручка для получения подписки по user_uuid
+    """
+    user_uuid = request.GET.get("user_uuid", None)
+
+    if not user_uuid:
+        return JsonResponse(
+            {"detail": "user_uuid is required"}, status=status.HTTP_400_BAD_REQUEST
+        )
+
+    try:
+        user_uuid = uuid.UUID(user_uuid)
+    except ValueError:
+        return JsonResponse(
+            {"detail": "user_uuid is invalid"}, status=status.HTTP_400_BAD_REQUEST
+        )
+
+    subscription_data = await SubscriptionCache.aget(user_uuid)
+    if subscription_data is None:
+        return JsonResponse(
+            {"detail": "Subscription not found"}, status=status.HTTP_404_NOT_FOUND
+        )
+
+    return JsonResponse(subscription_data, status=status.HTTP_200_OK)
+
+
+def _parse_user_uuids(request: HttpRequest) -> list[str] | JsonResponse:
+    """Уникальные user_uuid запроса массовой проверки или ответ с ошибкой"""
+    request_serializer = serializers.CheckSubscriptionsRequestSerializer(
+        data=_parse_body(request),
+    )
+    if not request_serializer.is_valid():
+        return JsonResponse(
+            request_serializer.errors, status=status.HTTP_400_BAD_REQUEST
+        )
+
+    # Убираем дубли с сохранением порядка
+    return list(
+        dict.fromkeys(
+            str(user_uuid)
+            for user_uuid in request_serializer.validated_data["user_uuids"]
+        )
+    )
+
+
+@csrf_exempt
+@require_POST
+@observe_view
+async def check_subscriptions(request: HttpRequest) -> HttpResponse:
+    """
+    Ручка для массовой проверки подписок по списку user_uuid
+
+    Возвращает компактный словарь user_uuid -> {status, end_date, plan_id}
+    """
+    user_uuids = _parse_user_uuids(request)
+    if isinstance(user_uuids, JsonResponse):
+        return user_uuids
+
+    subscriptions = {}
+    chunk_size = settings.BULK_CHECK_CHUNK_SIZE
+    for i in range(0, len(user_uuids), chunk_size):
+        chunk = await SubscriptionCache.aget_many(user_uuids[i : i + chunk_size])
+        for user_uuid, data in chunk.items():
+            subscriptions[user_uuid] = (
+                {
+                    "status": data["status"],
+                    "end_date": data["end_date"],
+                    "plan_id": data["plan"],
+                }
+                if data is not None
+                else None
+            )
+
+    return JsonResponse({"subscriptions": subscriptions}, status=status.HTTP_200_OK)
+
+
+@csrf_exempt
+@require_POST
+@observe_view
+async def check_entitlements(request: HttpRequest) -> HttpResponse:
+    """
+    Ручка для массовой проверки доступа по списку user_uuid
+
+    Читает только таблицу entitlement, без кэша, подписок и платежей
+    """
+    user_uuids = _parse_user_uuids(request)
+    if isinstance(user_uuids, JsonResponse):
+        return user_uuids
+
+    entitlements = {}
+    chunk_size = settings.BULK_CHECK_CHUNK_SIZE
+    for i in range(0, len(user_uuids), chunk_size):
+        entitlements.update(
+            await logic.EntitlementLogic.aget_many(user_uuids[i : i + chunk_size])
+        )
+
+    # Даты в том же формате, что и в ответах DRF
+    return JsonResponse(
+        {"entitlements": entitlements},
+        encoder=JSONEncoder,
+        status=status.HTTP_200_OK,
+    )
+
+
+@csrf_exempt
+@require_POST
+@observe_view
+async def payment_notification(request: HttpRequest) -> HttpResponse:
+    """
+    Ручка для уведомления об оплате
+
+    Уведомление сохраняется и применяется асинхронно таской process_payment_events
+    """
+    notification = logic.PaymentEventLogic.parse_notification(request.body)
+    if notification is None:
+        return HttpResponse(status=status.HTTP_400_BAD_REQUEST)
+
+    event, yk_payment_id, payload = notification
+    is_new = await logic.PaymentEventLogic.astore_event(
+        event=event, yk_payment_id=yk_payment_id, payload=payload
+    )
+    if is_new:
+        # Уведомление уже сохранено (autocommit), таску можно ставить сразу
+        await sync_to_async(tasks.process_payment_events.delay)()
+
+    return HttpResponse(status=status.HTTP_200_OK)
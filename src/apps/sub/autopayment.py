@@ -0,0 +1,339 @@
+"""
+Пачечное продление подписок автоплатежами.
+
+Таска make_autopayment продлевает пачку подписок в три шага:
+1. одним запросом загружает подписки и сохраненные способы оплаты;
+2. списывает деньги параллельно через AsyncYooKassaClient, не более
+   AUTOPAYMENT_CONCURRENCY запросов одновременно и не быстрее общего для всех
+   воркеров лимита AUTOPAYMENT_RATE_LIMIT в Redis;
+3. применяет результаты к подпискам в БД.
+
+Каждое списание идет с ключом идемпотентности от подписки и периода, поэтому
+повторная обработка подписки (ретрай, падение воркера, истекшая блокировка
+свипа) не спишет деньги второй раз. Ключи сохраняются в provider_operation
+до первого запроса.
+
+Таска retry_autopayment так же повторяет списания подписок в past_due
+(DunningLogic): у каждой повторной попытки свой ключ идемпотентности.
+
+Ошибка ЮKassa 4xx или AUTOPAYMENT_MAX_ATTEMPTS временных ошибок подряд
+применяются как отказ банка (DunningLogic.error_payment_data), иначе подписка
+с неудачным списанием забиралась бы свипом и сохраняла доступ бесконечно.
+Повторы временной ошибки идут с тем же ключом, поэтому ни один из них
+не списал деньги, если ЮKassa ни разу не вернула платеж.
+"""
+
+import asyncio
+import logging
+import os
+from dataclasses import dataclass
+from datetime import datetime
+
+import redis.asyncio as redis
+from django.conf import settings
+from django.db.models import OuterRef, Subquery
+
+from lib.rate_limit import RedisTokenBucket
+from .async_logic import AsyncYooKassaClient
+from .cache import PlanCatalog
+from .logic import (
+    DunningLogic,
+    ProviderOperationLogic,
+    RenewalLogic,
+    SubscriptionLogic,
+)
+from .models import Payment, RenewalRetry, Subscription
+from .resilience import is_retryable
+
+logger = logging.getLogger("sub")
+
+
+@dataclass
+class AutopaymentJob:
+    subscription_id: int
+    user_uuid: str
+    period_end: datetime
+    amount: float
+    payment_method_id: str
+    # Повторная попытка после отказа: строка RenewalRetry и количество отказов
+    retry_id: int | None = None
+    attempt: int = 0
+    result: dict | None = None
+    error: Exception | None = None
+    # Ошибка окончательная: списание применяется как отказ
+    final: bool = False
+
+    @property
+    def reference(self) -> str:
+        return RenewalLogic.autopayment_reference(
+            self.subscription_id, self.period_end, self.attempt
+        )
+
+    @property
+    def idempotence_key(self) -> str:
+        return ProviderOperationLogic.make_key("autopayment", self.reference)
+
+
+class AutopaymentExecutor:
+    @classmethod
+    def run(cls, subscription_ids: list[int]) -> dict[str, int]:
+        """
+        Продлить пачку подписок.
+
+        :param subscription_ids: ID подписок, забранных свипом
+        :return: количество продленных, ожидающих подтверждения платежа (pending),
+            не продленных (отказ банка), остановленных подписок и ошибок
+        """
+        jobs, not_renewable = cls.prepare(subscription_ids)
+
+        stopped = 0
+        if not_renewable:
+            stopped = RenewalLogic.stop_subscriptions(not_renewable)
+
+        stats = {
+            "renewed": 0,
+            "pending": 0,
+            "cancelled": 0,
+            "stopped": stopped,
+            "failed": 0,
+        }
+        for job in cls.charge(jobs):
+            if job.error is not None:
+                stats["failed"] += 1
+                if job.final:
+                    SubscriptionLogic.apply_autopayment(
+                        job.subscription_id,
+                        job.period_end,
+                        job.payment_method_id,
+                        DunningLogic.error_payment_data(job.error),
+                    )
+                continue
+
+            payment = SubscriptionLogic.apply_autopayment(
+                job.subscription_id, job.period_end, job.payment_method_id, job.result
+            )
+            if payment is None:
+                stats["cancelled"] += 1
+            elif job.result["status"] == "succeeded":
+                stats["renewed"] += 1
+            else:
+                stats["pending"] += 1
+
+        return stats
+
+    @classmethod
+    def run_retries(cls, retry_ids: list[int]) -> dict[str, int]:
+        """
+        Повторить списания пачки подписок в past_due.
+
+        :param retry_ids: ID попыток RenewalRetry, забранных свипом
+        :return: количество попыток по новому статусу (recovered, scheduled,
+            failed, cancelled) и ошибок
+        """
+        jobs, cancelled, not_renewable = cls.prepare_retries(retry_ids)
+
+        stats = {"recovered": 0, "scheduled": 0, "failed": 0, "cancelled": 0}
+        if cancelled:
+            stats["cancelled"] += DunningLogic.finish_retries(
+                cancelled, cancel_subscriptions=False
+            )
+        if not_renewable:
+            stats["failed"] += DunningLogic.finish_retries(
+                not_renewable, cancel_subscriptions=True
+            )
+
+        stats["errors"] = 0
+        for job in cls.charge(jobs):
+            if job.error is not None:
+                stats["errors"] += 1
+                if job.final:
+                    status = DunningLogic.apply_retry(
+                        job.retry_id,
+                        job.attempt,
+                        job.payment_method_id,
+                        DunningLogic.error_payment_data(job.error),
+                    )
+                    stats[status] += 1
+                continue
+
+            status = DunningLogic.apply_retry(
+                job.retry_id, job.attempt, job.payment_method_id, job.result
+            )
+            stats[status] += 1
+
+        return stats
+
+    @classmethod
+    def charge(cls, jobs: list[AutopaymentJob]) -> list[AutopaymentJob]:
+        """
+        Списать деньги по заданиям и сохранить исход операций.
+
+        :return: те же задания с result или error
+        """
+        if not jobs:
+            return jobs
+
+        ProviderOperationLogic.start_many(
+            "autopayment", [job.reference for job in jobs]
+        )
+        asyncio.run(cls.charge_all(jobs))
+
+        failed = [job.reference for job in jobs if job.error is not None]
+        attempts = (
+            ProviderOperationLogic.attempts("autopayment", failed) if failed else {}
+        )
+        for job in jobs:
+            if job.error is not None:
+                # Временная ошибка: блокировка свипа истечет, и подписка будет
+                # забрана повторно с тем же ключом идемпотентности
+                job.final = (
+                    not is_retryable(job.error)
+                    or attempts.get(job.reference, 0)
+                    >= settings.AUTOPAYMENT_MAX_ATTEMPTS
+                )
+                logger.error(
+                    f"Ошибка автоплатежа по подписке {job.subscription_id}: {job.error!r}"
+                )
+                ProviderOperationLogic.finish(
+                    "autopayment", job.reference, error=job.error
+                )
+            else:
+                ProviderOperationLogic.finish(
+                    "autopayment", job.reference, yk_object_id=job.result["payment_id"]
+                )
+        return jobs
+
+    @classmethod
+    def prepare(
+        cls, subscription_ids: list[int]
+    ) -> tuple[list[AutopaymentJob], list[int]]:
+        """
+        Загрузить подписки пачки вместе с последним сохраненным способом оплаты.
+
+        :return: задания на списание и ID подписок, которые нельзя продлить
+        """
+        last_payment_method = (
+            Payment.objects.filter(
+                subscription=OuterRef("pk"), yk_payment_method_id__isnull=False
+            )
+            .order_by("-id")
+            .values("yk_payment_method_id")[:1]
+        )
+        subscriptions = Subscription.objects.filter(id__in=subscription_ids).annotate(
+            payment_method_id=Subquery(last_payment_method)
+        )
+
+        jobs = []
+        not_renewable = []
+        for subscription in subscriptions:
+            if subscription.status != "active":
+                continue
+            if not subscription.auto_renew or not subscription.payment_method_id:
+                logger.info(
+                    f"Подписка {subscription.pk} не может быть продлена автоматически"
+                )
+                not_renewable.append(subscription.pk)
+                continue
+
+            jobs.append(
+                AutopaymentJob(
+                    subscription_id=subscription.pk,
+                    user_uuid=str(subscription.user_uuid),
+                    period_end=subscription.end_date,
+                    amount=float(PlanCatalog.get(subscription.plan_id).price),
+                    payment_method_id=subscription.payment_method_id,
+                )
+            )
+        return jobs, not_renewable
+
+    @classmethod
+    def prepare_retries(
+        cls, retry_ids: list[int]
+    ) -> tuple[list[AutopaymentJob], list[int], list[int]]:
+        """
+        Загрузить попытки пачки вместе с подписками и способами оплаты.
+
+        :return: задания на списание, ID попыток, подписка которых уже вышла
+            из past_due, и ID попыток, подписку которых нечем продлить
+        """
+        last_payment_method = (
+            Payment.objects.filter(
+                subscription=OuterRef("subscription_id"),
+                yk_payment_method_id__isnull=False,
+            )
+            .order_by("-id")
+            .values("yk_payment_method_id")[:1]
+        )
+        retries = (
+            RenewalRetry.objects.filter(id__in=retry_ids, status="scheduled")
+            .select_related("subscription")
+            .annotate(payment_method_id=Subquery(last_payment_method))
+        )
+
+        jobs = []
+        cancelled = []
+        not_renewable = []
+        for retry in retries:
+            subscription = retry.subscription
+            if (
+                subscription.status != "past_due"
+                or subscription.end_date != retry.period_end
+            ):
+                cancelled.append(retry.pk)
+                continue
+            if not subscription.auto_renew or not retry.payment_method_id:
+                not_renewable.append(retry.pk)
+                continue
+
+            jobs.append(
+                AutopaymentJob(
+                    subscription_id=subscription.pk,
+                    user_uuid=str(subscription.user_uuid),
+                    period_end=retry.period_end,
+                    amount=float(PlanCatalog.get(subscription.plan_id).price),
+                    payment_method_id=retry.payment_method_id,
+                    retry_id=retry.pk,
+                    attempt=retry.attempts,
+                )
+            )
+        return jobs, cancelled, not_renewable
+
+    @classmethod
+    async def charge_all(cls, jobs: list[AutopaymentJob]) -> None:
+        semaphore = asyncio.Semaphore(settings.AUTOPAYMENT_CONCURRENCY)
+        redis_client = None
+        rate_limiter = None
+        if settings.AUTOPAYMENT_RATE_LIMIT > 0:
+            redis_client = redis.Redis.from_url(settings.AUTOPAYMENT_RATE_LIMIT_REDIS)
+            rate_limiter = RedisTokenBucket(
+                redis_client,
+                key="sub:rate_limit:yookassa_autopayment",
+                rate=settings.AUTOPAYMENT_RATE_LIMIT,
+                capacity=settings.AUTOPAYMENT_RATE_LIMIT_BURST,
+            )
+
+        async def charge(client: AsyncYooKassaClient, job: AutopaymentJob) -> None:
+            async with semaphore:
+                try:
+                    if rate_limiter is not None:
+                        await rate_limiter.acquire()
+                    job.result = await client.charge_autopayment(
+                        user_id=job.user_uuid,
+                        amount=job.amount,
+                        currency="RUB",
+                        payment_method_id=job.payment_method_id,
+                        description=f"Renew subscription {job.subscription_id} for user {job.user_uuid}",
+                        idempotence_key=job.idempotence_key,
+                    )
+                except Exception as e:
+                    job.error = e
+
+        try:
+            async with AsyncYooKassaClient(
+                os.getenv("YOOKASSA_ACCOUNT_ID", ""),
+                os.getenv("YOOKASSA_SECRET_KEY", ""),
+            ) as client:
+                await asyncio.gather(*(charge(client, job) for job in jobs))
+        finally:
+            if redis_client is not None:
+                await redis_client.aclose()
@@ -1,6 +1,11 @@
 import logging
+from datetime import timedelta
 
 from celery import shared_task
+from django.conf import settings
+from django.utils import timezone
+
+from . import logic, queues, tasks
 
 logger = logging.getLogger("sub")
 
@@ -9,3 +14,105 @@ logger = logging.getLogger("sub")
 def test_celery_work() -> None:
     # Пример использования провайдера
     logger.info(f"Hello, world! Settings timezone: asdasd")
+
+
+@shared_task
+def renewal_sweep() -> None:
+    """
+    Свип продления: забирает подписки с автопродлением и наступившим end_date
+    пачками и отправляет их в таски автоплатежа
+
+    Пачки автоплатежей отправляются в очередь, которую выбирает queues.charge_queue
+    """
+    renew_batch_size = settings.RENEWAL_TASK_BATCH_SIZE
+    claimed = 0
+
+    for _ in range(settings.RENEWAL_SWEEP_MAX_CHUNKS):
+        due = logic.RenewalLogic.claim_due_subscriptions()
+        if not due:
+            break
+        claimed += len(due)
+
+        # Списания раскладываем по очередям: приоритетной и шардам
+        now = timezone.now()
+        renew_ids: dict[str, list[int]] = {}
+        for row in due:
+            queue = queues.charge_queue(row.user_uuid, row.end_date, now)
+            renew_ids.setdefault(queue, []).append(row.id)
+
+        for queue, ids in renew_ids.items():
+            for i in range(0, len(ids), renew_batch_size):
+                tasks.make_autopayment.apply_async(
+                    (ids[i : i + renew_batch_size],), queue=queue
+                )
+
+    logger.info(f"Свип продления забрал подписок: {claimed}")
+
+
+@shared_task
+def expiry_sweep() -> None:
+    """
+    Свип истечения: переводит подписки без автопродления с наступившим end_date
+    в expired пачками, по одному UPDATE на пачку, без тасок на каждую подписку
+    """
+    chunk_size = settings.EXPIRY_SWEEP_CHUNK_SIZE
+    expired = 0
+
+    for _ in range(settings.RENEWAL_SWEEP_MAX_CHUNKS):
+        chunk = logic.RenewalLogic.expire_due_subscriptions(chunk_size)
+        expired += chunk
+        if chunk < chunk_size:
+            break
+
+    if expired:
+        logger.info(f"Свип истечения остановил подписок: {expired}")
+
+
+@shared_task
+def dunning_sweep() -> None:
+    """
+    Свип повторных списаний: забирает попытки подписок в past_due
+    с наступившим next_retry_at пачками и отправляет их в таску retry_autopayment
+    """
+    retry_batch_size = settings.RENEWAL_TASK_BATCH_SIZE
+    claimed = 0
+
+    for _ in range(settings.RENEWAL_SWEEP_MAX_CHUNKS):
+        due = logic.DunningLogic.claim_due_retries()
+        if not due:
+            break
+        claimed += len(due)
+
+        now = timezone.now()
+        retry_ids: dict[str, list[int]] = {}
+        for row in due:
+            queue = queues.retry_queue(row.user_uuid, row.grace_until, now)
+            retry_ids.setdefault(queue, []).append(row.id)
+
+        for queue, ids in retry_ids.items():
+            for i in range(0, len(ids), retry_batch_size):
+                tasks.retry_autopayment.apply_async(
+                    (ids[i : i + retry_batch_size],), queue=queue
+                )
+
+    logger.info(f"Свип повторных списаний забрал попыток: {claimed}")
+
+
+@shared_task
+def cleanup_provider_operations() -> None:
+    """
+    Удаляет завершенные операции в ЮKassa старше PROVIDER_OPERATION_RETENTION_DAYS
+    пачками, чтобы provider_operation не росла бесконечно
+    """
+    chunk_size = settings.PROVIDER_OPERATION_CLEANUP_CHUNK_SIZE
+    before = timezone.now() - timedelta(days=settings.PROVIDER_OPERATION_RETENTION_DAYS)
+    deleted = 0
+
+    for _ in range(settings.RENEWAL_SWEEP_MAX_CHUNKS):
+        chunk = logic.ProviderOperationLogic.delete_finished(before, chunk_size)
+        deleted += chunk
+        if chunk < chunk_size:
+            break
+
+    if deleted:
+        logger.info(f"Удалено операций в ЮKassa: {deleted}")
@@ -0,0 +1,496 @@
+import asyncio
+import logging
+import time
+import uuid
+from typing import Iterable
+
+from asgiref.sync import sync_to_async
+from celery import signals
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from redis import RedisError
+
+from .metrics import SUBSCRIPTION_CACHE_REQUESTS
+from .models import Plan, Subscription
+from . import serializers
+
+logger = logging.getLogger("sub")
+
+# Отметка в кэше о том, что у пользователя нет подписки
+NOT_FOUND = "not_found"
+
+
+class SubscriptionCache:
+    """
+    Read-through кэш подписок по user_uuid.
+
+    Хранит сериализованную подписку (SubscriptionRequestSerializer) в Redis.
+    Для неизвестных пользователей кэшируется отметка NOT_FOUND с коротким TTL.
+    Все места, меняющие status/end_date подписки, обязаны вызывать invalidate.
+
+    Запись хранится вместе с версией пользователя, прочитанной до запроса в БД,
+    а invalidate меняет версию. Запись, которую чтение положило уже после
+    коммита изменения (данные прочитаны из БД до него), не совпадет с новой
+    версией и будет считаться промахом, а не отдаваться до истечения TTL.
+
+    Недоступный Redis не ломает чтение: подписки читаются из БД без записи
+    в кэш, ошибки считаются в метрике с результатом error. Не смененная из-за
+    ошибки Redis версия только логируется: запись с прежней версией будет
+    отдаваться до истечения TTL.
+    """
+
+    key_prefix = "sub:subscription:"
+    version_prefix = "sub:subscription_version:"
+
+    @classmethod
+    def make_key(cls, user_uuid: object) -> str:
+        return f"{cls.key_prefix}{user_uuid}"
+
+    @classmethod
+    def make_version_key(cls, user_uuid: object) -> str:
+        return f"{cls.version_prefix}{user_uuid}"
+
+    @classmethod
+    def get(cls, user_uuid: str) -> dict | None:
+        """
+        Получить подписку пользователя из кэша или из БД.
+
+        :param user_uuid: UUID пользователя
+        :return: сериализованная подписка или None, если подписки нет
+        """
+        key, version_key = cls.make_key(user_uuid), cls.make_version_key(user_uuid)
+
+        cached = cls._read([key, version_key])
+        if cached is not None:
+            version = cached.get(version_key)
+            entry = cached.get(key)
+            if cls._is_current(entry, version):
+                SUBSCRIPTION_CACHE_REQUESTS.labels("hit").inc()
+                return cls._unpack(entry)
+
+            SUBSCRIPTION_CACHE_REQUESTS.labels("miss").inc()
+
+        subscription = Subscription.objects.filter(user_uuid=user_uuid).first()
+        if subscription is None:
+            if cached is not None:
+                cls._write(
+                    {key: (version, NOT_FOUND)},
+                    settings.SUBSCRIPTION_CACHE_NEGATIVE_TTL,
+                )
+            return None
+
+        data = dict(serializers.SubscriptionRequestSerializer(subscription).data)
+        if cached is not None:
+            cls._write({key: (version, data)}, settings.SUBSCRIPTION_CACHE_TTL)
+        return data
+
+    @classmethod
+    def get_many(cls, user_uuids: list[str]) -> dict[str, dict | None]:
+        """
+        Получить подписки пачки пользователей: сначала multi-get из кэша,
+        промахи - одним запросом в БД по уникальному индексу user_uuid.
+
+        :param user_uuids: UUID пользователей (строки в каноническом виде)
+        :return: словарь UUID -> сериализованная подписка или None
+        """
+        result, versions = cls._split(user_uuids, cls._read(cls._keys(user_uuids)))
+        missed = [user_uuid for user_uuid in user_uuids if user_uuid not in result]
+        if not missed:
+            return result
+
+        subscriptions = Subscription.objects.filter(user_uuid__in=missed)
+        found = {
+            data["user_uuid"]: dict(data)
+            for data in serializers.SubscriptionRequestSerializer(
+                subscriptions, many=True
+            ).data
+        }
+        not_found = [user_uuid for user_uuid in missed if user_uuid not in found]
+
+        if found and versions is not None:
+            cls._write(cls._entries(found, versions), settings.SUBSCRIPTION_CACHE_TTL)
+        if not_found and versions is not None:
+            cls._write(
+                cls._entries(dict.fromkeys(not_found, NOT_FOUND), versions),
+                settings.SUBSCRIPTION_CACHE_NEGATIVE_TTL,
+            )
+
+        result.update(found)
+        result.update(dict.fromkeys(not_found))
+        return result
+
+    @classmethod
+    def invalidate(cls, user_uuid: object) -> None:
+        """
+        Сменить версию подписки пользователя в кэше после коммита текущей
+        транзакции.
+
+        :param user_uuid: UUID пользователя
+        """
+        versions = cls._new_versions([user_uuid])
+        transaction.on_commit(lambda: cls._set_versions(versions))
+
+    @classmethod
+    def invalidate_many(cls, user_uuids: Iterable[object]) -> None:
+        """
+        Сменить версии подписок пачки пользователей после коммита текущей
+        транзакции.
+
+        :param user_uuids: UUID пользователей
+        """
+        versions = cls._new_versions(user_uuids)
+        if versions:
+            transaction.on_commit(lambda: cls._set_versions(versions))
+
+    @classmethod
+    async def aget(cls, user_uuid: str) -> dict | None:
+        """Асинхронная версия get"""
+        key, version_key = cls.make_key(user_uuid), cls.make_version_key(user_uuid)
+
+        cached = await cls._aread([key, version_key])
+        if cached is not None:
+            version = cached.get(version_key)
+            entry = cached.get(key)
+            if cls._is_current(entry, version):
+                SUBSCRIPTION_CACHE_REQUESTS.labels("hit").inc()
+                return cls._unpack(entry)
+
+            SUBSCRIPTION_CACHE_REQUESTS.labels("miss").inc()
+
+        subscription = await Subscription.objects.filter(user_uuid=user_uuid).afirst()
+        if subscription is None:
+            if cached is not None:
+                await cls._awrite(
+                    {key: (version, NOT_FOUND)},
+                    settings.SUBSCRIPTION_CACHE_NEGATIVE_TTL,
+                )
+            return None
+
+        data = dict(serializers.SubscriptionRequestSerializer(subscription).data)
+        if cached is not None:
+            await cls._awrite({key: (version, data)}, settings.SUBSCRIPTION_CACHE_TTL)
+        return data
+
+    @classmethod
+    async def aget_many(cls, user_uuids: list[str]) -> dict[str, dict | None]:
+        """Асинхронная версия get_many"""
+        result, versions = cls._split(
+            user_uuids, await cls._aread(cls._keys(user_uuids))
+        )
+        missed = [user_uuid for user_uuid in user_uuids if user_uuid not in result]
+        if not missed:
+            return result
+
+        found = {
+            data["user_uuid"]: dict(data)
+            for data in serializers.SubscriptionRequestSerializer(
+                [
+                    subscription
+                    async for subscription in Subscription.objects.filter(
+                        user_uuid__in=missed
+                    )
+                ],
+                many=True,
+            ).data
+        }
+        not_found = [user_uuid for user_uuid in missed if user_uuid not in found]
+
+        if found and versions is not None:
+            await cls._awrite(
+                cls._entries(found, versions), settings.SUBSCRIPTION_CACHE_TTL
+            )
+        if not_found and versions is not None:
+            await cls._awrite(
+                cls._entries(dict.fromkeys(not_found, NOT_FOUND), versions),
+                settings.SUBSCRIPTION_CACHE_NEGATIVE_TTL,
+            )
+
+        result.update(found)
+        result.update(dict.fromkeys(not_found))
+        return result
+
+    @classmethod
+    async def ainvalidate(cls, user_uuid: object) -> None:
+        """
+        Сменить версию подписки пользователя в async коде (вне транзакции).
+
+        :param user_uuid: UUID пользователя
+        """
+        versions = cls._new_versions([user_uuid])
+        try:
+            await cache.aset_many(versions, cls._version_timeout())
+        except RedisError:
+            cls._log_version_error(versions)
+
+    @staticmethod
+    def _is_current(entry: object, version: str | None) -> bool:
+        # Записи без версии (старый формат) считаются промахом
+        return isinstance(entry, tuple) and entry[0] == version
+
+    @staticmethod
+    def _unpack(entry: tuple) -> dict | None:
+        data = entry[1]
+        return None if data == NOT_FOUND else data
+
+    @classmethod
+    def _keys(cls, user_uuids: list[str]) -> list[str]:
+        return [cls.make_key(user_uuid) for user_uuid in user_uuids] + [
+            cls.make_version_key(user_uuid) for user_uuid in user_uuids
+        ]
+
+    @classmethod
+    def _split(
+        cls, user_uuids: list[str], cached: dict | None
+    ) -> tuple[dict[str, dict | None], dict[str, str | None] | None]:
+        """
+        Разобрать multi-get: актуальные записи и версии пользователей.
+
+        Счетчики попаданий и промахов обновляются здесь. Если Redis
+        не ответил (cached is None), записей и версий нет.
+        """
+        if cached is None:
+            return {}, None
+
+        result: dict[str, dict | None] = {}
+        versions: dict[str, str | None] = {}
+        for user_uuid in user_uuids:
+            version = cached.get(cls.make_version_key(user_uuid))
+            entry = cached.get(cls.make_key(user_uuid))
+            versions[user_uuid] = version
+            if cls._is_current(entry, version):
+                result[user_uuid] = cls._unpack(entry)
+
+        SUBSCRIPTION_CACHE_REQUESTS.labels("hit").inc(len(result))
+        SUBSCRIPTION_CACHE_REQUESTS.labels("miss").inc(len(user_uuids) - len(result))
+        return result, versions
+
+    @classmethod
+    def _read(cls, keys: list[str]) -> dict | None:
+        try:
+            return cache.get_many(keys)
+        except RedisError:
+            cls._log_read_error(keys)
+            return None
+
+    @classmethod
+    async def _aread(cls, keys: list[str]) -> dict | None:
+        try:
+            return await cache.aget_many(keys)
+        except RedisError:
+            cls._log_read_error(keys)
+            return None
+
+    @staticmethod
+    def _write(entries: dict[str, tuple], timeout: int) -> None:
+        try:
+            cache.set_many(entries, timeout)
+        except RedisError:
+            logger.warning("Подписки не записаны в кэш", exc_info=True)
+
+    @staticmethod
+    async def _awrite(entries: dict[str, tuple], timeout: int) -> None:
+        try:
+            await cache.aset_many(entries, timeout)
+        except RedisError:
+            logger.warning("Подписки не записаны в кэш", exc_info=True)
+
+    @classmethod
+    def _set_versions(cls, versions: dict[str, str]) -> None:
+        # Вызывается в on_commit: ошибка Redis не должна прерывать
+        # остальные колбэки транзакции
+        try:
+            cache.set_many(versions, cls._version_timeout())
+        except RedisError:
+            cls._log_version_error(versions)
+
+    @staticmethod
+    def _log_read_error(keys: list[str]) -> None:
+        # На каждого пользователя две записи: подписка и версия
+        SUBSCRIPTION_CACHE_REQUESTS.labels("error").inc(len(keys) // 2)
+        logger.warning("Кэш подписок недоступен, чтение из БД", exc_info=True)
+
+    @staticmethod
+    def _log_version_error(versions: dict[str, str]) -> None:
+        logger.error(
+            f"Версии подписок в кэше не сменены: {', '.join(versions)}", exc_info=True
+        )
+
+    @classmethod
+    def _entries(cls, data: dict[str, object], versions: dict) -> dict[str, tuple]:
+        return {
+            cls.make_key(user_uuid): (versions.get(user_uuid), value)
+            for user_uuid, value in data.items()
+        }
+
+    @classmethod
+    def _new_versions(cls, user_uuids: Iterable[object]) -> dict[str, str]:
+        return {
+            cls.make_version_key(user_uuid): uuid.uuid4().hex
+            for user_uuid in user_uuids
+        }
+
+    @staticmethod
+    def _version_timeout() -> int:
+        # Версия живет дольше записей, положенных до ее смены, иначе
+        # устаревшая запись с версией None снова совпала бы с отсутствующей
+        return 2 * settings.SUBSCRIPTION_CACHE_TTL
+
+
+class PlanCatalog:
+    """
+    Справочник тарифных планов в памяти процесса.
+
+    Планов мало и они редко меняются, поэтому каждый процесс (gunicorn, uvicorn,
+    celery) держит их все в памяти и отдает без запросов в БД. Изменение Plan
+    меняет версию справочника в Redis (сигналы ниже), процессы сверяют версию
+    не чаще раза в PLAN_CATALOG_CHECK_INTERVAL секунд и перечитывают планы.
+    Измененный план процесс может отдавать по-старому не дольше
+    PLAN_CATALOG_CHECK_INTERVAL, новый план находится сразу.
+
+    Справочник загружается при старте процесса (warm): в asgi.py, wsgi.py
+    и в дочерних процессах prefork-воркеров Celery. В остальных процессах
+    (runscript, пулы threads и gevent) он загружается при первом get.
+
+    Пока Redis недоступен, процесс отдает загруженный справочник (без него -
+    загружает планы из БД) и сверяет версию снова через
+    PLAN_CATALOG_CHECK_INTERVAL.
+
+    Объекты Plan общие для всех потоков процесса, изменять их нельзя.
+    """
+
+    version_key = "sub:plans:version"
+
+    _plans: dict[int, Plan] = {}
+    _version: str | None = None
+    _checked_at = float("-inf")
+
+    @classmethod
+    def get(cls, plan_id: int) -> Plan | None:
+        """
+        Получить план по ID.
+
+        :param plan_id: ID тарифного плана
+        :return: план или None, если такого плана нет
+        """
+        if cls._is_check_due():
+            cls._refresh(cls._read_version())
+        plan = cls._plans.get(int(plan_id))
+        if plan is None:
+            # План мог появиться после последней сверки версии. Запрос в БД
+            # будет, только если версия изменилась
+            cls._refresh(cls._read_version())
+            plan = cls._plans.get(int(plan_id))
+        return plan
+
+    @classmethod
+    async def aget(cls, plan_id: int) -> Plan | None:
+        """Асинхронная версия get"""
+        if cls._is_check_due():
+            await sync_to_async(cls._refresh)(await cls._aread_version())
+        plan = cls._plans.get(int(plan_id))
+        if plan is None:
+            await sync_to_async(cls._refresh)(await cls._aread_version())
+            plan = cls._plans.get(int(plan_id))
+        return plan
+
+    @classmethod
+    def warm(cls) -> None:
+        """
+        Загрузить справочник при старте процесса, чтобы первый запрос не ждал БД.
+
+        Недоступная БД не мешает старту: справочник загрузится при первом get. Внутри запущенного event loop (uvicorn без gunicorn
+        импортирует приложение уже в нем) синхронный ORM недоступен, загрузку
+        выполнит первый aget.
+        """
+        try:
+            asyncio.get_running_loop()
+            return
+        except RuntimeError:
+            pass
+
+        try:
+            cls._refresh(cls._read_version())
+        except DatabaseError:
+            logger.warning("Справочник планов не загружен при старте", exc_info=True)
+
+    @classmethod
+    def invalidate(cls) -> None:
+        """
+        Сменить версию справочника во всех процессах после коммита текущей транзакции.
+        """
+
+        def bump() -> None:
+            cls._checked_at = float("-inf")
+            try:
+                cache.set(cls.version_key, uuid.uuid4().hex, timeout=None)
+            except RedisError:
+                # Другие процессы увидят изменение только после следующей
+                # смены версии
+                logger.error("Версия справочника планов не сменена", exc_info=True)
+
+        transaction.on_commit(bump)
+
+    @classmethod
+    def _is_check_due(cls) -> bool:
+        return (
+            time.monotonic() - cls._checked_at >= settings.PLAN_CATALOG_CHECK_INTERVAL
+        )
+
+    @classmethod
+    def _read_version(cls) -> str | None:
+        """Версия справочника или None, если Redis недоступен"""
+        try:
+            version = cache.get(cls.version_key)
+            if version is None:
+                # Версии еще нет: первый процесс после очистки Redis
+                cache.add(cls.version_key, uuid.uuid4().hex, timeout=None)
+                version = cache.get(cls.version_key)
+            return version
+        except RedisError:
+            logger.warning("Версия справочника планов не прочитана", exc_info=True)
+            return None
+
+    @classmethod
+    async def _aread_version(cls) -> str | None:
+        """Асинхронная версия _read_version"""
+        try:
+            version = await cache.aget(cls.version_key)
+            if version is None:
+                await cache.aadd(cls.version_key, uuid.uuid4().hex, timeout=None)
+                version = await cache.aget(cls.version_key)
+            return version
+        except RedisError:
+            logger.warning("Версия справочника планов не прочитана", exc_info=True)
+            return None
+
+    @classmethod
+    def _refresh(cls, version: str | None) -> None:
+        if version is None:
+            # Redis недоступен: загруженный справочник остается как есть,
+            # без него планы читаются из БД. Версия процесса остается None,
+            # и первая удачная сверка перечитает планы
+            if cls._version is None:
+                cls._plans = {plan.pk: plan for plan in Plan.objects.all()}
+            cls._checked_at = time.monotonic()
+            return
+
+        if version != cls._version:
+            # Версия читается до загрузки: изменение во время загрузки
+            # сменит версию, и следующая сверка перечитает планы
+            cls._plans = {plan.pk: plan for plan in Plan.objects.all()}
+            cls._version = version
+        cls._checked_at = time.monotonic()
+
+
+@receiver(post_save, sender=Plan)
+@receiver(post_delete, sender=Plan)
+def invalidate_plan_catalog(**kwargs) -> None:
+    PlanCatalog.invalidate()
+
+
+@signals.worker_process_init.connect
+def warm_plan_catalog(**kwargs) -> None:
+    PlanCatalog.warm()
@@ -1,2 +1,19 @@
 class SubAppError(Exception):
     """Базовый класс ошибки приложения Sub"""
+
+
+class YooKassaError(SubAppError):
+    """Ошибка ответа API ЮKassa"""
+
+    def __init__(self, status_code: int, content: dict | str):
+        self.status_code = status_code
+        self.content = content
+        super().__init__(f"YooKassa API error {status_code}: {content}")
+
+
+class CircuitOpenError(SubAppError):
+    """Запросы к провайдеру временно остановлены circuit breaker"""
+
+    def __init__(self, name: str):
+        self.name = name
+        super().__init__(f"Circuit breaker {name} is open")
@@ -0,0 +1,328 @@
+"""
+Потоковая выгрузка подписок и платежей для аналитики.
+
+Строки читаются серверным курсором (QuerySet.iterator) и сразу пишутся
+в выходной поток, поэтому память не зависит от размера выгрузки.
+Форматы: csv, ndjson и parquet (нужен pyarrow, extra "parquet").
+
+Под ASGI ответ отдается через Export.astream(): StreamingHttpResponse
+с синхронным итератором сначала читает его целиком в память.
+
+Инкрементальная выгрузка идет по водяному знаку: since - значение поля
+watermark последней выгруженной строки. Строки моложе EXPORT_WATERMARK_LAG_SECONDS
+не выгружаются: транзакция со строкой с более ранним значением поля могла еще
+не закоммититься, и следующая выгрузка с since пропустила бы ее.
+"""
+
+import csv
+import json
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import AsyncIterator, Iterable, Iterator
+from uuid import UUID
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection, models
+from django.utils import timezone
+
+from .models import Payment, Subscription, SubscriptionEvent
+
+# Сколько байт выгрузки читается за один переход в поток sync_to_async
+ASYNC_READ_BYTES = 64 * 1024
+
+
+@dataclass(frozen=True)
+class Dataset:
+    model: type[models.Model]
+    # Поле водяного знака инкрементальной выгрузки
+    watermark: str
+    # Поле и тип колонки parquet
+    fields: tuple[tuple[str, str], ...]
+
+    @property
+    def field_names(self) -> list[str]:
+        return [name for name, _ in self.fields]
+
+
+DATASETS = {
+    "subscriptions": Dataset(
+        model=Subscription,
+        watermark="created_at",
+        fields=(
+            ("id", "int64"),
+            ("user_uuid", "string"),
+            ("plan_id", "int64"),
+            ("status", "string"),
+            ("start_date", "timestamp"),
+            ("end_date", "timestamp"),
+            ("auto_renew", "bool"),
+            ("created_at", "timestamp"),
+        ),
+    ),
+    "payments": Dataset(
+        model=Payment,
+        watermark="payment_date",
+        fields=(
+            ("id", "int64"),
+            ("subscription_id", "int64"),
+            ("user_uuid", "string"),
+            ("amount", "decimal"),
+            ("payment_date", "timestamp"),
+            ("yk_payment_id", "string"),
+            ("yk_payment_method_id", "string"),
+        ),
+    ),
+    # События подписок для внешних потребителей
+    "subscription_events": Dataset(
+        model=SubscriptionEvent,
+        watermark="created_at",
+        fields=(
+            ("id", "int64"),
+            ("event", "string"),
+            ("subscription_id", "int64"),
+            ("user_uuid", "string"),
+            ("plan_id", "int64"),
+            ("end_date", "timestamp"),
+            ("created_at", "timestamp"),
+        ),
+    ),
+}
+
+FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+class ExportError(ValueError):
+    """Неверные параметры выгрузки"""
+
+
+def iter_rows(
+    dataset: Dataset, since: datetime | None = None, chunk_size: int | None = None
+) -> Iterator[tuple]:
+    """
+    Строки выгрузки в порядке водяного знака.
+
+    :param since: выгрузить строки с водяным знаком строго больше since
+    :param chunk_size: сколько строк читается из курсора за раз
+    """
+    if chunk_size is None:
+        chunk_size = settings.EXPORT_CHUNK_SIZE
+
+    until = timezone.now() - timedelta(seconds=settings.EXPORT_WATERMARK_LAG_SECONDS)
+    queryset = dataset.model.objects.filter(**{f"{dataset.watermark}__lte": until})
+    if since is not None:
+        queryset = queryset.filter(**{f"{dataset.watermark}__gt": since})
+    queryset = queryset.order_by(dataset.watermark, "id").values_list(
+        *dataset.field_names
+    )
+
+    if not connection.settings_dict.get("DISABLE_SERVER_SIDE_CURSORS"):
+        yield from queryset.iterator(chunk_size=chunk_size)
+        return
+
+    # Через PgBouncer серверные курсоры отключены, а обычный курсор psycopg
+    # читает весь результат в память. Читаем страницами по (watermark, id)
+    watermark_index = dataset.field_names.index(dataset.watermark)
+    id_index = dataset.field_names.index("id")
+    page = list(queryset[:chunk_size])
+    while page:
+        yield from page
+        last = page[-1]
+        page = list(
+            queryset.filter(
+                models.Q(**{f"{dataset.watermark}__gt": last[watermark_index]})
+                | models.Q(
+                    **{
+                        dataset.watermark: last[watermark_index],
+                        "id__gt": last[id_index],
+                    }
+                )
+            )[:chunk_size]
+        )
+
+
+def _plain(value: object) -> object:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (UUID, Decimal)):
+        return str(value)
+    return value
+
+
+class _Echo:
+    """Файл для csv.writer, который возвращает записанную строку"""
+
+    def write(self, value: str) -> str:
+        return value
+
+
+def render_csv(dataset: Dataset, rows: Iterable[tuple]) -> Iterator[bytes]:
+    writer = csv.writer(_Echo())
+    yield writer.writerow(dataset.field_names).encode()
+    for row in rows:
+        yield writer.writerow([_plain(value) for value in row]).encode()
+
+
+def render_ndjson(dataset: Dataset, rows: Iterable[tuple]) -> Iterator[bytes]:
+    names = dataset.field_names
+    for row in rows:
+        yield (
+            json.dumps(
+                {name: _plain(value) for name, value in zip(names, row)},
+                ensure_ascii=False,
+            )
+            + "\n"
+        ).encode()
+
+
+class _Chunks:
+    """Файл для ParquetWriter, который копит записанные байты до выдачи"""
+
+    def __init__(self):
+        self.chunks: list[bytes] = []
+        self.closed = False
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def render_parquet(
+    dataset: Dataset, rows: Iterable[tuple], chunk_size: int | None = None
+) -> Iterator[bytes]:
+    """Parquet по одной row group на chunk_size строк"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if chunk_size is None:
+        chunk_size = settings.EXPORT_CHUNK_SIZE
+
+    types = {
+        "int64": pa.int64(),
+        "string": pa.string(),
+        "bool": pa.bool_(),
+        "decimal": pa.decimal128(10, 2),
+        "timestamp": pa.timestamp("us", tz="UTC"),
+    }
+    schema = pa.schema([(name, types[kind]) for name, kind in dataset.fields])
+    string_columns = [kind == "string" for _, kind in dataset.fields]
+
+    sink = _Chunks()
+    writer = pq.ParquetWriter(sink, schema)
+
+    def write(batch: list[tuple]) -> bytes:
+        columns = [
+            (
+                [str(value) if value is not None else None for value in column]
+                if is_string
+                else list(column)
+            )
+            for column, is_string in zip(zip(*batch), string_columns)
+        ]
+        writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+        return sink.drain()
+
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= chunk_size:
+            yield write(batch)
+            batch = []
+    if batch:
+        yield write(batch)
+    writer.close()
+    yield sink.drain()
+
+
+class Export:
+    """
+    Выгрузка набора данных.
+
+    stream() отдает байты выгрузки, после его окончания watermark - водяной
+    знак последней выгруженной строки, since для следующей выгрузки.
+    """
+
+    def __init__(
+        self, dataset_name: str, export_format: str, since: datetime | None = None
+    ):
+        """
+        :param dataset_name: subscriptions, payments или subscription_events
+        :param export_format: csv, ndjson или parquet
+        :param since: водяной знак прошлой выгрузки
+        """
+        self.dataset = DATASETS.get(dataset_name)
+        if self.dataset is None:
+            raise ExportError(f"Неизвестный набор данных {dataset_name}")
+        if export_format not in FORMATS:
+            raise ExportError(f"Неизвестный формат {export_format}")
+        if export_format == "parquet":
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                raise ExportError("Для parquet нужен pyarrow") from None
+
+        self.export_format = export_format
+        self.content_type = FORMATS[export_format]
+        if since is not None and timezone.is_naive(since):
+            since = timezone.make_aware(since)
+        self.since = since
+        self.watermark = since
+        self.rows_count = 0
+
+    def rows(self) -> Iterator[tuple]:
+        watermark_index = self.dataset.field_names.index(self.dataset.watermark)
+        for row in iter_rows(self.dataset, self.since):
+            self.watermark = row[watermark_index]
+            self.rows_count += 1
+            yield row
+
+    def stream(self) -> Iterator[bytes]:
+        if self.export_format == "csv":
+            return render_csv(self.dataset, self.rows())
+        if self.export_format == "ndjson":
+            return render_ndjson(self.dataset, self.rows())
+        return render_parquet(self.dataset, self.rows())
+
+    async def astream(self) -> AsyncIterator[bytes]:
+        """
+        stream() для ASGI: куски читаются в потоке sync_to_async пачками
+        по ASYNC_READ_BYTES и сразу отдаются клиенту.
+
+        Все чтения идут в одном потоке (thread_sensitive), поэтому курсор
+        остается на том же соединении с БД.
+        """
+        chunks = self.stream()
+
+        def read() -> bytes | None:
+            data = []
+            size = 0
+            for chunk in chunks:
+                data.append(chunk)
+                size += len(chunk)
+                if size >= ASYNC_READ_BYTES:
+                    return b"".join(data)
+            # Выгрузка закончилась
+            return b"".join(data) if data else None
+
+        try:
+            while (data := await sync_to_async(read)()) is not None:
+                yield data
+        finally:
+            # Клиент мог отключиться раньше: закрываем генератор и курсор
+            await sync_to_async(chunks.close)()
@@ -0,0 +1,341 @@
+"""
+Массовый импорт подписок партнеров.
+
+Импорт загружает тарифные планы, подписки, сохраненные способы оплаты и
+расписание продлений без запросов в ЮKassa. Подписки пишутся пачками по
+IMPORT_BATCH_SIZE: один запрос на проверку уже существующих user_uuid
+и bulk_create подписок, платежей и доступов в одной транзакции на пачку.
+
+Сохраненный способ оплаты записывается платежом на нулевую сумму с
+yk_payment_method_id и ID платежа с префиксом IMPORTED_PAYMENT_PREFIX (в ЮKassa
+такого платежа нет). Его находит AutopaymentExecutor при продлении, как
+способ оплаты последнего платежа подписки.
+
+Отдельного расписания продлений нет: активная подписка с auto_renew
+продлевается свипом RenewalLogic, когда подходит ее end_date. Поэтому
+импорт не создает периодических задач.
+
+Подписки с user_uuid, который уже встречался в файле или есть в БД,
+пропускаются. Подписки пользователей, чей способ оплаты уже импортировался
+(платеж с тем же ID есть в БД), тоже пропускаются и попадают в отчет.
+Невалидные строки пропускаются, первые MAX_ERRORS ошибок попадают в отчет.
+"""
+
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from typing import Iterable
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .cache import PlanCatalog, SubscriptionCache
+from .logic import EntitlementLogic
+from .models import Entitlement, Payment, Plan, Subscription
+
+# Статусы, в которых можно импортировать подписку. pending ждет платежа,
+# которого при импорте нет
+IMPORT_STATUSES = {"active", "expired", "cancelled"}
+
+# Префикс ID платежей, которыми импортированы сохраненные способы оплаты
+IMPORTED_PAYMENT_PREFIX = "import:"
+
+# Сколько ошибок валидации сохраняется в отчете
+MAX_ERRORS = 100
+
+
+def imported_payment_id(user_uuid: uuid.UUID) -> str:
+    """ID платежа, которым импортирован сохраненный способ оплаты пользователя"""
+    return f"{IMPORTED_PAYMENT_PREFIX}{user_uuid}"
+
+
+class ImportRowError(ValueError):
+    """Невалидная строка импорта"""
+
+
+@dataclass
+class ImportReport:
+    rows: int = 0
+    imported: int = 0
+    invalid: int = 0
+    # user_uuid уже встречался в файле
+    duplicates: int = 0
+    # Подписка пользователя уже есть в БД
+    existing: int = 0
+    # Способ оплаты пользователя уже импортировался
+    imported_before: int = 0
+    plans_created: int = 0
+    payment_methods: int = 0
+    elapsed: float = 0.0
+    errors: list[str] = field(default_factory=list)
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def add_error(self, line: int, error: Exception) -> None:
+        self.invalid += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append(f"строка {line}: {error}")
+
+
+def _required(row: dict, name: str) -> str:
+    value = (row.get(name) or "").strip()
+    if not value:
+        raise ImportRowError(f"не заполнено поле {name}")
+    return value
+
+
+def _parse_datetime(row: dict, name: str) -> datetime:
+    value = _required(row, name)
+    try:
+        parsed = parse_datetime(value)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ImportRowError(f"неверная дата {name}: {value}")
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def _parse_decimal(row: dict, name: str) -> Decimal:
+    value = _required(row, name)
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        raise ImportRowError(f"неверное число {name}: {value}") from None
+
+
+def _parse_int(row: dict, name: str) -> int:
+    value = _required(row, name)
+    try:
+        return int(value)
+    except ValueError:
+        raise ImportRowError(f"неверное число {name}: {value}") from None
+
+
+def _parse_bool(row: dict, name: str) -> bool:
+    value = (row.get(name) or "").strip().lower()
+    if value in ("", "0", "false", "no"):
+        return False
+    if value in ("1", "true", "yes"):
+        return True
+    raise ImportRowError(f"неверное значение {name}: {value}")
+
+
+class SubscriptionImport:
+    def __init__(self, dry_run: bool = False, batch_size: int | None = None):
+        """
+        :param dry_run: только проверить файл: строки валидируются и сверяются
+            с БД, но ничего не записывается
+        :param batch_size: подписок в пачке, по умолчанию IMPORT_BATCH_SIZE
+        """
+        self.dry_run = dry_run
+        self.batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+        self.report = ImportReport()
+        # Планы по названию, в dry run у новых планов нет ID
+        self.plans: dict[str, int | None] = {}
+        self.seen: set[uuid.UUID] = set()
+
+    def run(
+        self, plan_rows: Iterable[dict], subscription_rows: Iterable[dict]
+    ) -> ImportReport:
+        """
+        Импортировать планы, затем подписки.
+
+        :param plan_rows: строки планов: name, price, days
+        :param subscription_rows: строки подписок: user_uuid, plan (название),
+            status, start_date, end_date, auto_renew, payment_method_id
+        """
+        started = time.perf_counter()
+        self.import_plans(plan_rows)
+
+        batch = []
+        # Первая строка файла - заголовок
+        for line, row in enumerate(subscription_rows, start=2):
+            self.report.rows += 1
+            try:
+                item = self.parse_subscription(row)
+            except ImportRowError as e:
+                self.report.add_error(line, e)
+                continue
+
+            if item["user_uuid"] in self.seen:
+                self.report.duplicates += 1
+                continue
+            self.seen.add(item["user_uuid"])
+
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                self.import_batch(batch)
+                batch = []
+        if batch:
+            self.import_batch(batch)
+
+        self.report.elapsed = time.perf_counter() - started
+        return self.report
+
+    def import_plans(self, rows: Iterable[dict]) -> None:
+        """Создать планы, которых еще нет в БД (по названию)"""
+        # При одинаковых названиях в БД используется самый старый план
+        self.plans = dict(Plan.objects.order_by("-id").values_list("name", "id"))
+
+        new_plans = []
+        for line, row in enumerate(rows, start=2):
+            try:
+                name = _required(row, "name")
+                price = _parse_decimal(row, "price")
+                days = _parse_int(row, "days")
+            except ImportRowError as e:
+                self.report.add_error(line, ImportRowError(f"план: {e}"))
+                continue
+            if price < 0 or days <= 0:
+                self.report.add_error(
+                    line, ImportRowError("план: неверная цена или срок")
+                )
+                continue
+            if name in self.plans:
+                continue
+
+            self.plans[name] = None
+            new_plans.append(Plan(name=name, price=price, days=days))
+
+        self.report.plans_created = len(new_plans)
+        if self.dry_run or not new_plans:
+            return
+
+        with transaction.atomic():
+            for plan in Plan.objects.bulk_create(new_plans):
+                self.plans[plan.name] = plan.pk
+            # bulk_create не отправляет post_save, справочник сбрасываем сами
+            PlanCatalog.invalidate()
+
+    def parse_subscription(self, row: dict) -> dict:
+        value = _required(row, "user_uuid")
+        try:
+            user_uuid = uuid.UUID(value)
+        except ValueError:
+            raise ImportRowError(f"неверный user_uuid: {value}") from None
+
+        plan = _required(row, "plan")
+        if plan not in self.plans:
+            raise ImportRowError(f"неизвестный план: {plan}")
+
+        status = _required(row, "status")
+        if status not in IMPORT_STATUSES:
+            raise ImportRowError(f"неверный статус: {status}")
+
+        start_date = _parse_datetime(row, "start_date")
+        end_date = _parse_datetime(row, "end_date")
+        if end_date <= start_date:
+            raise ImportRowError("end_date раньше start_date")
+
+        auto_renew = _parse_bool(row, "auto_renew")
+        payment_method_id = (row.get("payment_method_id") or "").strip() or None
+        if auto_renew and payment_method_id is None:
+            raise ImportRowError("автопродление без сохраненного способа оплаты")
+
+        return {
+            "user_uuid": user_uuid,
+            "plan": plan,
+            "status": status,
+            "start_date": start_date,
+            "end_date": end_date,
+            "auto_renew": auto_renew,
+            "payment_method_id": payment_method_id,
+        }
+
+    def import_batch(self, batch: list[dict]) -> None:
+        # Подписка могла появиться между проверкой и вставкой, тогда пачка
+        # проверяется заново
+        for attempt in range(2):
+            existing = set(
+                Subscription.objects.filter(
+                    user_uuid__in=[item["user_uuid"] for item in batch]
+                ).values_list("user_uuid", flat=True)
+            )
+            imported_before = (
+                set(
+                    Payment.objects.filter(
+                        yk_payment_id__in=[
+                            imported_payment_id(item["user_uuid"])
+                            for item in batch
+                            if item["payment_method_id"]
+                        ]
+                    ).values_list("user_uuid", flat=True)
+                )
+                - existing
+            )
+            new_items = [
+                item
+                for item in batch
+                if item["user_uuid"] not in existing
+                and item["user_uuid"] not in imported_before
+            ]
+
+            if self.dry_run:
+                break
+            try:
+                self.store(new_items)
+                break
+            except IntegrityError:
+                if attempt == 1:
+                    raise
+
+        self.report.existing += len(existing)
+        self.report.imported_before += len(imported_before)
+        self.report.imported += len(new_items)
+        self.report.payment_methods += sum(
+            1 for item in new_items if item["payment_method_id"]
+        )
+
+    def store(self, items: list[dict]) -> None:
+        if not items:
+            return
+
+        with transaction.atomic():
+            subscriptions = Subscription.objects.bulk_create(
+                [
+                    Subscription(
+                        user_uuid=item["user_uuid"],
+                        plan_id=self.plans[item["plan"]],
+                        status=item["status"],
+                        start_date=item["start_date"],
+                        end_date=item["end_date"],
+                        auto_renew=item["auto_renew"],
+                    )
+                    for item in items
+                ]
+            )
+
+            Payment.objects.bulk_create(
+                [
+                    Payment(
+                        subscription=subscription,
+                        amount=0,
+                        user_uuid=subscription.user_uuid,
+                        yk_payment_id=imported_payment_id(subscription.user_uuid),
+                        yk_payment_method_id=item["payment_method_id"],
+                    )
+                    for subscription, item in zip(subscriptions, items)
+                    if item["payment_method_id"]
+                ]
+            )
+
+            Entitlement.objects.bulk_create(
+                [
+                    EntitlementLogic.from_subscription(subscription)
+                    for subscription in subscriptions
+                ],
+                update_conflicts=True,
+                unique_fields=["user_uuid"],
+                update_fields=["plan", "active_until", "auto_renew", "updated_at"],
+            )
+
+            # Сбрасываем отметки "подписка не найдена"
+            SubscriptionCache.invalidate_many(item["user_uuid"] for item in items)
@@ -1,25 +1,69 @@
+import json
 import os
 import uuid
-import json
+import httpx
 from dotenv import load_dotenv
-from datetime import timedelta
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Iterable
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Count, F, Q
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.db import transaction
-from yookassa import Configuration, Payment, Refund
-from django_celery_beat.models import PeriodicTask, ClockedSchedule
-
-from .models import Plan, Subscription, Payment as PaymentModel, AutoSubscriptionTasks
-from . import sub_types
+from yookassa.domain.notification import WebhookNotification
+
+from .models import (
+    Plan,
+    Subscription,
+    Payment as PaymentModel,
+    PaymentEvent,
+    ProviderOperation,
+    RenewalRetry,
+    ProviderPayment,
+    SyncCheckpoint,
+    Entitlement,
+    SubscriptionEvent,
+)
+from . import sub_types, yookassa_api
+from .cache import PlanCatalog, SubscriptionCache
+from .metrics import observe_provider
+from .resilience import RetryPolicy, is_retryable
 
 load_dotenv()
 
 
 class YooKassaClient:
+    """
+    Синхронный клиент API ЮKassa.
+
+    SDK не поддерживает таймауты запросов, поэтому клиент работает напрямую
+    через httpx. Запросы и разбор ответов общие с AsyncYooKassaClient
+    (yookassa_api). Каждая операция выполняется через RetryPolicy: с таймаутом
+    операции, ретраями временных ошибок и circuit breaker.
+    """
+
     def __init__(cls, account_id: str, secret_key: str):
-        Configuration.account_id = account_id
-        Configuration.secret_key = secret_key
+        cls.http = httpx.Client(**yookassa_api.http_options(account_id, secret_key))
+        cls.policy = RetryPolicy.from_settings()
+
+    def _request(cls, request: yookassa_api.ApiRequest) -> dict:
+        def attempt(timeout: float) -> dict:
+            return yookassa_api.parse_response(
+                cls.http.request(
+                    request.method,
+                    request.path,
+                    json=request.body,
+                    params=request.params,
+                    headers=request.headers,
+                    timeout=timeout,
+                )
+            )
 
+        return cls.policy.call(request.operation, attempt)
+
+    @observe_provider
     def create_payment(
         cls,
         amount: float,
@@ -28,121 +72,60 @@ class YooKassaClient:
         user_id: str,
         save_payment_method: bool = False,
         description: str = None,
+        idempotence_key: str | None = None,
     ) -> dict:
         """
         Создает платеж, возвращает URL для оплаты и данные о платеже.
 
-        :param amount: сумма платежа, float
-        :param currency: код валюты, например 'RUB'
-        :param return_url: URL, на который пользователь вернется после оплаты
-        :param user_id: идентификатор пользователя (UUID), сохраняется в metadata
-        :param save_payment_method: сохранить ли способ оплаты для автоплатежей
-        :param description: описание платежа, можно указать информацию о подписке, или user_id
-        :return: словарь с confirmation_url и данными о платеже
-        """
-        if description is None:
-            description = f"Payment for user {user_id}"
-
-        # Создаем платеж
-        payment = Payment.create(
-            {
-                "amount": {"value": f"{amount:.2f}", "currency": currency},
-                "confirmation": {"type": "redirect", "return_url": return_url},
-                "capture": True,
-                "description": description,
-                "save_payment_method": save_payment_method,
-                "metadata": {"user_id": user_id},
-            },
-            uuid.uuid4(),
+        Параметры описаны в yookassa_api.create_payment
+        """
+        payment = cls._request(
+            yookassa_api.create_payment(
+                amount,
+                currency,
+                return_url,
+                user_id,
+                save_payment_method,
+                description,
+                idempotence_key,
+            )
         )
+        return yookassa_api.checkout_info(payment)
 
-        # Возвращаем confirmation_url и информацию о платеже
-        return {
-            "payment_id": payment.id,
-            "status": payment.status,
-            "paid": payment.paid,
-            "amount": payment.amount,
-            "created_at": payment.created_at,
-            "confirmation_url": (
-                payment.confirmation.confirmation_url if payment.confirmation else None
-            ),
-            "description": payment.description,
-            "metadata": payment.metadata,
-        }
-
-    def cancel_payment(cls, payment_id: str) -> dict:
+    @observe_provider
+    def cancel_payment(
+        cls, payment_id: str, idempotence_key: str | None = None
+    ) -> dict:
         """
         Отменяет платеж в статусе waiting_for_capture.
+        """
+        return yookassa_api.cancellation_info(
+            cls._request(yookassa_api.cancel_payment(payment_id, idempotence_key))
+        )
 
-        :param payment_id: идентификатор платежа
-        :return: данные об отмененном платеже
+    @observe_provider
+    def list_payments(
+        cls, limit: int = 100, cursor: str | None = None, **filters
+    ) -> tuple[list[dict], str | None]:
         """
-        response = Payment.cancel(payment_id, uuid.uuid4())
-        return {
-            "payment_id": response.id,
-            "status": response.status,
-            "cancellation_details": response.cancellation_details,
-        }
+        Возвращает страницу списка платежей магазина и курсор следующей страницы.
 
-    def get_user_payments_history(
-        cls, user_id: str, limit: int = 100, **list_params
-    ) -> list:
-        """
-        Возвращает список платежей пользователя, фильтруя их по metadata.user_id.
-        Параметр list_params можно использовать для передачи дополнительных параметров в Payment.list(),
-        например: from_time, to_time, и т.д.
-
-        Обратите внимание, что в реальности может потребоваться пагинация, т.к. Payment.list() возвращает
-        ограниченное число платежей. Тут для простоты берём первые `limit` платежей.
-
-        :param user_id: идентификатор пользователя (UUID)
-        :param limit: Максимальное количество возвращаемых платежей
-        :param list_params: дополнительные параметры для Payment.list()
-        :return: список словарей с информацией о платежах пользователя
-        """
-        # Получаем список платежей (по умолчанию SDK может вернуть до 100 платежей)
-        payments = Payment.list(limit=limit, **list_params)
-
-        user_payments = []
-        for p in payments.items:
-            if p.metadata and p.metadata.get("user_id") == user_id:
-                user_payments.append(
-                    {
-                        "payment_id": p.id,
-                        "status": p.status,
-                        "paid": p.paid,
-                        "amount": p.amount,
-                        "created_at": p.created_at,
-                        "description": p.description,
-                        "metadata": p.metadata,
-                        "payment_method_id": (
-                            p.payment_method.id if p.payment_method else None
-                        ),
-                    }
-                )
-        return user_payments
+        Параметры описаны в yookassa_api.list_payments
+        """
+        return yookassa_api.payments_page(
+            cls._request(yookassa_api.list_payments(limit, cursor, **filters))
+        )
 
+    @observe_provider
     def get_payment(cls, payment_id: str) -> dict:
         """
         Получает информацию о платеже по его идентификатору.
-
-        :param payment_id: идентификатор платежа
-        :return: данные о платеже
         """
-        payment = Payment.find_one(payment_id)
-        return {
-            "payment_id": payment.id,
-            "status": payment.status,
-            "paid": payment.paid,
-            "amount": payment.amount,
-            "created_at": payment.created_at,
-            "description": payment.description,
-            "metadata": payment.metadata,
-            "payment_method_id": (
-                payment.payment_method.id if payment.payment_method else None
-            ),
-        }
+        return yookassa_api.payment_info(
+            cls._request(yookassa_api.get_payment(payment_id))
+        )
 
+    @observe_provider
     def charge_autopayment(
         cls,
         user_id: str,
@@ -150,70 +133,415 @@ class YooKassaClient:
         currency: str,
         payment_method_id: str,
         description: str,
+        idempotence_key: str | None = None,
     ) -> dict:
         """
         Совершает автоплатеж с сохраненным способом оплаты.
 
-        :param amount: сумма списания
-        :param currency: валюта
-        :param payment_method_id: идентификатор сохраненного способа оплаты (получен из успешного платежа)
-        :param description: описание платежа
-        :return: данные о созданном платеже
-        """
-        payment = Payment.create(
-            {
-                "amount": {"value": f"{amount:.2f}", "currency": currency},
-                "capture": True,
-                "payment_method_id": payment_method_id,
-                "description": description,
-                "metadata": {"user_id": user_id},
-            },
-            uuid.uuid4(),
+        Параметры описаны в yookassa_api.charge_autopayment
+        """
+        payment = cls._request(
+            yookassa_api.charge_autopayment(
+                user_id,
+                amount,
+                currency,
+                payment_method_id,
+                description,
+                idempotence_key,
+            )
         )
+        return yookassa_api.autopayment_info(payment)
 
-        return {
-            "payment_id": payment.id,
-            "status": payment.status,
-            "paid": payment.paid,
-            "amount": payment.amount,
-            "created_at": payment.created_at,
-            "description": payment.description,
-            "metadata": payment.metadata,
-        }
-
+    @observe_provider
     def refund_payment(
-        cls, payment_id: str, amount: float, currency: str = "RUB"
+        cls,
+        payment_id: str,
+        amount: float,
+        currency: str = "RUB",
+        idempotence_key: str | None = None,
     ) -> sub_types.RefundResponse:
         """
         Возврат платежа.
 
-        :param payment_id: идентификатор исходного платежа
-        :param amount: сумма возврата
-        :param currency: валюта
-        :return: данные о возврате
+        Параметры описаны в yookassa_api.refund_payment
         """
-        refund = Refund.create(
-            {
-                "payment_id": payment_id,
-                "amount": {"value": f"{amount:.2f}", "currency": currency},
-            },
-            uuid.uuid4(),
+        refund = cls._request(
+            yookassa_api.refund_payment(payment_id, amount, currency, idempotence_key)
+        )
+        return yookassa_api.refund_info(refund)
+
+
+class ProviderOperationLogic:
+    """
+    Ключи идемпотентности изменяющих операций в ЮKassa.
+
+    Ключ детерминированно выводится из операции и ссылки на оплачиваемый объект
+    и сохраняется в provider_operation до запроса. Повтор той же операции
+    (ретрай таски, падение воркера) идет с тем же ключом, и ЮKassa
+    возвращает результат первого запроса.
+
+    Операции по запросу пользователя (оплата, продление, возврат) получают ссылку
+    attempt_reference, уникальную для запроса: объект с той же естественной
+    ссылкой может повториться (повторная подписка после удаления, повторная
+    отмена после неудачного возврата), а старый ключ вернул бы старый объект
+    или ошибку ЮKassa из-за другого тела запроса.
+
+    Завершенные операции удаляет бит cleanup_provider_operations через
+    PROVIDER_OPERATION_RETENTION_DAYS: ЮKassa помнит ключ сутки.
+    """
+
+    @staticmethod
+    def make_key(operation: str, reference: str) -> str:
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{operation}:{reference}"))
+
+    @staticmethod
+    def attempt_reference(reference: str) -> str:
+        """Ссылка одной попытки операции по запросу пользователя"""
+        return f"{reference}:{uuid.uuid4()}"
+
+    @classmethod
+    def start(cls, operation: str, reference: str) -> str:
+        """
+        Зарегистрировать попытку операции.
+
+        :param operation: операция, например autopayment или refund
+        :param reference: ссылка на объект операции
+        :return: ключ идемпотентности
+        """
+        provider_operation, created = ProviderOperation.objects.get_or_create(
+            operation=operation,
+            reference=reference,
+            defaults={"idempotence_key": cls.make_key(operation, reference)},
         )
+        if not created:
+            ProviderOperation.objects.filter(pk=provider_operation.pk).update(
+                attempts=F("attempts") + 1, updated_at=timezone.now()
+            )
+        return str(provider_operation.idempotence_key)
 
-        return sub_types.RefundResponse(
-            refund_id=refund.id,
-            status=refund.status,
-            payment_id=refund.payment_id,
-            amount=(
-                sub_types.RefundAmount(
-                    value=refund.amount.value, currency=refund.amount.currency
+    @classmethod
+    def start_many(cls, operation: str, references: list[str]) -> dict[str, str]:
+        """
+        Зарегистрировать попытки пачки операций.
+
+        :return: словарь ссылка -> ключ идемпотентности
+        """
+        keys = {
+            reference: cls.make_key(operation, reference) for reference in references
+        }
+        ProviderOperation.objects.filter(
+            operation=operation, reference__in=references
+        ).update(attempts=F("attempts") + 1, updated_at=timezone.now())
+        ProviderOperation.objects.bulk_create(
+            [
+                ProviderOperation(
+                    operation=operation, reference=reference, idempotence_key=key
                 )
-                if refund.amount
-                else None
-            ),
-            created_at=refund.created_at,
-            description=refund.description,
+                for reference, key in keys.items()
+            ],
+            ignore_conflicts=True,
+        )
+        return keys
+
+    @staticmethod
+    def attempts(operation: str, references: list[str]) -> dict[str, int]:
+        """
+        Количество попыток операций.
+
+        :return: словарь ссылка -> попыток
+        """
+        return dict(
+            ProviderOperation.objects.filter(
+                operation=operation, reference__in=references
+            ).values_list("reference", "attempts")
+        )
+
+    @classmethod
+    def finish(
+        cls,
+        operation: str,
+        reference: str,
+        yk_object_id: str | None = None,
+        error: Exception | None = None,
+    ) -> None:
+        """
+        Записать результат операции.
+
+        :param yk_object_id: ID созданного в ЮKassa платежа или возврата
+        :param error: ошибка последней попытки
+        """
+        ProviderOperation.objects.filter(
+            operation=operation, reference=reference
+        ).update(
+            status="failed" if error is not None else "succeeded",
+            yk_object_id=yk_object_id,
+            error=repr(error) if error is not None else None,
+            updated_at=timezone.now(),
+        )
+
+    @staticmethod
+    def delete_finished(before: datetime, chunk_size: int) -> int:
+        """
+        Удалить пачку завершенных операций, обновленных раньше before.
+
+        :return: количество удаленных операций
+        """
+        ids = list(
+            ProviderOperation.objects.filter(updated_at__lt=before)
+            .exclude(status="pending")
+            .values_list("id", flat=True)[:chunk_size]
+        )
+        if not ids:
+            return 0
+        deleted, _ = ProviderOperation.objects.filter(id__in=ids).delete()
+        return deleted
+
+    @classmethod
+    def run(
+        cls,
+        operation: str,
+        reference: str,
+        func: Callable[[str], dict],
+        id_field: str = "payment_id",
+    ) -> dict:
+        """
+        Выполнить операцию в ЮKassa с ключом идемпотентности и записать результат.
+
+        :param func: запрос к ЮKassa, получает ключ идемпотентности
+        :param id_field: поле ответа с ID созданного объекта
+        :return: ответ func
+        """
+        key = cls.start(operation, reference)
+        try:
+            result = func(key)
+        except Exception as e:
+            cls.finish(operation, reference, error=e)
+            raise
+        cls.finish(operation, reference, yk_object_id=result[id_field])
+        return result
+
+    @classmethod
+    async def arun(
+        cls,
+        operation: str,
+        reference: str,
+        func: Callable[[str], Awaitable[dict]],
+        id_field: str = "payment_id",
+    ) -> dict:
+        """Асинхронная версия run"""
+        key = await sync_to_async(cls.start)(operation, reference)
+        try:
+            result = await func(key)
+        except Exception as e:
+            await sync_to_async(cls.finish)(operation, reference, error=e)
+            raise
+        await sync_to_async(cls.finish)(
+            operation, reference, yk_object_id=result[id_field]
+        )
+        return result
+
+
+class ProviderPaymentLogic:
+    """
+    Локальное зеркало платежей ЮKassa (provider_payment).
+
+    Зеркало пополняется фоновой синхронизацией (provider_sync), уведомлениями
+    ЮKassa и ночной сверкой (reconciliation). История платежей пользователя
+    читается из payment, а не из зеркала.
+    """
+
+    @classmethod
+    def upsert(cls, payments: list[dict]) -> int:
+        """
+        Сохранить платежи ЮKassa в зеркало, обновив уже известные.
+
+        :param payments: платежи в формате yookassa_api.payment_info
+        :return: количество сохраненных платежей
+        """
+        rows = {}
+        for payment in payments:
+            metadata = payment.get("metadata") or {}
+            try:
+                user_uuid = uuid.UUID(str(metadata.get("user_id")))
+            except ValueError:
+                user_uuid = None
+            rows[payment["payment_id"]] = ProviderPayment(
+                yk_payment_id=payment["payment_id"],
+                user_uuid=user_uuid,
+                status=payment["status"],
+                paid=payment["paid"],
+                amount=payment["amount"]["value"],
+                currency=payment["amount"]["currency"],
+                description=payment.get("description"),
+                payment_method_id=payment.get("payment_method_id"),
+                metadata=metadata,
+                created_at=parse_datetime(payment["created_at"]),
+            )
+
+        ProviderPayment.objects.bulk_create(
+            rows.values(),
+            update_conflicts=True,
+            unique_fields=["yk_payment_id"],
+            update_fields=[
+                "status",
+                "paid",
+                "description",
+                "payment_method_id",
+                "metadata",
+                "synced_at",
+            ],
         )
+        return len(rows)
+
+
+class SyncCheckpointLogic:
+    """
+    Позиции фоновых синхронизаций с арендой на время запуска.
+
+    Запуск забирает аренду условным UPDATE, как свип продления блокирует
+    подписки. Если воркер упал, аренда истечет и следующий запуск продолжит
+    с последней сохраненной позиции.
+    """
+
+    @classmethod
+    def acquire(cls, name: str, lease_seconds: int) -> dict | None:
+        """
+        Забрать аренду синхронизации.
+
+        :param name: имя синхронизации
+        :param lease_seconds: на сколько секунд забирается аренда
+        :return: сохраненная позиция или None, если синхронизация уже выполняется
+        """
+        SyncCheckpoint.objects.get_or_create(name=name)
+        now = timezone.now()
+        acquired = (
+            SyncCheckpoint.objects.filter(name=name)
+            .filter(Q(locked_until__isnull=True) | Q(locked_until__lte=now))
+            .update(locked_until=now + timedelta(seconds=lease_seconds), updated_at=now)
+        )
+        if not acquired:
+            return None
+        return SyncCheckpoint.objects.values_list("position", flat=True).get(name=name)
+
+    @classmethod
+    def save(cls, name: str, position: dict, lease_seconds: int | None = None) -> None:
+        """
+        Сохранить позицию синхронизации.
+
+        :param lease_seconds: продлить аренду на столько секунд
+        """
+        now = timezone.now()
+        values = {"position": position, "updated_at": now}
+        if lease_seconds is not None:
+            values["locked_until"] = now + timedelta(seconds=lease_seconds)
+        SyncCheckpoint.objects.filter(name=name).update(**values)
+
+    @classmethod
+    def release(cls, name: str) -> None:
+        SyncCheckpoint.objects.filter(name=name).update(
+            locked_until=None, updated_at=timezone.now()
+        )
+
+
+class EntitlementLogic:
+    """
+    Доступы по подпискам (таблица entitlement).
+
+    Каждое изменение подписки вызывает refresh/revoke_many в своей транзакции,
+    поэтому проверка доступа - чтение одной строки по первичному ключу
+    и сравнение active_until с текущим временем.
+    """
+
+    @staticmethod
+    def from_subscription(subscription: Subscription) -> Entitlement:
+        # Доступ дает оплаченная подписка и подписка в льготном периоде
+        # повторных списаний
+        active_until = None
+        if subscription.status == "active":
+            active_until = subscription.end_date
+        elif subscription.status == "past_due":
+            active_until = DunningLogic.grace_until(subscription.end_date)
+
+        return Entitlement(
+            user_uuid=subscription.user_uuid,
+            plan_id=subscription.plan_id,
+            active_until=active_until,
+            auto_renew=subscription.auto_renew,
+        )
+
+    @classmethod
+    def refresh(cls, subscription: Subscription) -> None:
+        """
+        Записать доступ по текущему состоянию подписки.
+
+        :param subscription: объект БД Subscription после изменения
+        """
+        cls.refresh_many([subscription])
+
+    @classmethod
+    def refresh_many(cls, subscriptions: list[Subscription]) -> None:
+        """
+        Записать доступы пачки подписок одним запросом.
+
+        :param subscriptions: объекты БД Subscription после изменения
+        """
+        Entitlement.objects.bulk_create(
+            [cls.from_subscription(subscription) for subscription in subscriptions],
+            update_conflicts=True,
+            unique_fields=["user_uuid"],
+            update_fields=["plan", "active_until", "auto_renew", "updated_at"],
+        )
+
+    @classmethod
+    def revoke_many(cls, user_uuids: Iterable[object]) -> None:
+        """
+        Отозвать доступ пачки пользователей.
+
+        :param user_uuids: UUID пользователей
+        """
+        Entitlement.objects.filter(user_uuid__in=list(user_uuids)).update(
+            active_until=None, updated_at=timezone.now()
+        )
+
+    @classmethod
+    def remove(cls, user_uuid: object) -> None:
+        Entitlement.objects.filter(user_uuid=user_uuid).delete()
+
+    @classmethod
+    def get_many(cls, user_uuids: list[str]) -> dict[str, dict | None]:
+        """
+        Доступы пачки пользователей одним запросом по первичному ключу.
+
+        :param user_uuids: UUID пользователей (строки в каноническом виде)
+        :return: словарь UUID -> доступ или None, если подписки нет
+        """
+        return cls._to_result(user_uuids, cls._rows(user_uuids))
+
+    @classmethod
+    async def aget_many(cls, user_uuids: list[str]) -> dict[str, dict | None]:
+        """Асинхронная версия get_many"""
+        return cls._to_result(user_uuids, [row async for row in cls._rows(user_uuids)])
+
+    @staticmethod
+    def _rows(user_uuids: list[str]):
+        return Entitlement.objects.filter(user_uuid__in=user_uuids).values_list(
+            "user_uuid", "plan_id", "active_until", "auto_renew"
+        )
+
+    @staticmethod
+    def _to_result(
+        user_uuids: list[str], rows: Iterable[tuple]
+    ) -> dict[str, dict | None]:
+        now = timezone.now()
+        result: dict[str, dict | None] = dict.fromkeys(user_uuids)
+        for user_uuid, plan_id, active_until, auto_renew in rows:
+            result[str(user_uuid)] = {
+                "entitled": active_until is not None and active_until > now,
+                "active_until": active_until,
+                "plan_id": plan_id,
+                "auto_renew": auto_renew,
+            }
+        return result
 
 
 class SubscriptionLogic:
@@ -234,41 +562,67 @@ class SubscriptionLogic:
         :param return_url: URL, на который пользователь вернется после оплаты
         :return: URL для оплаты через YooKassa
         """
-        plan = Plan.objects.get(id=plan_id)
-        now = timezone.now()
-        end_date = now + timedelta(days=plan.days)
-
-        # Создаем платеж через YooKassa
-        payment_data = cls.yoo_client.create_payment(
-            amount=float(plan.price),
-            currency="RUB",
-            return_url=return_url,
-            user_id=user_uuid,
-            save_payment_method=auto_renew,  # Если автопродление, то сохраняем способ оплаты
-            description=f"Subscription for user {user_uuid}",
-        )
-
-        # Создаем подписку
-        subscription = Subscription.objects.create(
-            user_uuid=user_uuid,
-            plan=plan,
-            status="pending",
-            start_date=now,
-            end_date=end_date,
-            auto_renew=auto_renew,
-        )
-
-        # Сохраняем данные платежа в БД
-        PaymentModel.objects.create(
-            subscription=subscription,
-            amount=plan.price,
-            user_uuid=user_uuid,
-            yk_payment_id=payment_data["payment_id"],
-            yk_payment_method_id=payment_data.get("payment_method_id"),
+        plan = PlanCatalog.get(plan_id)
+        if plan is None:
+            raise Plan.DoesNotExist(f"Plan {plan_id} not found")
+
+        # Создаем платеж через YooKassa. Ретраи внутри запроса идут с одним
+        # ключом, каждый запрос пользователя создает новый платеж
+        payment_data = ProviderOperationLogic.run(
+            "checkout",
+            ProviderOperationLogic.attempt_reference(f"{user_uuid}:{plan_id}"),
+            lambda key: cls.yoo_client.create_payment(
+                amount=float(plan.price),
+                currency="RUB",
+                return_url=return_url,
+                user_id=user_uuid,
+                save_payment_method=auto_renew,  # Если автопродление, то сохраняем способ оплаты
+                description=f"Subscription for user {user_uuid}",
+                idempotence_key=key,
+            ),
         )
 
+        cls.store_new_subscription(plan, user_uuid, auto_renew, payment_data)
+
         return payment_data["confirmation_url"]
 
+    @classmethod
+    def store_new_subscription(
+        cls, plan: Plan, user_uuid: str, auto_renew: bool, payment_data: dict
+    ) -> Subscription:
+        """
+        Сохранить новую подписку в pending и ее первый платеж.
+
+        :param payment_data: ответ create_payment
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            # Создаем подписку. UUID приводится к каноническому виду, в котором
+            # ручки чтения строят ключи кэша
+            subscription = Subscription.objects.create(
+                user_uuid=uuid.UUID(str(user_uuid)),
+                plan=plan,
+                status="pending",
+                start_date=now,
+                end_date=now + timedelta(days=plan.days),
+                auto_renew=auto_renew,
+            )
+
+            # Сохраняем данные платежа в БД
+            PaymentModel.objects.create(
+                subscription=subscription,
+                amount=plan.price,
+                user_uuid=user_uuid,
+                yk_payment_id=payment_data["payment_id"],
+                yk_payment_method_id=payment_data.get("payment_method_id"),
+            )
+            EntitlementLogic.refresh(subscription)
+
+            # Сбрасываем отметку "подписка не найдена"
+            SubscriptionCache.invalidate(subscription.user_uuid)
+
+        return subscription
+
     @classmethod
     def get_user_subscriptions(cls, user_uuid: str) -> Subscription | None:
         """
@@ -309,37 +663,145 @@ class SubscriptionLogic:
         if not last_payment or not last_payment.yk_payment_method_id:
             raise ValueError("No saved payment method found for this subscription")
 
+        plan = PlanCatalog.get(subscription.plan_id)
+
         logger.info("Подали запрос на автоплатеж")
         # Совершаем автоплатеж
-        payment_data = cls.yoo_client.charge_autopayment(
-            user_id=str(subscription.user_uuid),
-            amount=float(subscription.plan.price),
-            currency="RUB",
-            payment_method_id=last_payment.yk_payment_method_id,
-            description=f"Renew subscription {subscription.pk} for user {subscription.user_uuid}",
+        payment_data = ProviderOperationLogic.run(
+            "autopayment",
+            RenewalLogic.autopayment_reference(subscription.pk, subscription.end_date),
+            lambda key: cls.yoo_client.charge_autopayment(
+                user_id=str(subscription.user_uuid),
+                amount=float(plan.price),
+                currency="RUB",
+                payment_method_id=last_payment.yk_payment_method_id,
+                description=f"Renew subscription {subscription.pk} for user {subscription.user_uuid}",
+                idempotence_key=key,
+            ),
+        )
+        logger.info(f"Статус платежа: {payment_data.get('status')}")
+
+        return cls.apply_autopayment(
+            subscription.pk,
+            subscription.end_date,
+            last_payment.yk_payment_method_id,
+            payment_data,
         )
+
+    @classmethod
+    def apply_autopayment(
+        cls,
+        subscription_id: int,
+        period_end: datetime,
+        payment_method_id: str,
+        payment_data: dict,
+    ) -> PaymentModel | None:
+        """
+        Применить результат автоплатежа к подписке.
+
+        Если end_date подписки уже не совпадает с продлеваемым периодом,
+        результат этого списания уже применен и повторно ничего не меняется.
+        Отклоненное (canceled) списание переводит подписку в past_due
+        с повторными списаниями (DunningLogic), если для них осталось время.
+        Неоконченное списание (pending) сохраняется платежом, его исход
+        применит вебхук или сверка.
+
+        :param subscription_id: ID подписки
+        :param period_end: end_date подписки на момент списания
+        :param payment_method_id: идентификатор сохраненного способа оплаты
+        :param payment_data: ответ charge_autopayment
+        :return: созданный платеж, если списание прошло или ждет подтверждения
+        """
         with transaction.atomic():
-            # Обновляем дату окончания подписки и ставим статус active
+            subscription = Subscription.objects.select_for_update().get(
+                id=subscription_id
+            )
+            if subscription.end_date != period_end or subscription.status != "active":
+                return None
+
             if payment_data["status"] == "succeeded":
-                logger.info(f"Статус платежа: {payment_data.get('status')}")
-                subscription.end_date = subscription.end_date + timedelta(
-                    days=subscription.plan.days
+                return cls.store_renewal(subscription, payment_method_id, payment_data)
+            if payment_data["status"] != "canceled":
+                return cls.store_pending_autopayment(
+                    subscription, payment_method_id, payment_data
                 )
-                logger.info("Переводим подписку в ACTIVE")
-                subscription.status = "active"
-                subscription.save()
-
-                # Сохраняем новый платеж
-                return PaymentModel.objects.create(
-                    subscription=subscription,
-                    amount=subscription.plan.price,
-                    user_uuid=subscription.user_uuid,
-                    yk_payment_id=payment_data["payment_id"],
-                    yk_payment_method_id=last_payment.yk_payment_method_id,
-                )
-            else:
-                subscription.status = "cancelled"
-                subscription.save()
+
+            subscription.status = (
+                "past_due"
+                if DunningLogic.start(subscription, payment_data)
+                else "cancelled"
+            )
+            subscription.sweep_locked_until = None
+            subscription.save()
+            EntitlementLogic.refresh(subscription)
+            SubscriptionCache.invalidate(subscription.user_uuid)
+            return None
+
+    @classmethod
+    def store_renewal(
+        cls, subscription: Subscription, payment_method_id: str, payment_data: dict
+    ) -> PaymentModel:
+        """
+        Продлить подписку на период плана после успешного автоплатежа.
+
+        Вызывается в транзакции с заблокированной подпиской. Новый период
+        начинается с end_date, в том числе после повторного списания.
+
+        :param payment_data: ответ charge_autopayment
+        :return: созданный платеж
+        """
+        plan = PlanCatalog.get(subscription.plan_id)
+
+        # Обновляем дату окончания подписки и ставим статус active
+        subscription.end_date = subscription.end_date + timedelta(days=plan.days)
+        subscription.status = "active"
+        subscription.sweep_locked_until = None
+        subscription.save()
+        EntitlementLogic.refresh(subscription)
+        SubscriptionCache.invalidate(subscription.user_uuid)
+
+        # Сохраняем новый платеж
+        return PaymentModel.objects.create(
+            subscription=subscription,
+            amount=plan.price,
+            user_uuid=subscription.user_uuid,
+            yk_payment_id=payment_data["payment_id"],
+            yk_payment_method_id=payment_method_id,
+        )
+
+    @classmethod
+    def store_pending_autopayment(
+        cls, subscription: Subscription, payment_method_id: str, payment_data: dict
+    ) -> PaymentModel:
+        """
+        Сохранить автоплатеж, который ЮKassa еще не провела (pending).
+
+        Подписка переходит в pending с продленным end_date, как при ручном
+        продлении: вебхук по платежу переведет ее в active или cancelled,
+        потерянный вебхук восстановит сверка. Повторять такое списание
+        нельзя - если оно пройдет, деньги спишутся дважды.
+
+        Вызывается в транзакции с заблокированной подпиской.
+
+        :param payment_data: ответ charge_autopayment
+        :return: созданный платеж
+        """
+        plan = PlanCatalog.get(subscription.plan_id)
+
+        subscription.end_date = subscription.end_date + timedelta(days=plan.days)
+        subscription.status = "pending"
+        subscription.sweep_locked_until = None
+        subscription.save()
+        EntitlementLogic.refresh(subscription)
+        SubscriptionCache.invalidate(subscription.user_uuid)
+
+        return PaymentModel.objects.create(
+            subscription=subscription,
+            amount=plan.price,
+            user_uuid=subscription.user_uuid,
+            yk_payment_id=payment_data["payment_id"],
+            yk_payment_method_id=payment_method_id,
+        )
 
     @classmethod
     def renew_subscription_through_payment(
@@ -347,7 +809,7 @@ class SubscriptionLogic:
     ) -> str:
         """
         Продлить подписку за счёт обычной оплаты (не автоплатежа).
-        Продлить можно только cancelled подписку.
+        Продлить можно только cancelled, expired или past_due подписку.
         Возвращает ссылку на оплату. После оплаты можно обновить подписку.
 
         :param plan_id: ID плана
@@ -356,37 +818,65 @@ class SubscriptionLogic:
         :param auto_renew: Автоплатеж
         :return: URL для оплаты
         """
-        plan = Plan.objects.get(id=plan_id)
-
-        plan = subscription.plan
+        plan = PlanCatalog.get(subscription.plan_id)
 
         # Создаем платеж через YooKassa. Здесь мы не сохраняем payment_method для автоплатежа.
-        payment_data = cls.yoo_client.create_payment(
-            amount=float(plan.price),
-            currency="RUB",
-            return_url=return_url,
-            user_id=str(subscription.user_uuid),
-            save_payment_method=auto_renew,  # здесь можно оставить False, если не хотим сохранять способ оплаты
-            description=f"Manual renewal for subscription {subscription.pk} user {subscription.user_uuid}",
-        )
-
-        # Сохраняем данные платежа в БД
-        PaymentModel.objects.create(
-            subscription=subscription,
-            amount=plan.price,
-            user_uuid=subscription.user_uuid,
-            yk_payment_id=payment_data["payment_id"],
-            yk_payment_method_id=payment_data.get("payment_method_id"),
+        payment_data = ProviderOperationLogic.run(
+            "renewal_checkout",
+            ProviderOperationLogic.attempt_reference(
+                f"{subscription.pk}:{subscription.end_date.isoformat()}"
+            ),
+            lambda key: cls.yoo_client.create_payment(
+                amount=float(plan.price),
+                currency="RUB",
+                return_url=return_url,
+                user_id=str(subscription.user_uuid),
+                save_payment_method=auto_renew,  # здесь можно оставить False, если не хотим сохранять способ оплаты
+                description=f"Manual renewal for subscription {subscription.pk} user {subscription.user_uuid}",
+                idempotence_key=key,
+            ),
         )
 
-        subscription.end_date = subscription.end_date + timedelta(days=plan.days)
-        subscription.status = "pending"
-        subscription.plan = plan
-        subscription.auto_renew = auto_renew
-        subscription.save()
+        cls.store_renewal_checkout(subscription, plan, auto_renew, payment_data)
 
         return payment_data["confirmation_url"]
 
+    @classmethod
+    def store_renewal_checkout(
+        cls,
+        subscription: Subscription,
+        plan: Plan,
+        auto_renew: bool,
+        payment_data: dict,
+    ) -> None:
+        """
+        Сохранить платеж ручного продления и перевести подписку в pending.
+
+        Подписка из past_due сохраняет доступ до конца льготного периода, пока
+        платеж не завершится: доступ пересчитает уведомление о платеже.
+
+        :param payment_data: ответ create_payment
+        """
+        in_grace = subscription.status == "past_due"
+        with transaction.atomic():
+            # Сохраняем данные платежа в БД
+            PaymentModel.objects.create(
+                subscription=subscription,
+                amount=plan.price,
+                user_uuid=subscription.user_uuid,
+                yk_payment_id=payment_data["payment_id"],
+                yk_payment_method_id=payment_data.get("payment_method_id"),
+            )
+
+            subscription.end_date = subscription.end_date + timedelta(days=plan.days)
+            subscription.status = "pending"
+            subscription.plan = plan
+            subscription.auto_renew = auto_renew
+            subscription.save()
+            if not in_grace:
+                EntitlementLogic.refresh(subscription)
+            SubscriptionCache.invalidate(subscription.user_uuid)
+
     @classmethod
     def cancel_subscription(cls, subscription: Subscription) -> bool:
         """
@@ -400,6 +890,10 @@ class SubscriptionLogic:
         logger = logging.getLogger("sub")
         logger.info(f"Отменяем подписку пользователю {subscription.user_uuid}")
 
+        if subscription.status == "past_due":
+            cls.store_cancelled_past_due(subscription)
+            return True
+
         last_payment = (
             PaymentModel.objects.filter(subscription=subscription)
             .exclude(yk_payment_method_id__isnull=True)
@@ -408,9 +902,15 @@ class SubscriptionLogic:
         )
 
         if last_payment:
-            refund = cls.yoo_client.refund_payment(
-                payment_id=last_payment.yk_payment_id,
-                amount=float(subscription.plan.price),
+            refund = ProviderOperationLogic.run(
+                "refund",
+                ProviderOperationLogic.attempt_reference(last_payment.yk_payment_id),
+                lambda key: cls.yoo_client.refund_payment(
+                    payment_id=last_payment.yk_payment_id,
+                    amount=float(PlanCatalog.get(subscription.plan_id).price),
+                    idempotence_key=key,
+                ),
+                id_field="refund_id",
             )
 
             logger.info(f"Статус возврата: {refund['status']}")
@@ -419,70 +919,742 @@ class SubscriptionLogic:
                 logger.info("Возврат не удался")
                 return False
 
-        subscription.status = "cancelled"
-        subscription.save()
+        cls.store_cancelled(subscription)
+
+        return True
+
+    @classmethod
+    def store_cancelled(cls, subscription: Subscription) -> None:
+        """
+        Перевести подписку в cancelled.
 
-        if subscription.auto_renew:
-            # Удаляем таску на автоматическую оплату
-            auto_payment = AutoSubscriptionTasks.objects.filter(
-                subscription=subscription
-            ).first()
+        Отмененная подписка больше не попадает в свип продления,
+        поэтому отдельно снимать задачи на автоплатеж не нужно.
+        """
+        with transaction.atomic():
+            subscription.status = "cancelled"
+            subscription.save()
+            EntitlementLogic.refresh(subscription)
+            SubscriptionCache.invalidate(subscription.user_uuid)
+
+    @classmethod
+    def store_cancelled_past_due(cls, subscription: Subscription) -> None:
+        """
+        Отменить подписку в past_due.
+
+        Текущий период не оплачен, поэтому возвращать нечего: подписка
+        переводится в cancelled, открытые повторные списания закрываются.
+        """
+        with transaction.atomic():
+            cls.store_cancelled(subscription)
+            DunningLogic.finish_retries(
+                list(
+                    RenewalRetry.objects.filter(
+                        subscription=subscription, status="scheduled"
+                    ).values_list("id", flat=True)
+                ),
+                cancel_subscriptions=False,
+            )
 
-            if auto_payment:
-                PeriodicTasksLogic.remove_periodic_task_with_clocked(auto_payment.task)
+    @classmethod
+    def remove_subscription(cls, subscription: Subscription) -> None:
+        """
+        Удалить подписку вместе с доступом по ней.
+        """
+        with transaction.atomic():
+            subscription.delete()
+            EntitlementLogic.remove(subscription.user_uuid)
+            SubscriptionCache.invalidate(subscription.user_uuid)
 
-                auto_payment.delete()
 
-        return True
+class RenewalLogic:
+    """
+    Свип продления подписок.
 
+    Вместо отдельных ClockedSchedule + PeriodicTask на каждую подписку
+    периодические таски забирают подписки с наступившим end_date пачками:
+    renewal_sweep раздает подписки с автопродлением в make_autopayment,
+    expiry_sweep сам переводит остальные в expired.
+    """
 
-class PeriodicTasksLogic:
     @classmethod
-    def create_stop_subscription_task(
-        cls, subscription_id: int, days: int
-    ) -> PeriodicTask:
-        task_name = f"stop_subscription_{subscription_id}"
-        task_path = "apps.sub.tasks.stop_subscription"
-        stop_subscription_time = timezone.now() + timedelta(days=days)
-        task_kwargs = {"subscription_id": subscription_id}
+    def claim_due_subscriptions(cls, limit: int | None = None) -> list[tuple]:
+        """
+        Забрать пачку активных подписок с автопродлением, у которых наступил
+        end_date.
+
+        Забранные подписки блокируются на RENEWAL_SWEEP_LOCK_SECONDS, чтобы
+        следующий свип не отправил их повторно, пока таска еще в очереди.
+        Если таска упала, подписка будет забрана снова после истечения блокировки.
+
+        :param limit: максимальный размер пачки
+        :return: список именованных кортежей (id, user_uuid, end_date)
+        """
+        if limit is None:
+            limit = settings.RENEWAL_SWEEP_CHUNK_SIZE
+
+        now = timezone.now()
+        with transaction.atomic():
+            due = list(
+                Subscription.objects.select_for_update(skip_locked=True)
+                .filter(status="active", auto_renew=True, end_date__lte=now)
+                .filter(
+                    Q(sweep_locked_until__isnull=True) | Q(sweep_locked_until__lte=now)
+                )
+                .order_by("end_date")
+                .values_list("id", "user_uuid", "end_date", named=True)[:limit]
+            )
+            if due:
+                Subscription.objects.filter(id__in=[row.id for row in due]).update(
+                    sweep_locked_until=now
+                    + timedelta(seconds=settings.RENEWAL_SWEEP_LOCK_SECONDS)
+                )
+
+        return due
+
+    @staticmethod
+    def autopayment_reference(
+        subscription_id: int, period_end: datetime, attempt: int = 0
+    ) -> str:
+        """
+        Ссылка операции autopayment: подписка, продлеваемый период (end_date)
+        и номер повторного списания после отказа.
 
-        clocked_schedule = ClockedSchedule.objects.create(
-            clocked_time=stop_subscription_time
+        Повторное списание того же периода после ретрая или таймаута идет
+        с тем же ключом идемпотентности и вернет исходный платеж ЮKassa.
+        Новая попытка после отказа банка идет с новым ключом, иначе ЮKassa
+        вернула бы тот же отклоненный платеж.
+        """
+        reference = f"{subscription_id}:{period_end.isoformat()}"
+        return f"{reference}:{attempt}" if attempt else reference
+
+    @classmethod
+    def autopayment_idempotence_key(
+        cls, subscription_id: int, period_end: datetime
+    ) -> str:
+        """Ключ идемпотентности автоплатежа за период подписки"""
+        return ProviderOperationLogic.make_key(
+            "autopayment", cls.autopayment_reference(subscription_id, period_end)
         )
 
-        return PeriodicTask.objects.create(
-            clocked=clocked_schedule,
-            name=task_name,
-            task=task_path,
-            kwargs=json.dumps(task_kwargs),
-            one_off=True,
+    @classmethod
+    def expire_due_subscriptions(cls, limit: int | None = None) -> int:
+        """
+        Перевести в expired пачку активных подписок без автопродления,
+        у которых наступил end_date.
+
+        Пачка стоит постоянное число запросов независимо от размера: выборка
+        с блокировкой, UPDATE подписок, UPDATE доступов и INSERT событий.
+
+        :param limit: максимальный размер пачки
+        :return: количество остановленных подписок
+        """
+        if limit is None:
+            limit = settings.EXPIRY_SWEEP_CHUNK_SIZE
+
+        with transaction.atomic():
+            expired = list(
+                Subscription.objects.select_for_update(skip_locked=True)
+                .filter(status="active", auto_renew=False, end_date__lte=timezone.now())
+                .order_by("end_date")
+                .values_list("id", "user_uuid", "plan_id", "end_date", named=True)[
+                    :limit
+                ]
+            )
+            cls.store_expired(expired)
+
+        return len(expired)
+
+    @classmethod
+    def stop_subscriptions(cls, subscription_ids: list[int]) -> int:
+        """
+        Остановить подписки, срок которых истек, а продлить нечем.
+
+        Повторный вызов безопасен: обновляются только активные подписки
+        с наступившим end_date.
+
+        :param subscription_ids: ID подписок
+        :return: количество остановленных подписок
+        """
+        with transaction.atomic():
+            expired = list(
+                Subscription.objects.select_for_update()
+                .filter(
+                    id__in=subscription_ids,
+                    status="active",
+                    end_date__lte=timezone.now(),
+                )
+                .values_list("id", "user_uuid", "plan_id", "end_date", named=True)
+            )
+            cls.store_expired(expired)
+
+        return len(expired)
+
+    @staticmethod
+    def store_expired(rows: list[tuple]) -> None:
+        """
+        Перевести заблокированные подписки в expired, отозвать доступы
+        и записать события subscription.expired.
+
+        Истекшая подписка - expired, cancelled остается за отменой
+        пользователем и отказом в оплате.
+
+        :param rows: именованные кортежи (id, user_uuid, plan_id, end_date)
+        """
+        if not rows:
+            return
+
+        Subscription.objects.filter(id__in=[row.id for row in rows]).update(
+            status="expired", sweep_locked_until=None
+        )
+        EntitlementLogic.revoke_many(row.user_uuid for row in rows)
+        SubscriptionEvent.objects.bulk_create(
+            [
+                SubscriptionEvent(
+                    event="subscription.expired",
+                    subscription_id=row.id,
+                    user_uuid=row.user_uuid,
+                    plan_id=row.plan_id,
+                    end_date=row.end_date,
+                )
+                for row in rows
+            ]
+        )
+        SubscriptionCache.invalidate_many(row.user_uuid for row in rows)
+
+
+class DunningLogic:
+    """
+    Повторные списания после отклоненного автоплатежа (dunning).
+
+    Отказ банка переводит подписку в past_due и создает строку RenewalRetry
+    с временем следующей попытки по DUNNING_RETRY_SCHEDULE. Свип
+    beats.dunning_sweep забирает попытки с наступившим next_retry_at пачками
+    по частичному индексу и отдает их в tasks.retry_autopayment. Подписка
+    в past_due сохраняет доступ до конца льготного периода
+    DUNNING_GRACE_SECONDS, после последнего отказа она отменяется.
+    """
+
+    # Причины отказа ЮKassa, при которых повтор с тем же способом оплаты
+    # не пройдет
+    FINAL_DECLINE_REASONS = {
+        "card_expired",
+        "invalid_card_number",
+        "payment_method_restricted",
+        "permission_revoked",
+        "provider_rejected",
+    }
+
+    @staticmethod
+    def error_payment_data(error: Exception) -> dict:
+        """
+        Отказ вместо ответа charge_autopayment для списания, которое ЮKassa
+        не провела: provider_rejected после ошибки 4xx (повтор не пройдет),
+        provider_unavailable после исчерпанных временных ошибок.
+        """
+        reason = "provider_unavailable" if is_retryable(error) else "provider_rejected"
+        return {"status": "canceled", "cancellation_details": {"reason": reason}}
+
+    @staticmethod
+    def grace_until(period_end: datetime) -> datetime:
+        """Конец льготного периода подписки, не продленной в period_end"""
+        return period_end + timedelta(seconds=settings.DUNNING_GRACE_SECONDS)
+
+    @staticmethod
+    def decline_reason(payment_data: dict) -> str:
+        """Причина отказа из ответа charge_autopayment"""
+        details = payment_data.get("cancellation_details") or {}
+        return details.get("reason") or payment_data["status"]
+
+    @classmethod
+    def next_retry_at(
+        cls, attempts: int, grace_until: datetime, reason: str, now: datetime
+    ) -> datetime | None:
+        """
+        Время следующей попытки после отказа.
+
+        :param attempts: количество отказов за период, включая последний
+        :param reason: причина последнего отказа
+        :return: None, если попыток больше не будет
+        """
+        schedule = settings.DUNNING_RETRY_SCHEDULE
+        if reason in cls.FINAL_DECLINE_REASONS or attempts > len(schedule):
+            return None
+
+        retry_at = now + timedelta(seconds=schedule[attempts - 1])
+        return retry_at if retry_at < grace_until else None
+
+    @classmethod
+    def start(cls, subscription: Subscription, payment_data: dict) -> bool:
+        """
+        Запланировать повторные списания после отказа первого автоплатежа.
+
+        Вызывается в транзакции с заблокированной подпиской.
+
+        :param payment_data: ответ charge_autopayment
+        :return: False, если повторять списание не нужно
+        """
+        reason = cls.decline_reason(payment_data)
+        grace_until = cls.grace_until(subscription.end_date)
+        next_retry_at = cls.next_retry_at(1, grace_until, reason, timezone.now())
+        if next_retry_at is None:
+            return False
+
+        RenewalRetry.objects.get_or_create(
+            subscription=subscription,
+            period_end=subscription.end_date,
+            defaults={
+                "next_retry_at": next_retry_at,
+                "grace_until": grace_until,
+                "decline_reason": reason,
+            },
+        )
+        return True
+
+    @classmethod
+    def claim_due_retries(cls, limit: int | None = None) -> list[tuple]:
+        """
+        Забрать пачку попыток с наступившим next_retry_at.
+
+        Забранные попытки блокируются на RENEWAL_SWEEP_LOCK_SECONDS, как
+        подписки в свипе продления.
+
+        :param limit: максимальный размер пачки
+        :return: список именованных кортежей (id, user_uuid, grace_until)
+        """
+        if limit is None:
+            limit = settings.RENEWAL_SWEEP_CHUNK_SIZE
+
+        now = timezone.now()
+        with transaction.atomic():
+            due = list(
+                RenewalRetry.objects.select_for_update(skip_locked=True, of=("self",))
+                .filter(status="scheduled", next_retry_at__lte=now)
+                .filter(Q(locked_until__isnull=True) | Q(locked_until__lte=now))
+                .order_by("next_retry_at")
+                .annotate(user_uuid=F("subscription__user_uuid"))
+                .values_list("id", "user_uuid", "grace_until", named=True)[:limit]
+            )
+            if due:
+                RenewalRetry.objects.filter(id__in=[row.id for row in due]).update(
+                    locked_until=now
+                    + timedelta(seconds=settings.RENEWAL_SWEEP_LOCK_SECONDS)
+                )
+
+        return due
+
+    @classmethod
+    def apply_retry(
+        cls,
+        retry_id: int,
+        attempt: int,
+        payment_method_id: str,
+        payment_data: dict,
+    ) -> str:
+        """
+        Применить результат повторного списания.
+
+        Если номер попытки уже не совпадает, результат уже применен
+        и повторно ничего не меняется.
+
+        Повторяется только отклоненное (canceled) списание. Неоконченное
+        (pending) закрывает попытку со статусом cancelled: его исход применит
+        вебхук или сверка, а новая попытка с новым ключом идемпотентности
+        списала бы деньги второй раз.
+
+        :param attempt: количество отказов на момент списания
+        :param payment_data: ответ charge_autopayment
+        :return: новый статус попытки: recovered, scheduled, failed или cancelled
+        """
+        with transaction.atomic():
+            retry = (
+                RenewalRetry.objects.select_for_update()
+                .select_related("subscription")
+                .get(id=retry_id)
+            )
+            if retry.status != "scheduled" or retry.attempts != attempt:
+                return retry.status
+
+            subscription = retry.subscription
+            now = timezone.now()
+            retry.locked_until = None
+            if (
+                subscription.status != "past_due"
+                or subscription.end_date != retry.period_end
+            ):
+                # Подписку продлили вручную или отменили
+                retry.status = "cancelled"
+            elif payment_data["status"] == "succeeded":
+                SubscriptionLogic.store_renewal(
+                    subscription, payment_method_id, payment_data
+                )
+                retry.status = "recovered"
+            elif payment_data["status"] != "canceled":
+                SubscriptionLogic.store_pending_autopayment(
+                    subscription, payment_method_id, payment_data
+                )
+                retry.status = "cancelled"
+            else:
+                retry.attempts += 1
+                retry.decline_reason = cls.decline_reason(payment_data)
+                retry.next_retry_at = cls.next_retry_at(
+                    retry.attempts, retry.grace_until, retry.decline_reason, now
+                )
+                if retry.next_retry_at is None:
+                    SubscriptionLogic.store_cancelled(subscription)
+                    retry.status = "failed"
+
+            if retry.status != "scheduled":
+                retry.next_retry_at = None
+                retry.finished_at = now
+            retry.save()
+
+        return retry.status
+
+    @classmethod
+    def finish_retries(cls, retry_ids: list[int], cancel_subscriptions: bool) -> int:
+        """
+        Завершить попытки без списания.
+
+        :param cancel_subscriptions: отменить подписки в past_due (продлить
+            нечем), иначе подписка уже вышла из past_due и попытки просто
+            закрываются
+        :return: количество завершенных попыток
+        """
+        with transaction.atomic():
+            retries = list(
+                RenewalRetry.objects.select_for_update()
+                .filter(id__in=retry_ids, status="scheduled")
+                .values_list("id", "subscription_id")
+            )
+            RenewalRetry.objects.filter(id__in=[pk for pk, _ in retries]).update(
+                status="failed" if cancel_subscriptions else "cancelled",
+                next_retry_at=None,
+                locked_until=None,
+                finished_at=timezone.now(),
+            )
+
+            if cancel_subscriptions:
+                subscriptions = list(
+                    Subscription.objects.select_for_update().filter(
+                        id__in=[subscription_id for _, subscription_id in retries],
+                        status="past_due",
+                    )
+                )
+                for subscription in subscriptions:
+                    subscription.status = "cancelled"
+                if subscriptions:
+                    Subscription.objects.bulk_update(subscriptions, ["status"])
+                    EntitlementLogic.refresh_many(subscriptions)
+                    SubscriptionCache.invalidate_many(
+                        subscription.user_uuid for subscription in subscriptions
+                    )
+
+        return len(retries)
+
+    @classmethod
+    def report(cls, since: datetime | None = None) -> dict:
+        """
+        Отчет о повторных списаниях, начатых после since.
+
+        recovery_rate - доля продленных подписок среди завершенных попыток
+        (без закрытых из-за ручного продления, отмены или списания в pending).
+        """
+        retries = RenewalRetry.objects.all()
+        if since is not None:
+            retries = retries.filter(created_at__gte=since)
+
+        by_status = dict(
+            retries.values_list("status").annotate(count=Count("id")).order_by()
         )
+        recovered = by_status.get("recovered", 0)
+        failed = by_status.get("failed", 0)
+        return {
+            "started": sum(by_status.values()),
+            "scheduled": by_status.get("scheduled", 0),
+            "recovered": recovered,
+            "failed": failed,
+            "cancelled": by_status.get("cancelled", 0),
+            "recovery_rate": (
+                recovered / (recovered + failed) if recovered + failed else None
+            ),
+            # Сколько продлений прошло с N-й повторной попытки
+            "recovered_by_attempt": dict(
+                retries.filter(status="recovered")
+                .values_list("attempts")
+                .annotate(count=Count("id"))
+                .order_by("attempts")
+            ),
+            "decline_reasons": dict(
+                retries.values_list("decline_reason")
+                .annotate(count=Count("id"))
+                .order_by("-count")[:10]
+            ),
+        }
+
+
+class PaymentEventLogic:
+    """
+    Прием уведомлений ЮKassa через таблицу payment_event.
+
+    Ручка только сохраняет уведомление с ключом дедупликации и сразу отвечает 200,
+    а изменения подписки применяются таской process_payment_events пачками.
+    Уведомление помечается обработанным в той же транзакции, что и изменения
+    подписки, поэтому каждое уведомление применяется ровно один раз.
+    Пачка применяется apply_notifications за фиксированное число запросов.
+    """
+
+    @staticmethod
+    def parse_notification(body: bytes) -> tuple[str, str, dict] | None:
+        """
+        Разобрать тело вебхука ЮKassa.
+
+        :return: событие, ID объекта в ЮKassa и тело уведомления или None,
+            если тело невалидно
+        """
+        try:
+            payload = json.loads(body)
+        except json.JSONDecodeError:
+            return None
+
+        if not isinstance(payload, dict) or not isinstance(payload.get("object"), dict):
+            return None
+
+        event = payload.get("event")
+        yk_payment_id = payload["object"].get("id")
+        if not event or not yk_payment_id:
+            return None
+        return str(event), str(yk_payment_id), payload
 
     @classmethod
-    def create_auto_payment_task(cls, subscription_id: int, days: int) -> PeriodicTask:
-        task_name = f"auto_payment_{subscription_id}"
-        task_path = "apps.sub.tasks.make_autopayment"
-        make_autopayment_time = timezone.now() + timedelta(days=days)
-        task_kwargs = {"subscription_id": subscription_id}
+    def store_event(cls, event: str, yk_payment_id: str, payload: dict) -> bool:
+        """
+        Сохранить уведомление, если такое еще не приходило.
 
-        clocked_schedule = ClockedSchedule.objects.create(
-            clocked_time=make_autopayment_time
+        :param event: событие, например payment.succeeded
+        :param yk_payment_id: ID объекта уведомления в ЮKassa
+        :param payload: тело уведомления
+        :return: True, если уведомление новое
+        """
+        _, created = PaymentEvent.objects.get_or_create(
+            dedupe_key=f"{event}:{yk_payment_id}",
+            defaults={
+                "event": event,
+                "yk_payment_id": yk_payment_id,
+                "payload": payload,
+            },
         )
+        return created
 
-        return PeriodicTask.objects.create(
-            clocked=clocked_schedule,
-            name=task_name,
-            task=task_path,
-            kwargs=json.dumps(task_kwargs),
-            one_off=True,
+    @classmethod
+    async def astore_event(cls, event: str, yk_payment_id: str, payload: dict) -> bool:
+        """Асинхронная версия store_event"""
+        _, created = await PaymentEvent.objects.aget_or_create(
+            dedupe_key=f"{event}:{yk_payment_id}",
+            defaults={
+                "event": event,
+                "yk_payment_id": yk_payment_id,
+                "payload": payload,
+            },
         )
+        return created
+
+    @classmethod
+    def process_events(cls, limit: int | None = None) -> int:
+        """
+        Применить пачку необработанных уведомлений.
+
+        Пачка блокируется через SKIP LOCKED, поэтому несколько воркеров
+        могут разбирать очередь параллельно.
+
+        :param limit: максимальный размер пачки
+        :return: количество взятых в обработку уведомлений
+        """
+        if limit is None:
+            limit = settings.PAYMENT_EVENTS_BATCH_SIZE
+
+        with transaction.atomic():
+            events = list(
+                PaymentEvent.objects.select_for_update(skip_locked=True)
+                .filter(status="new")
+                .order_by("id")[:limit]
+            )
+            cls.apply_events(events)
+
+        return len(events)
+
+    @classmethod
+    def replay_events(
+        cls,
+        status: str,
+        after_id: int = 0,
+        until_id: int | None = None,
+        limit: int | None = None,
+    ) -> int | None:
+        """
+        Повторно применить пачку уже обработанных уведомлений, например failed
+        после исправления ошибки.
+
+        :param status: статус уведомлений
+        :param after_id: применить уведомления с ID больше after_id
+        :param until_id: и не больше until_id
+        :param limit: максимальный размер пачки
+        :return: ID последнего уведомления пачки или None, если уведомлений нет
+        """
+        if limit is None:
+            limit = settings.PAYMENT_EVENTS_BATCH_SIZE
+
+        with transaction.atomic():
+            events = PaymentEvent.objects.select_for_update(skip_locked=True).filter(
+                status=status, id__gt=after_id
+            )
+            if until_id is not None:
+                events = events.filter(id__lte=until_id)
+            events = list(events.order_by("id")[:limit])
+            cls.apply_events(events)
+
+        return events[-1].pk if events else None
 
     @classmethod
-    def remove_periodic_task_with_clocked(cls, periodic_task: PeriodicTask) -> None:
-        # Удаляем периодическую таску из БД
-        clocked = periodic_task.clocked
+    def apply_events(cls, events: list[PaymentEvent]) -> None:
+        """
+        Применить уведомления одной пачкой и сохранить их статусы.
+        Вызывается в транзакции, в которой уведомления заблокированы.
 
-        periodic_task.delete()
+        Если пачка не применилась, уведомления применяются по одному, чтобы
+        ошибка одного не мешала остальным.
+        """
+        import logging
+
+        logger = logging.getLogger("sub")
+
+        if not events:
+            return
+
+        results: list[bool | None]
+        try:
+            with transaction.atomic():
+                results = cls.apply_notifications([event.payload for event in events])
+        except Exception:
+            logger.exception(
+                f"Не удалось применить пачку из {len(events)} уведомлений, "
+                "применяем по одному"
+            )
+            results = []
+            for event in events:
+                try:
+                    # Savepoint: ошибка одного уведомления не откатывает пачку
+                    with transaction.atomic():
+                        results.append(cls.apply_notification(event.payload))
+                except Exception:
+                    logger.exception(f"Не удалось обработать уведомление {event}")
+                    results.append(None)
+
+        now = timezone.now()
+        for event, is_applied in zip(events, results):
+            if is_applied is None:
+                event.status = "failed"
+            else:
+                event.status = "processed" if is_applied else "skipped"
+            event.processed_at = now
+
+        PaymentEvent.objects.bulk_update(events, ["status", "processed_at"])
+
+    @classmethod
+    def apply_notification(cls, payload: dict) -> bool:
+        """
+        Применить уведомление ЮKassa к подписке.
+
+        :param payload: тело уведомления
+        :return: False, если платеж из уведомления не найден
+        """
+        return cls.apply_notifications([payload])[0]
+
+    @classmethod
+    def apply_notifications(cls, payloads: list[dict]) -> list[bool]:
+        """
+        Применить пачку уведомлений ЮKassa к подпискам в одной транзакции.
+
+        Платежи и их подписки читаются одним запросом с блокировкой строк,
+        изменения пишутся bulk запросами. Уведомления применяются в порядке
+        списка: если по подписке в пачке несколько уведомлений, остается
+        результат последнего.
+
+        :param payloads: тела уведомлений
+        :return: по каждому уведомлению False, если платеж не найден
+        """
+        payments = [WebhookNotification(payload).object for payload in payloads]
+
+        with transaction.atomic():
+            # Уведомление - самая свежая версия платежа, обновляем зеркало
+            mirror = [
+                yookassa_api.payment_info(payload["object"])
+                for payload in payloads
+                if payload.get("event", "").startswith("payment.")
+            ]
+            if mirror:
+                ProviderPaymentLogic.upsert(mirror)
+
+            # Блокируем подписки в порядке ID, чтобы параллельные пачки
+            # не ждали друг друга по кругу
+            payments_db = {
+                payment_db.yk_payment_id: payment_db
+                for payment_db in PaymentModel.objects.select_related("subscription")
+                .select_for_update(of=("self", "subscription"))
+                .filter(yk_payment_id__in={payment.id for payment in payments})
+                .order_by("subscription_id", "id")
+            }
+            subscriptions: dict[int, Subscription] = {}
+            for payment_db in payments_db.values():
+                # Платежи одной подписки ссылаются на один объект
+                payment_db.subscription = subscriptions.setdefault(
+                    payment_db.subscription_id, payment_db.subscription
+                )
+            initial_status = {pk: sub.status for pk, sub in subscriptions.items()}
+
+            results = []
+            changed_payments: dict[int, PaymentModel] = {}
+            for payment in payments:
+                payment_db = payments_db.get(payment.id)
+                if payment_db is None:
+                    results.append(False)
+                    continue
+                subscription = payment_db.subscription
+
+                # Если платеж прошел
+                if payment.paid is True:
+                    # Ставим статус active. Продление или остановку подписки
+                    # по end_date выполнит свип продления (beats.renewal_sweep)
+                    subscription.status = "active"
+
+                    # Если установленно автоматическое продление подписки
+                    if (
+                        subscription.auto_renew
+                        and payment.payment_method
+                        and payment_db.yk_payment_method_id != payment.payment_method.id
+                    ):
+                        payment_db.yk_payment_method_id = payment.payment_method.id
+                        changed_payments[payment_db.pk] = payment_db
+                else:
+                    # Если оплата не прошла
+                    subscription.status = "cancelled"
+                results.append(True)
+
+            if changed_payments:
+                PaymentModel.objects.bulk_update(
+                    changed_payments.values(), ["yk_payment_method_id"]
+                )
+
+            changed_subscriptions = [
+                subscription
+                for pk, subscription in subscriptions.items()
+                if subscription.status != initial_status[pk]
+            ]
+            if changed_subscriptions:
+                Subscription.objects.bulk_update(changed_subscriptions, ["status"])
+                EntitlementLogic.refresh_many(changed_subscriptions)
+                SubscriptionCache.invalidate_many(
+                    subscription.user_uuid for subscription in changed_subscriptions
+                )
 
-        assert isinstance(clocked, ClockedSchedule)
-        clocked.delete()
+        return results
@@ -0,0 +1,257 @@
+"""
+Метрики Prometheus приложения Sub.
+
+Если задана переменная PROMETHEUS_MULTIPROC_DIR, метрики пишутся в общий каталог
+(multiprocess режим prometheus_client) и собираются со всех воркеров gunicorn
+и дочерних процессов celery. Каталог должен быть свой у каждого контейнера.
+"""
+
+import asyncio
+import functools
+import os
+import time
+from typing import Callable
+
+import redis
+from celery import signals
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+from prometheus_client import (
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    multiprocess,
+    start_http_server,
+)
+from prometheus_client.core import GaugeMetricFamily
+
+from apps.back import celery_app
+from apps.back.settings import task_queues
+from .models import Subscription
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+PROVIDER_LATENCY = Histogram(
+    "yookassa_request_seconds",
+    "Время запроса к API ЮKassa",
+    ["method", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+VIEW_LATENCY = Histogram(
+    "sub_view_request_seconds",
+    "Время обработки запроса ручкой",
+    ["view", "action", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+SUBSCRIPTION_CACHE_REQUESTS = Counter(
+    "subscription_cache_requests",
+    "Чтения подписок из кэша по результату (hit/miss/error)",
+    ["result"],
+)
+TASK_DURATION = Histogram(
+    "celery_task_seconds",
+    "Время выполнения таски Celery",
+    ["task", "state"],
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600),
+)
+
+
+def observe_provider(func: Callable) -> Callable:
+    """
+    Декоратор метода клиента ЮKassa: пишет время вызова и исход (success/error)
+    """
+    method = func.__name__
+
+    if asyncio.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            outcome = "error"
+            try:
+                result = await func(*args, **kwargs)
+                outcome = "success"
+                return result
+            finally:
+                PROVIDER_LATENCY.labels(method, outcome).observe(
+                    time.perf_counter() - started
+                )
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            result = func(*args, **kwargs)
+            outcome = "success"
+            return result
+        finally:
+            PROVIDER_LATENCY.labels(method, outcome).observe(
+                time.perf_counter() - started
+            )
+
+    return wrapper
+
+
+def observe_view(func: Callable) -> Callable:
+    """
+    Декоратор async view: пишет время обработки запроса
+    """
+
+    @functools.wraps(func)
+    async def wrapper(request, *args, **kwargs):
+        started = time.perf_counter()
+        status = 500
+        try:
+            response = await func(request, *args, **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            VIEW_LATENCY.labels("async", func.__name__, status).observe(
+                time.perf_counter() - started
+            )
+
+    return wrapper
+
+
+class ViewMetricsMixin:
+    """
+    Примесь для ViewSet: пишет время обработки запроса по action
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        started = time.perf_counter()
+        response = super().dispatch(request, *args, **kwargs)
+        VIEW_LATENCY.labels(
+            type(self).__name__,
+            getattr(self, "action", None) or request.method.lower(),
+            response.status_code,
+        ).observe(time.perf_counter() - started)
+        return response
+
+
+# Время старта выполняемых тасок процесса по task_id
+_task_started: dict[str, float] = {}
+
+
+@signals.task_prerun.connect
+def _on_task_prerun(task_id: str, **kwargs) -> None:
+    _task_started[task_id] = time.perf_counter()
+
+
+@signals.task_postrun.connect
+def _on_task_postrun(task_id: str, task, state: str | None = None, **kwargs) -> None:
+    started = _task_started.pop(task_id, None)
+    if started is not None:
+        TASK_DURATION.labels(task.name, state or "UNKNOWN").observe(
+            time.perf_counter() - started
+        )
+
+
+class CeleryQueueCollector:
+    """
+    Длина очередей Celery в брокере Redis на момент сбора метрик
+    """
+
+    def collect(self):
+        gauge = GaugeMetricFamily(
+            "celery_queue_length", "Количество тасок в очереди", labels=["queue"]
+        )
+        broker_url = celery_app.conf.broker_url
+        if not broker_url.startswith("redis://"):
+            return
+
+        # Очереди из task_queues: шарды charges_<N> и приоритетная очередь
+        # списаний выбираются при отправке и в task_routes не попадают
+        queues = sorted(task_queues)
+        client = redis.Redis.from_url(broker_url)
+        try:
+            with client.pipeline(transaction=False) as pipe:
+                for queue in queues:
+                    pipe.llen(queue)
+                lengths = pipe.execute()
+        except redis.RedisError:
+            return
+        finally:
+            client.close()
+
+        for queue, length in zip(queues, lengths):
+            gauge.add_metric([queue], length)
+        yield gauge
+
+
+class SubscriptionStatusCollector:
+    """
+    Количество подписок по статусам. Результат кэшируется, чтобы частый сбор
+    метрик не нагружал БД группировкой по всей таблице
+    """
+
+    cache_key = "sub:metrics:subscriptions_by_status"
+
+    def collect(self):
+        counts = cache.get(self.cache_key)
+        if counts is None:
+            counts = dict(
+                Subscription.objects.values_list("status")
+                .annotate(count=Count("id"))
+                .order_by()
+            )
+            cache.set(self.cache_key, counts, settings.METRICS_SUBSCRIPTIONS_TTL)
+
+        gauge = GaugeMetricFamily(
+            "subscriptions", "Количество подписок по статусам", labels=["status"]
+        )
+        for status, _ in Subscription.STATUS_CHOICES:
+            gauge.add_metric([status], counts.get(status, 0))
+        yield gauge
+
+
+def build_registry(include_subscriptions: bool = True) -> CollectorRegistry:
+    """
+    Реестр для отдачи метрик: метрики процесса (или всех процессов в multiprocess
+    режиме), длины очередей Celery и, по желанию, подписки по статусам.
+    """
+    registry = CollectorRegistry()
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry.register(_ProcessRegistryCollector())
+
+    registry.register(CeleryQueueCollector())
+    if include_subscriptions:
+        registry.register(SubscriptionStatusCollector())
+    return registry
+
+
+class _ProcessRegistryCollector:
+    """Метрики стандартного реестра текущего процесса"""
+
+    def collect(self):
+        return REGISTRY.collect()
+
+
+@signals.worker_ready.connect
+def _start_worker_metrics_server(**kwargs) -> None:
+    """
+    Отдает метрики воркера Celery на CELERY_METRICS_PORT.
+    Таски выполняются в дочерних процессах, поэтому нужен multiprocess режим
+    """
+    import logging
+
+    logger = logging.getLogger("sub")
+
+    if settings.CELERY_METRICS_PORT is None:
+        return
+
+    try:
+        start_http_server(
+            settings.CELERY_METRICS_PORT,
+            registry=build_registry(include_subscriptions=False),
+        )
+    except OSError:
+        # Порт уже занят другим узлом celery multi, он отдает те же метрики
+        logger.info(f"Порт метрик {settings.CELERY_METRICS_PORT} уже занят")
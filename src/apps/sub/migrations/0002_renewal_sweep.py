@@ -0,0 +1,59 @@
+# Generated by Django 5.1.4 on 2026-10-17 19:17
+
+from django.db import migrations, models
+
+LEGACY_TASKS = (
+    "apps.sub.tasks.make_autopayment",
+    "apps.sub.tasks.stop_subscription",
+)
+
+
+def remove_legacy_periodic_tasks(apps, schema_editor):
+    # Продление теперь выполняет свип по end_date, поэтому одноразовые задачи
+    # на каждую подписку и их ClockedSchedule больше не нужны
+    PeriodicTask = apps.get_model("django_celery_beat", "PeriodicTask")
+    ClockedSchedule = apps.get_model("django_celery_beat", "ClockedSchedule")
+
+    legacy_tasks = PeriodicTask.objects.filter(task__in=LEGACY_TASKS)
+    clocked_ids = list(
+        legacy_tasks.exclude(clocked__isnull=True).values_list("clocked_id", flat=True)
+    )
+
+    legacy_tasks.delete()
+    ClockedSchedule.objects.filter(id__in=clocked_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sub", "0001_initial"),
+        ("django_celery_beat", "0019_alter_periodictasks_options"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            remove_legacy_periodic_tasks,
+            migrations.RunPython.noop,
+        ),
+        migrations.RemoveField(
+            model_name="autosubscriptiontasks",
+            name="subscription",
+        ),
+        migrations.RemoveField(
+            model_name="autosubscriptiontasks",
+            name="task",
+        ),
+        migrations.AddField(
+            model_name="subscription",
+            name="sweep_locked_until",
+            field=models.DateTimeField(
+                blank=True,
+                help_text="Подписка забрана свипом продления и ждет обработки в таске",
+                null=True,
+                verbose_name="Заблокирована для продления до",
+            ),
+        ),
+        migrations.DeleteModel(
+            name="AutoSubscriptionTasks",
+        ),
+    ]
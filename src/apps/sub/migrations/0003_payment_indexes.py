@@ -0,0 +1,122 @@
+# Generated by Django 5.1.4 on 2026-10-17 19:22
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+PAYMENT_INDEXES = (
+    "payment_user_history_idx",
+    "payment_saved_method_idx",
+    "payment_yk_payment_id_uniq",
+)
+
+
+def drop_invalid_indexes(apps, schema_editor):
+    # Прерванный CREATE INDEX CONCURRENTLY оставляет невалидный индекс:
+    # запросы его не используют, а повторное создание с тем же именем падает
+    # или пропускается через IF NOT EXISTS. Удаляем такие индексы перед
+    # построением
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT index_class.relname FROM pg_index "
+            "JOIN pg_class index_class ON index_class.oid = pg_index.indexrelid "
+            "JOIN pg_class table_class ON table_class.oid = pg_index.indrelid "
+            "WHERE table_class.relname = 'payment' AND NOT pg_index.indisvalid "
+            "AND index_class.relname = ANY(%s)",
+            [list(PAYMENT_INDEXES)],
+        )
+        invalid_indexes = [name for (name,) in cursor.fetchall()]
+
+    for name in invalid_indexes:
+        schema_editor.execute(
+            f"DROP INDEX CONCURRENTLY IF EXISTS {schema_editor.quote_name(name)}"
+        )
+
+
+def merge_duplicate_payments(apps, schema_editor):
+    # Вебхук, примененный дважды, мог сохранить один платеж ЮKassa несколько
+    # раз. Оставляем первую строку, переносим в нее сохраненный способ оплаты
+    # из дублей и удаляем дубли, иначе уникальный индекс не построится
+    Payment = apps.get_model("sub", "Payment")
+
+    duplicates = (
+        Payment.objects.values("yk_payment_id")
+        .annotate(count=Count("id"), first_id=Min("id"))
+        .filter(count__gt=1)
+        .order_by()
+    )
+    for duplicate in duplicates.iterator():
+        payments = Payment.objects.filter(yk_payment_id=duplicate["yk_payment_id"])
+        payment_method_id = (
+            payments.exclude(yk_payment_method_id__isnull=True)
+            .order_by("-id")
+            .values_list("yk_payment_method_id", flat=True)
+            .first()
+        )
+        if payment_method_id is not None:
+            payments.filter(
+                id=duplicate["first_id"], yk_payment_method_id__isnull=True
+            ).update(yk_payment_method_id=payment_method_id)
+        payments.exclude(id=duplicate["first_id"]).delete()
+
+
+class Migration(migrations.Migration):
+    # Индексы строятся CONCURRENTLY, чтобы не блокировать запись в payment
+    atomic = False
+
+    dependencies = [
+        ("sub", "0002_renewal_sweep"),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_invalid_indexes, migrations.RunPython.noop),
+        AddIndexConcurrently(
+            model_name="payment",
+            index=models.Index(
+                fields=["user_uuid", "-payment_date", "-id"],
+                name="payment_user_history_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="payment",
+            index=models.Index(
+                condition=models.Q(("yk_payment_method_id__isnull", False)),
+                fields=["subscription", "-id"],
+                name="payment_saved_method_idx",
+            ),
+        ),
+        # Дубли удаляются в одной транзакции прямо перед уникальным индексом
+        migrations.RunPython(
+            merge_duplicate_payments, migrations.RunPython.noop, atomic=True
+        ),
+        # Уникальный индекс строится CONCURRENTLY и затем превращается в ограничение
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    sql=(
+                        "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS "
+                        "payment_yk_payment_id_uniq ON payment (yk_payment_id)"
+                    ),
+                    reverse_sql="DROP INDEX CONCURRENTLY IF EXISTS payment_yk_payment_id_uniq",
+                ),
+                migrations.RunSQL(
+                    sql=(
+                        "ALTER TABLE payment ADD CONSTRAINT payment_yk_payment_id_uniq "
+                        "UNIQUE USING INDEX payment_yk_payment_id_uniq"
+                    ),
+                    reverse_sql=(
+                        "ALTER TABLE payment DROP CONSTRAINT IF EXISTS "
+                        "payment_yk_payment_id_uniq"
+                    ),
+                ),
+            ],
+            state_operations=[
+                migrations.AddConstraint(
+                    model_name="payment",
+                    constraint=models.UniqueConstraint(
+                        fields=("yk_payment_id",), name="payment_yk_payment_id_uniq"
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 5.1.4 on 2026-10-17 19:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sub", "0003_payment_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PaymentEvent",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "dedupe_key",
+                    models.CharField(
+                        help_text="Событие и ID платежа, повторы вебхука с тем же ключом игнорируются",
+                        max_length=255,
+                        unique=True,
+                        verbose_name="Ключ дедупликации",
+                    ),
+                ),
+                ("event", models.CharField(max_length=100, verbose_name="Событие")),
+                (
+                    "yk_payment_id",
+                    models.CharField(
+                        max_length=255, verbose_name="ID объекта в ЮKassa"
+                    ),
+                ),
+                ("payload", models.JSONField(verbose_name="Тело уведомления")),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("new", "New"),
+                            ("processed", "Processed"),
+                            ("skipped", "Skipped"),
+                            ("failed", "Failed"),
+                        ],
+                        default="new",
+                        max_length=20,
+                        verbose_name="Статус обработки",
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        auto_now_add=True, verbose_name="Дата получения"
+                    ),
+                ),
+                (
+                    "processed_at",
+                    models.DateTimeField(
+                        blank=True, null=True, verbose_name="Дата обработки"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Уведомление ЮKassa",
+                "verbose_name_plural": "Уведомления ЮKassa",
+                "db_table": "payment_event",
+                "indexes": [
+                    models.Index(
+                        condition=models.Q(("status", "new")),
+                        fields=["id"],
+                        name="payment_event_new_idx",
+                    )
+                ],
+            },
+        ),
+    ]
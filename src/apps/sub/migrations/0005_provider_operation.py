@@ -0,0 +1,93 @@
+# Generated by Django 5.1.4 on 2026-10-17 19:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sub", "0004_payment_event"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ProviderOperation",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("operation", models.CharField(max_length=50, verbose_name="Операция")),
+                (
+                    "reference",
+                    models.CharField(
+                        help_text="Что именно оплачивается или возвращается, например подписка и период",
+                        max_length=255,
+                        verbose_name="Ссылка на объект",
+                    ),
+                ),
+                (
+                    "idempotence_key",
+                    models.UUIDField(verbose_name="Ключ идемпотентности"),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Pending"),
+                            ("succeeded", "Succeeded"),
+                            ("failed", "Failed"),
+                        ],
+                        default="pending",
+                        max_length=20,
+                        verbose_name="Статус",
+                    ),
+                ),
+                (
+                    "attempts",
+                    models.PositiveIntegerField(default=1, verbose_name="Попыток"),
+                ),
+                (
+                    "yk_object_id",
+                    models.CharField(
+                        blank=True,
+                        max_length=255,
+                        null=True,
+                        verbose_name="ID объекта в ЮKassa",
+                    ),
+                ),
+                (
+                    "error",
+                    models.TextField(
+                        blank=True, null=True, verbose_name="Последняя ошибка"
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        auto_now_add=True, verbose_name="Дата создания"
+                    ),
+                ),
+                (
+                    "updated_at",
+                    models.DateTimeField(auto_now=True, verbose_name="Дата обновления"),
+                ),
+            ],
+            options={
+                "verbose_name": "Операция в ЮKassa",
+                "verbose_name_plural": "Операции в ЮKassa",
+                "db_table": "provider_operation",
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("operation", "reference"),
+                        name="provider_operation_uniq",
+                    )
+                ],
+            },
+        ),
+    ]
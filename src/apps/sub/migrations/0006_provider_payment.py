@@ -0,0 +1,131 @@
+# Generated by Django 5.1.4 on 2026-10-17 19:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sub", "0005_provider_operation"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SyncCheckpoint",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "name",
+                    models.CharField(
+                        max_length=100, unique=True, verbose_name="Синхронизация"
+                    ),
+                ),
+                ("position", models.JSONField(default=dict, verbose_name="Позиция")),
+                (
+                    "locked_until",
+                    models.DateTimeField(
+                        blank=True,
+                        help_text="Запуск синхронизации держит блокировку, чтобы не было параллельных запусков",
+                        null=True,
+                        verbose_name="Выполняется до",
+                    ),
+                ),
+                (
+                    "updated_at",
+                    models.DateTimeField(auto_now=True, verbose_name="Дата обновления"),
+                ),
+            ],
+            options={
+                "verbose_name": "Позиция синхронизации",
+                "verbose_name_plural": "Позиции синхронизации",
+                "db_table": "sync_checkpoint",
+            },
+        ),
+        migrations.CreateModel(
+            name="ProviderPayment",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "yk_payment_id",
+                    models.CharField(
+                        max_length=255, unique=True, verbose_name="ID платежа в ЮKassa"
+                    ),
+                ),
+                (
+                    "user_uuid",
+                    models.UUIDField(
+                        blank=True,
+                        help_text="metadata.user_id платежа",
+                        null=True,
+                        verbose_name="UUID пользователя",
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(max_length=50, verbose_name="Статус в ЮKassa"),
+                ),
+                ("paid", models.BooleanField(default=False, verbose_name="Оплачен")),
+                (
+                    "amount",
+                    models.DecimalField(
+                        decimal_places=2, max_digits=10, verbose_name="Сумма платежа"
+                    ),
+                ),
+                ("currency", models.CharField(max_length=3, verbose_name="Валюта")),
+                (
+                    "description",
+                    models.TextField(blank=True, null=True, verbose_name="Описание"),
+                ),
+                (
+                    "payment_method_id",
+                    models.CharField(
+                        blank=True,
+                        max_length=255,
+                        null=True,
+                        verbose_name="ID способа оплаты",
+                    ),
+                ),
+                ("metadata", models.JSONField(default=dict, verbose_name="Метаданные")),
+                (
+                    "created_at",
+                    models.DateTimeField(verbose_name="Дата создания в ЮKassa"),
+                ),
+                (
+                    "synced_at",
+                    models.DateTimeField(
+                        auto_now=True, verbose_name="Дата синхронизации"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Платеж в ЮKassa",
+                "verbose_name_plural": "Платежи в ЮKassa",
+                "db_table": "provider_payment",
+                "indexes": [
+                    models.Index(
+                        fields=["user_uuid", "-created_at"],
+                        name="provider_payment_user_idx",
+                    ),
+                    models.Index(
+                        fields=["created_at"], name="provider_payment_created_idx"
+                    ),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 5.1.4 on 2026-10-17 19:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Доступы по существующим подпискам одним запросом, без загрузки строк в память
+BACKFILL_SQL = """
+INSERT INTO entitlement (user_uuid, plan_id, active_until, auto_renew, updated_at)
+SELECT
+    user_uuid,
+    plan_id,
+    CASE WHEN status = 'active' THEN end_date END,
+    auto_renew,
+    CURRENT_TIMESTAMP
+FROM subscription
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sub", "0006_provider_payment"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Entitlement",
+            fields=[
+                (
+                    "user_uuid",
+                    models.UUIDField(
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="UUID пользователя",
+                    ),
+                ),
+                (
+                    "active_until",
+                    models.DateTimeField(
+                        blank=True,
+                        help_text="end_date активной подписки, пусто - доступа нет",
+                        null=True,
+                        verbose_name="Доступ до",
+                    ),
+                ),
+                (
+                    "auto_renew",
+                    models.BooleanField(default=False, verbose_name="Автопродление"),
+                ),
+                (
+                    "updated_at",
+                    models.DateTimeField(auto_now=True, verbose_name="Дата обновления"),
+                ),
+                (
+                    "plan",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="sub.plan",
+                        verbose_name="Тарифный план",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Доступ по подписке",
+                "verbose_name_plural": "Доступы по подписке",
+                "db_table": "entitlement",
+            },
+        ),
+        migrations.RunSQL(BACKFILL_SQL, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,137 @@
+# Generated by Django 5.1.4 on 2026-10-17 20:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sub", "0007_entitlement"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="subscription",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("active", "Active"),
+                    ("expired", "Expired"),
+                    ("cancelled", "Cancelled"),
+                    ("pending", "Pending"),
+                    ("past_due", "Past due"),
+                ],
+                max_length=20,
+                verbose_name="Статус подписки",
+            ),
+        ),
+        migrations.CreateModel(
+            name="RenewalRetry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "period_end",
+                    models.DateTimeField(
+                        help_text="end_date подписки на момент первого отказа",
+                        verbose_name="Продлеваемый период",
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("scheduled", "Scheduled"),
+                            ("recovered", "Recovered"),
+                            ("failed", "Failed"),
+                            ("cancelled", "Cancelled"),
+                        ],
+                        default="scheduled",
+                        max_length=20,
+                        verbose_name="Статус",
+                    ),
+                ),
+                (
+                    "attempts",
+                    models.PositiveIntegerField(default=1, verbose_name="Отказов"),
+                ),
+                (
+                    "next_retry_at",
+                    models.DateTimeField(
+                        blank=True, null=True, verbose_name="Следующая попытка"
+                    ),
+                ),
+                (
+                    "grace_until",
+                    models.DateTimeField(verbose_name="Льготный период до"),
+                ),
+                (
+                    "locked_until",
+                    models.DateTimeField(
+                        blank=True,
+                        help_text="Попытка забрана свипом и ждет обработки в таске",
+                        null=True,
+                        verbose_name="Заблокирована до",
+                    ),
+                ),
+                (
+                    "decline_reason",
+                    models.CharField(
+                        blank=True,
+                        max_length=100,
+                        null=True,
+                        verbose_name="Причина последнего отказа",
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        auto_now_add=True, verbose_name="Дата создания"
+                    ),
+                ),
+                (
+                    "finished_at",
+                    models.DateTimeField(
+                        blank=True, null=True, verbose_name="Дата завершения"
+                    ),
+                ),
+                (
+                    "subscription",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="sub.subscription",
+                        verbose_name="Подписка",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Повторное списание",
+                "verbose_name_plural": "Повторные списания",
+                "db_table": "renewal_retry",
+                "indexes": [
+                    models.Index(
+                        condition=models.Q(("status", "scheduled")),
+                        fields=["next_retry_at"],
+                        name="renewal_retry_due_idx",
+                    ),
+                    models.Index(
+                        fields=["created_at"], name="renewal_retry_created_idx"
+                    ),
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("subscription", "period_end"),
+                        name="renewal_retry_period_uniq",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.1.4 on 2026-10-17 20:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sub", "0008_renewal_retry"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SubscriptionEvent",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "event",
+                    models.CharField(
+                        choices=[("subscription.expired", "Subscription expired")],
+                        max_length=100,
+                        verbose_name="Событие",
+                    ),
+                ),
+                ("subscription_id", models.BigIntegerField(verbose_name="ID подписки")),
+                ("user_uuid", models.UUIDField(verbose_name="UUID пользователя")),
+                ("plan_id", models.BigIntegerField(verbose_name="ID тарифного плана")),
+                (
+                    "end_date",
+                    models.DateTimeField(verbose_name="Дата окончания подписки"),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        auto_now_add=True, verbose_name="Дата события"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Событие подписки",
+                "verbose_name_plural": "События подписок",
+                "db_table": "subscription_event",
+                "indexes": [
+                    models.Index(
+                        fields=["created_at", "id"],
+                        name="subscription_event_created_idx",
+                    )
+                ],
+            },
+        ),
+    ]
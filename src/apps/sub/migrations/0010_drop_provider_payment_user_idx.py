@@ -0,0 +1,21 @@
+# Generated by Django 5.1.4 on 2026-10-17 20:45
+
+from django.contrib.postgres.operations import RemoveIndexConcurrently
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # Индекс удаляется CONCURRENTLY, чтобы не блокировать запись в provider_payment
+    atomic = False
+
+    dependencies = [
+        ("sub", "0009_subscription_event"),
+    ]
+
+    operations = [
+        # История платежей пользователя читается из payment, индекс не использовался
+        RemoveIndexConcurrently(
+            model_name="providerpayment",
+            name="provider_payment_user_idx",
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.1.4 on 2026-10-17 20:50
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+def drop_invalid_index(apps, schema_editor):
+    # Прерванный CREATE INDEX CONCURRENTLY оставляет невалидный индекс,
+    # повторное создание с тем же именем упадет. Удаляем его перед построением
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_index "
+            "JOIN pg_class index_class ON index_class.oid = pg_index.indexrelid "
+            "WHERE index_class.relname = 'subscription_due_idx' "
+            "AND NOT pg_index.indisvalid"
+        )
+        invalid = cursor.fetchone() is not None
+
+    if invalid:
+        schema_editor.execute("DROP INDEX CONCURRENTLY IF EXISTS subscription_due_idx")
+
+
+class Migration(migrations.Migration):
+    # Индекс строится CONCURRENTLY, чтобы не блокировать запись в subscription
+    atomic = False
+
+    dependencies = [
+        ("sub", "0010_drop_provider_payment_user_idx"),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_invalid_index, migrations.RunPython.noop),
+        # Свип продления: активные подписки с наступившим end_date
+        AddIndexConcurrently(
+            model_name="subscription",
+            index=models.Index(
+                condition=models.Q(("status", "active")),
+                fields=["end_date"],
+                name="subscription_due_idx",
+            ),
+        ),
+    ]
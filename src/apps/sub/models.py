@@ -1,5 +1,4 @@
 from django.db import models
-from django_celery_beat.models import PeriodicTask
 
 
 class Plan(models.Model):
@@ -26,6 +25,8 @@ class Subscription(models.Model):
         ("expired", "Expired"),
         ("cancelled", "Cancelled"),
         ("pending", "Pending"),
+        # Автоплатеж отклонен, идут повторные списания (RenewalRetry)
+        ("past_due", "Past due"),
     ]
 
     user_uuid = models.UUIDField(verbose_name="UUID пользователя", unique=True)
@@ -39,16 +40,106 @@ class Subscription(models.Model):
     end_date = models.DateTimeField(verbose_name="Дата окончания")
     auto_renew = models.BooleanField(default=False, verbose_name="Автопродление")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+    sweep_locked_until = models.DateTimeField(
+        verbose_name="Заблокирована для продления до",
+        blank=True,
+        null=True,
+        help_text="Подписка забрана свипом продления и ждет обработки в таске",
+    )
 
     class Meta:
         db_table = "subscription"
         verbose_name = "Подписка"
         verbose_name_plural = "Подписки"
+        indexes = [
+            # Индекс для свипа продления: ищем только активные подписки по end_date
+            models.Index(
+                fields=["end_date"],
+                condition=models.Q(status="active"),
+                name="subscription_due_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"Subscription {self.id} for user {self.user_uuid}"
 
 
+class RenewalRetry(models.Model):
+    """
+    Повторные списания за период подписки после отклоненного автоплатежа.
+
+    Строка создается при первом отказе и живет до продления подписки,
+    исчерпания попыток или конца льготного периода. Свип повторных списаний
+    (DunningLogic) забирает строки с наступившим next_retry_at пачками.
+    """
+
+    STATUS_CHOICES = [
+        ("scheduled", "Scheduled"),
+        ("recovered", "Recovered"),
+        ("failed", "Failed"),
+        ("cancelled", "Cancelled"),
+    ]
+
+    subscription = models.ForeignKey(
+        Subscription, on_delete=models.CASCADE, verbose_name="Подписка"
+    )
+    period_end = models.DateTimeField(
+        verbose_name="Продлеваемый период",
+        help_text="end_date подписки на момент первого отказа",
+    )
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default="scheduled",
+        verbose_name="Статус",
+    )
+    attempts = models.PositiveIntegerField(default=1, verbose_name="Отказов")
+    next_retry_at = models.DateTimeField(
+        verbose_name="Следующая попытка", blank=True, null=True
+    )
+    grace_until = models.DateTimeField(verbose_name="Льготный период до")
+    locked_until = models.DateTimeField(
+        verbose_name="Заблокирована до",
+        blank=True,
+        null=True,
+        help_text="Попытка забрана свипом и ждет обработки в таске",
+    )
+    decline_reason = models.CharField(
+        max_length=100,
+        blank=True,
+        null=True,
+        verbose_name="Причина последнего отказа",
+    )
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+    finished_at = models.DateTimeField(
+        verbose_name="Дата завершения", blank=True, null=True
+    )
+
+    class Meta:
+        db_table = "renewal_retry"
+        verbose_name = "Повторное списание"
+        verbose_name_plural = "Повторные списания"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["subscription", "period_end"],
+                name="renewal_retry_period_uniq",
+            ),
+        ]
+        indexes = [
+            # Свип повторных списаний: ищем только ожидающие попытки
+            models.Index(
+                fields=["next_retry_at"],
+                condition=models.Q(status="scheduled"),
+                name="renewal_retry_due_idx",
+            ),
+            # Отчет о возврате подписок за период
+            models.Index(fields=["created_at"], name="renewal_retry_created_idx"),
+        ]
+
+    def __str__(self) -> str:
+        return f"RenewalRetry {self.subscription_id} {self.period_end}: {self.status}"
+
+
 class Payment(models.Model):
     subscription = models.ForeignKey(
         Subscription, on_delete=models.CASCADE, verbose_name="Подписка"
@@ -67,19 +158,244 @@ class Payment(models.Model):
         db_table = "payment"
         verbose_name = "Платеж"
         verbose_name_plural = "Платежи"
+        constraints = [
+            # Поиск платежа из вебхука ЮKassa
+            models.UniqueConstraint(
+                fields=["yk_payment_id"], name="payment_yk_payment_id_uniq"
+            ),
+        ]
+        indexes = [
+            # История платежей пользователя, новые сверху
+            models.Index(
+                fields=["user_uuid", "-payment_date", "-id"],
+                name="payment_user_history_idx",
+            ),
+            # Последний платеж подписки с сохраненным способом оплаты
+            models.Index(
+                fields=["subscription", "-id"],
+                condition=models.Q(yk_payment_method_id__isnull=False),
+                name="payment_saved_method_idx",
+            ),
+        ]
 
     def __str__(self) -> str:
         return f"Payment {self.id} for subscription {self.subscription_id}"
 
 
-class AutoSubscriptionTasks(models.Model):
-    subscription = models.ForeignKey(
-        Subscription, on_delete=models.CASCADE, verbose_name="Подписка", unique=True
+class PaymentEvent(models.Model):
+    STATUS_CHOICES = [
+        ("new", "New"),
+        ("processed", "Processed"),
+        ("skipped", "Skipped"),
+        ("failed", "Failed"),
+    ]
+
+    dedupe_key = models.CharField(
+        max_length=255,
+        unique=True,
+        verbose_name="Ключ дедупликации",
+        help_text="Событие и ID платежа, повторы вебхука с тем же ключом игнорируются",
+    )
+    event = models.CharField(max_length=100, verbose_name="Событие")
+    yk_payment_id = models.CharField(max_length=255, verbose_name="ID объекта в ЮKassa")
+    payload = models.JSONField(verbose_name="Тело уведомления")
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default="new",
+        verbose_name="Статус обработки",
     )
-    task = models.ForeignKey(
-        PeriodicTask,
-        verbose_name="Задача на операцию, связанную с подпиской",
-        on_delete=models.CASCADE,
-        default=None,
-        help_text="Задача на операцию, связанную с подпиской",
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата получения")
+    processed_at = models.DateTimeField(
+        verbose_name="Дата обработки", blank=True, null=True
+    )
+
+    class Meta:
+        db_table = "payment_event"
+        verbose_name = "Уведомление ЮKassa"
+        verbose_name_plural = "Уведомления ЮKassa"
+        indexes = [
+            # Очередь необработанных уведомлений
+            models.Index(
+                fields=["id"],
+                condition=models.Q(status="new"),
+                name="payment_event_new_idx",
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f"PaymentEvent {self.dedupe_key}"
+
+
+class SubscriptionEvent(models.Model):
+    """
+    Исходящие события подписок для внешних потребителей (outbox).
+
+    Событие пишется в той же транзакции, что и изменение подписки, поэтому
+    не теряется и не опережает его. Потребители забирают события
+    инкрементальной выгрузкой subscription_events (apps.sub.export).
+    """
+
+    EVENT_CHOICES = [
+        ("subscription.expired", "Subscription expired"),
+    ]
+
+    event = models.CharField(
+        max_length=100, choices=EVENT_CHOICES, verbose_name="Событие"
     )
+    # Без внешнего ключа: события остаются после удаления подписки
+    subscription_id = models.BigIntegerField(verbose_name="ID подписки")
+    user_uuid = models.UUIDField(verbose_name="UUID пользователя")
+    plan_id = models.BigIntegerField(verbose_name="ID тарифного плана")
+    end_date = models.DateTimeField(verbose_name="Дата окончания подписки")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата события")
+
+    class Meta:
+        db_table = "subscription_event"
+        verbose_name = "Событие подписки"
+        verbose_name_plural = "События подписок"
+        indexes = [
+            # Инкрементальная выгрузка по водяному знаку created_at
+            models.Index(
+                fields=["created_at", "id"], name="subscription_event_created_idx"
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f"SubscriptionEvent {self.event} {self.subscription_id}"
+
+
+class ProviderOperation(models.Model):
+    STATUS_CHOICES = [
+        ("pending", "Pending"),
+        ("succeeded", "Succeeded"),
+        ("failed", "Failed"),
+    ]
+
+    operation = models.CharField(max_length=50, verbose_name="Операция")
+    reference = models.CharField(
+        max_length=255,
+        verbose_name="Ссылка на объект",
+        help_text="Что именно оплачивается или возвращается, например подписка и период",
+    )
+    idempotence_key = models.UUIDField(verbose_name="Ключ идемпотентности")
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default="pending",
+        verbose_name="Статус",
+    )
+    attempts = models.PositiveIntegerField(default=1, verbose_name="Попыток")
+    yk_object_id = models.CharField(
+        max_length=255, blank=True, null=True, verbose_name="ID объекта в ЮKassa"
+    )
+    error = models.TextField(blank=True, null=True, verbose_name="Последняя ошибка")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата обновления")
+
+    class Meta:
+        db_table = "provider_operation"
+        verbose_name = "Операция в ЮKassa"
+        verbose_name_plural = "Операции в ЮKassa"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["operation", "reference"],
+                name="provider_operation_uniq",
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.operation} {self.reference}: {self.status}"
+
+
+class ProviderPayment(models.Model):
+    """Локальное зеркало платежей ЮKassa"""
+
+    yk_payment_id = models.CharField(
+        max_length=255, unique=True, verbose_name="ID платежа в ЮKassa"
+    )
+    user_uuid = models.UUIDField(
+        verbose_name="UUID пользователя",
+        blank=True,
+        null=True,
+        help_text="metadata.user_id платежа",
+    )
+    status = models.CharField(max_length=50, verbose_name="Статус в ЮKassa")
+    paid = models.BooleanField(default=False, verbose_name="Оплачен")
+    amount = models.DecimalField(
+        max_digits=10, decimal_places=2, verbose_name="Сумма платежа"
+    )
+    currency = models.CharField(max_length=3, verbose_name="Валюта")
+    description = models.TextField(blank=True, null=True, verbose_name="Описание")
+    payment_method_id = models.CharField(
+        max_length=255, blank=True, null=True, verbose_name="ID способа оплаты"
+    )
+    metadata = models.JSONField(default=dict, verbose_name="Метаданные")
+    created_at = models.DateTimeField(verbose_name="Дата создания в ЮKassa")
+    synced_at = models.DateTimeField(auto_now=True, verbose_name="Дата синхронизации")
+
+    class Meta:
+        db_table = "provider_payment"
+        verbose_name = "Платеж в ЮKassa"
+        verbose_name_plural = "Платежи в ЮKassa"
+        indexes = [
+            # Сверка платежей за период
+            models.Index(fields=["created_at"], name="provider_payment_created_idx"),
+        ]
+
+    def __str__(self) -> str:
+        return f"ProviderPayment {self.yk_payment_id}: {self.status}"
+
+
+class SyncCheckpoint(models.Model):
+    """Позиция фоновой синхронизации, чтобы следующий запуск продолжил с нее"""
+
+    name = models.CharField(max_length=100, unique=True, verbose_name="Синхронизация")
+    position = models.JSONField(default=dict, verbose_name="Позиция")
+    locked_until = models.DateTimeField(
+        verbose_name="Выполняется до",
+        blank=True,
+        null=True,
+        help_text="Запуск синхронизации держит блокировку, чтобы не было параллельных запусков",
+    )
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата обновления")
+
+    class Meta:
+        db_table = "sync_checkpoint"
+        verbose_name = "Позиция синхронизации"
+        verbose_name_plural = "Позиции синхронизации"
+
+    def __str__(self) -> str:
+        return f"SyncCheckpoint {self.name}"
+
+
+class Entitlement(models.Model):
+    """
+    Доступ пользователя по подписке.
+
+    Денормализованная копия подписки для проверок доступа: обновляется
+    в той же транзакции, что и подписка (EntitlementLogic). Доступ есть,
+    пока active_until больше текущего времени, поэтому истечение подписки
+    не требует записи в таблицу.
+    """
+
+    user_uuid = models.UUIDField(primary_key=True, verbose_name="UUID пользователя")
+    plan = models.ForeignKey(
+        Plan, on_delete=models.CASCADE, verbose_name="Тарифный план"
+    )
+    active_until = models.DateTimeField(
+        verbose_name="Доступ до",
+        blank=True,
+        null=True,
+        help_text="end_date активной подписки, пусто - доступа нет",
+    )
+    auto_renew = models.BooleanField(default=False, verbose_name="Автопродление")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата обновления")
+
+    class Meta:
+        db_table = "entitlement"
+        verbose_name = "Доступ по подписке"
+        verbose_name_plural = "Доступы по подписке"
+
+    def __str__(self) -> str:
+        return f"Entitlement {self.user_uuid} until {self.active_until}"
@@ -0,0 +1,104 @@
+"""
+Инкрементальная синхронизация платежей ЮKassa в локальное зеркало provider_payment.
+
+Список платежей ЮKassa отдается страницами новые сверху. Каждый проход
+забирает платежи, созданные после водяного знака (максимальный created_at
+прошлых проходов) минус перекрытие SYNC_OVERLAP: платеж может появиться
+в списке чуть позже своего created_at. Курсор страницы сохраняется после
+каждой страницы, поэтому прерванный проход продолжается со следующей
+страницы, а не с начала. Первый проход без водяного знака забирает всю
+историю магазина.
+
+Изменения статусов между проходами приходят уведомлениями ЮKassa
+(PaymentEventLogic.apply_notification обновляет зеркало).
+"""
+
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+
+from .logic import ProviderPaymentLogic, SubscriptionLogic, SyncCheckpointLogic
+
+logger = logging.getLogger("sub")
+
+CHECKPOINT = "provider_payments"
+
+
+class ProviderPaymentSync:
+    @classmethod
+    def run(cls, max_pages: int | None = None) -> int | None:
+        """
+        Выполнить часть прохода синхронизации.
+
+        :param max_pages: максимум страниц за запуск
+        :return: количество сохраненных платежей или None, если синхронизация
+            уже выполняется другим воркером
+        """
+        if max_pages is None:
+            max_pages = settings.PROVIDER_SYNC_MAX_PAGES
+
+        position = SyncCheckpointLogic.acquire(
+            CHECKPOINT, settings.PROVIDER_SYNC_LEASE_SECONDS
+        )
+        if position is None:
+            return None
+
+        try:
+            return cls.sync_pages(position, max_pages)
+        finally:
+            SyncCheckpointLogic.release(CHECKPOINT)
+
+    @classmethod
+    def sync_pages(cls, position: dict, max_pages: int) -> int:
+        """
+        :param position: позиция синхронизации:
+            watermark - максимальный created_at завершенных проходов
+            created_at_gte - нижняя граница текущего прохода
+            cursor - курсор следующей страницы текущего прохода
+            pass_max - максимальный created_at текущего прохода
+        """
+        if position.get("cursor") is None:
+            # Новый проход
+            position["created_at_gte"] = None
+            if position.get("watermark"):
+                position["created_at_gte"] = (
+                    parse_datetime(position["watermark"])
+                    - timedelta(seconds=settings.PROVIDER_SYNC_OVERLAP_SECONDS)
+                ).isoformat()
+            position["pass_max"] = position.get("watermark")
+
+        filters = {}
+        if position["created_at_gte"]:
+            filters["created_at.gte"] = position["created_at_gte"]
+
+        synced = 0
+        for _ in range(max_pages):
+            payments, next_cursor = SubscriptionLogic.yoo_client.list_payments(
+                limit=settings.PROVIDER_SYNC_PAGE_SIZE,
+                cursor=position.get("cursor"),
+                **filters,
+            )
+            synced += ProviderPaymentLogic.upsert(payments)
+
+            for payment in payments:
+                created_at = parse_datetime(payment["created_at"])
+                if position["pass_max"] is None or created_at > parse_datetime(
+                    position["pass_max"]
+                ):
+                    position["pass_max"] = created_at.isoformat()
+
+            position["cursor"] = next_cursor
+            if next_cursor is None:
+                position["watermark"] = position["pass_max"]
+            SyncCheckpointLogic.save(CHECKPOINT, position)
+
+            if next_cursor is None:
+                break
+
+        logger.info(
+            f"Синхронизировано платежей ЮKassa: {synced}, "
+            f"проход {'завершен' if position['cursor'] is None else 'продолжится'}"
+        )
+        return synced
@@ -0,0 +1,42 @@
+"""
+Выбор очереди Celery для пачки списаний автоплатежей.
+
+Очередь списания зависит от подписки: просроченные списания и попытки dunning
+у конца льготного периода идут в приоритетную очередь, остальные - в шард
+по хэшу user_uuid. Шард подписки постоянный, поэтому
+повторная отправка подписки попадает в тот же шард.
+"""
+
+import zlib
+from datetime import datetime, timedelta
+from uuid import UUID
+
+from django.conf import settings
+
+
+def charge_shard(user_uuid: UUID) -> int:
+    return zlib.crc32(user_uuid.bytes) % len(settings.CHARGE_QUEUES)
+
+
+def charge_queue(user_uuid: UUID, end_date: datetime, now: datetime) -> str:
+    """
+    Очередь списания продления подписки.
+
+    :param end_date: окончание оплаченного периода подписки
+    :param now: время свипа
+    """
+    if now - end_date >= timedelta(seconds=settings.CHARGE_PRIORITY_OVERDUE_SECONDS):
+        return settings.CHARGE_PRIORITY_QUEUE
+    return settings.CHARGE_QUEUES[charge_shard(user_uuid)]
+
+
+def retry_queue(user_uuid: UUID, grace_until: datetime, now: datetime) -> str:
+    """
+    Очередь повторного списания подписки в past_due.
+
+    :param grace_until: конец льготного периода подписки
+    :param now: время свипа
+    """
+    if grace_until - now < timedelta(seconds=settings.DUNNING_PRIORITY_GRACE_SECONDS):
+        return settings.CHARGE_PRIORITY_QUEUE
+    return settings.CHARGE_QUEUES[charge_shard(user_uuid)]
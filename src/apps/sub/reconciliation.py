@@ -0,0 +1,198 @@
+"""
+Ночная сверка платежей с ЮKassa.
+
+Потерянное уведомление оставляет подписку в pending навсегда. Сверка проходит
+по платежам за последние RECONCILE_LOOKBACK_DAYS и по последним платежам
+подписок в pending, запрашивает их статус в ЮKassa параллельными пачками
+и обновляет зеркало provider_payment.
+
+Расхождение чинится не напрямую: для платежа в финальном статусе сверка
+сохраняет уведомление в payment_event с тем же ключом дедупликации, что и
+у настоящего вебхука. Его применяет таска process_payment_events тем же
+PaymentEventLogic.apply_notification. Если вебхук уже приходил, уведомление
+отбрасывается как повтор, поэтому переход применяется ровно один раз.
+
+Платежи читаются пачками по id (keyset), а не одним серверным курсором:
+курсор держал бы соединение и транзакцию открытыми на время запросов
+к ЮKassa и не работает через PgBouncer. Позиция сохраняется после каждой
+пачки, прерванная сверка продолжается с нее.
+"""
+
+import asyncio
+import logging
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .async_logic import AsyncYooKassaClient
+from .importer import IMPORTED_PAYMENT_PREFIX
+from .logic import PaymentEventLogic, ProviderPaymentLogic, SyncCheckpointLogic
+from .models import Payment
+from . import yookassa_api
+
+logger = logging.getLogger("sub")
+
+CHECKPOINT = "payment_reconciliation"
+
+# Финальные статусы платежа и события вебхука, которые их сообщают
+FINAL_STATUS_EVENTS = {
+    "succeeded": "payment.succeeded",
+    "canceled": "payment.canceled",
+}
+
+
+class PaymentReconciliation:
+    @classmethod
+    def run(cls, max_batches: int | None = None) -> dict[str, int] | None:
+        """
+        Выполнить сверку или продолжить прерванную.
+
+        :param max_batches: максимум пачек за запуск, по умолчанию до конца
+        :return: количество проверенных платежей, ошибок запроса и починенных
+            расхождений или None, если сверка уже выполняется
+        """
+        position = SyncCheckpointLogic.acquire(
+            CHECKPOINT, settings.RECONCILE_LEASE_SECONDS
+        )
+        if position is None:
+            return None
+
+        # Один event loop и пул соединений на весь запуск
+        loop = asyncio.new_event_loop()
+        client = AsyncYooKassaClient(
+            os.getenv("YOOKASSA_ACCOUNT_ID", ""),
+            os.getenv("YOOKASSA_SECRET_KEY", ""),
+        )
+        try:
+            return cls.reconcile(loop, client, position, max_batches)
+        finally:
+            loop.run_until_complete(client.aclose())
+            loop.close()
+            SyncCheckpointLogic.release(CHECKPOINT)
+
+    @classmethod
+    def reconcile(
+        cls,
+        loop: asyncio.AbstractEventLoop,
+        client: AsyncYooKassaClient,
+        position: dict,
+        max_batches: int | None,
+    ) -> dict[str, int]:
+        """
+        :param position: позиция сверки:
+            last_id - последний проверенный платеж
+            window_start, window_end - границы payment_date текущей сверки
+        """
+        if position.get("window_end") is None:
+            # Новая сверка. Свежие платежи не проверяем: вебхук по ним
+            # может быть еще в пути
+            now = timezone.now()
+            position = {
+                "last_id": 0,
+                "window_start": (
+                    now - timedelta(days=settings.RECONCILE_LOOKBACK_DAYS)
+                ).isoformat(),
+                "window_end": (
+                    now - timedelta(seconds=settings.RECONCILE_GRACE_SECONDS)
+                ).isoformat(),
+            }
+        window_start = parse_datetime(position["window_start"])
+        window_end = parse_datetime(position["window_end"])
+
+        payments = (
+            Payment.objects.filter(payment_date__lte=window_end)
+            # Импортированных способов оплаты нет в ЮKassa как платежей
+            .exclude(yk_payment_id__startswith=IMPORTED_PAYMENT_PREFIX)
+            .filter(
+                Q(payment_date__gte=window_start) | Q(subscription__status="pending")
+            )
+            .annotate(
+                is_latest=~Exists(
+                    Payment.objects.filter(
+                        subscription=OuterRef("subscription"), id__gt=OuterRef("id")
+                    )
+                )
+            )
+            .order_by("id")
+        )
+
+        stats = {"checked": 0, "failed": 0, "repaired": 0}
+        finished = False
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            batch = list(
+                payments.filter(id__gt=position["last_id"]).values_list(
+                    "id", "yk_payment_id", "subscription__status", "is_latest"
+                )[: settings.RECONCILE_BATCH_SIZE]
+            )
+            if not batch:
+                finished = True
+                break
+            batches += 1
+
+            objects = loop.run_until_complete(
+                cls.fetch_all(
+                    client, [yk_payment_id for _, yk_payment_id, _, _ in batch]
+                )
+            )
+
+            fetched = []
+            for (_, yk_payment_id, subscription_status, is_latest), payment in zip(
+                batch, objects
+            ):
+                if isinstance(payment, Exception):
+                    logger.error(
+                        f"Сверка: не удалось получить платеж {yk_payment_id}: {payment!r}"
+                    )
+                    stats["failed"] += 1
+                    continue
+                fetched.append(yookassa_api.payment_info(payment))
+                stats["checked"] += 1
+
+                event = FINAL_STATUS_EVENTS.get(payment["status"])
+                # Чиним только последний платеж подписки, которая ждет оплаты:
+                # более ранние платежи уже применены или заменены новым
+                if event is None or subscription_status != "pending" or not is_latest:
+                    continue
+                if PaymentEventLogic.store_event(
+                    event,
+                    yk_payment_id,
+                    {"type": "notification", "event": event, "object": payment},
+                ):
+                    logger.warning(
+                        f"Сверка: потерянное уведомление {event} по платежу {yk_payment_id}"
+                    )
+                    stats["repaired"] += 1
+
+            ProviderPaymentLogic.upsert(fetched)
+
+            position["last_id"] = batch[-1][0]
+            SyncCheckpointLogic.save(
+                CHECKPOINT, position, lease_seconds=settings.RECONCILE_LEASE_SECONDS
+            )
+
+        if finished:
+            SyncCheckpointLogic.save(
+                CHECKPOINT, {"last_finished_at": timezone.now().isoformat()}
+            )
+        return stats
+
+    @classmethod
+    async def fetch_all(
+        cls, client: AsyncYooKassaClient, yk_payment_ids: list[str]
+    ) -> list[dict | Exception]:
+        """Запросить платежи пачки, не более RECONCILE_CONCURRENCY одновременно"""
+        semaphore = asyncio.Semaphore(settings.RECONCILE_CONCURRENCY)
+
+        async def fetch(yk_payment_id: str) -> dict:
+            async with semaphore:
+                return await client.get_payment_object(yk_payment_id)
+
+        return await asyncio.gather(
+            *(fetch(yk_payment_id) for yk_payment_id in yk_payment_ids),
+            return_exceptions=True,
+        )
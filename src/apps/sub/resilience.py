@@ -0,0 +1,159 @@
+"""
+Устойчивые вызовы API ЮKassa: таймауты по операциям, ретраи с экспоненциальной
+задержкой и jitter, circuit breaker.
+
+Ретраятся только временные ошибки: сетевые ошибки и таймауты, 202, 429 и 5xx.
+Все изменяющие запросы идут с ключом идемпотентности, который не меняется
+между попытками, поэтому повтор не создаст второй платеж или возврат.
+"""
+
+import asyncio
+import random
+import time
+from typing import Awaitable, Callable, TypeVar
+
+import httpx
+from django.conf import settings
+from django.core.cache import cache
+
+from .exceptions import CircuitOpenError, YooKassaError
+
+T = TypeVar("T")
+
+# 202 - ЮKassa еще обрабатывает запрос, его нужно повторить с тем же ключом
+RETRYABLE_STATUS_CODES = {202, 429, 500, 502, 503, 504}
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, httpx.TransportError):
+        return True
+    if isinstance(error, YooKassaError):
+        return error.status_code in RETRYABLE_STATUS_CODES
+    return False
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker, общий для всех процессов через кэш.
+
+    После failure_threshold временных ошибок за window секунд запросы к провайдеру
+    не выполняются open_seconds секунд, а сразу завершаются CircuitOpenError.
+    """
+
+    def __init__(
+        self, name: str, failure_threshold: int, window: int, open_seconds: int
+    ):
+        self.failures_key = f"sub:circuit:{name}:failures"
+        self.open_key = f"sub:circuit:{name}:open"
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.window = window
+        self.open_seconds = open_seconds
+
+    def check(self) -> None:
+        if cache.get(self.open_key):
+            raise CircuitOpenError(self.name)
+
+    def record_failure(self) -> None:
+        cache.add(self.failures_key, 0, self.window)
+        try:
+            failures = cache.incr(self.failures_key)
+        except ValueError:
+            # Окно истекло между add и incr
+            return
+        if failures >= self.failure_threshold:
+            cache.set(self.open_key, True, self.open_seconds)
+            cache.delete(self.failures_key)
+
+    async def acheck(self) -> None:
+        if await cache.aget(self.open_key):
+            raise CircuitOpenError(self.name)
+
+    async def arecord_failure(self) -> None:
+        await cache.aadd(self.failures_key, 0, self.window)
+        try:
+            failures = await cache.aincr(self.failures_key)
+        except ValueError:
+            return
+        if failures >= self.failure_threshold:
+            await cache.aset(self.open_key, True, self.open_seconds)
+            await cache.adelete(self.failures_key)
+
+
+class RetryPolicy:
+    """
+    Выполнение запроса к провайдеру с таймаутом операции, ретраями и circuit breaker.
+
+    func получает таймаут операции в секундах и выполняет одну попытку запроса.
+    """
+
+    def __init__(
+        self,
+        breaker: CircuitBreaker,
+        attempts: int,
+        base_delay: float,
+        max_delay: float,
+        timeouts: dict[str, float],
+        default_timeout: float,
+    ):
+        self.breaker = breaker
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeouts = timeouts
+        self.default_timeout = default_timeout
+
+    @classmethod
+    def from_settings(cls) -> "RetryPolicy":
+        return cls(
+            breaker=CircuitBreaker(
+                "yookassa",
+                failure_threshold=settings.YOOKASSA_CIRCUIT_FAILURES,
+                window=settings.YOOKASSA_CIRCUIT_WINDOW,
+                open_seconds=settings.YOOKASSA_CIRCUIT_OPEN_SECONDS,
+            ),
+            attempts=settings.YOOKASSA_RETRY_ATTEMPTS,
+            base_delay=settings.YOOKASSA_RETRY_BASE_DELAY,
+            max_delay=settings.YOOKASSA_RETRY_MAX_DELAY,
+            timeouts=settings.YOOKASSA_TIMEOUTS,
+            default_timeout=settings.YOOKASSA_HTTP_TIMEOUT,
+        )
+
+    def timeout(self, operation: str) -> float:
+        return self.timeouts.get(operation, self.default_timeout)
+
+    def backoff(self, attempt: int) -> float:
+        """Задержка перед следующей попыткой: full jitter"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+    def call(self, operation: str, func: Callable[[float], T]) -> T:
+        timeout = self.timeout(operation)
+        for attempt in range(self.attempts):
+            self.breaker.check()
+            try:
+                return func(timeout)
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                self.breaker.record_failure()
+                if attempt == self.attempts - 1:
+                    raise
+            time.sleep(self.backoff(attempt))
+
+        raise AssertionError("unreachable")
+
+    async def acall(self, operation: str, func: Callable[[float], Awaitable[T]]) -> T:
+        timeout = self.timeout(operation)
+        for attempt in range(self.attempts):
+            await self.breaker.acheck()
+            try:
+                return await func(timeout)
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                await self.breaker.arecord_failure()
+                if attempt == self.attempts - 1:
+                    raise
+            await asyncio.sleep(self.backoff(attempt))
+
+        raise AssertionError("unreachable")
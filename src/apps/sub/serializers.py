@@ -1,4 +1,6 @@
+from django.conf import settings
 from rest_framework import serializers
+from lib.django_utils.serializers import DynamicFieldsModelSerializer
 from .models import Plan, Subscription, Payment
 
 
@@ -82,7 +84,8 @@ class PaymentNotificationRequestSerializer(serializers.Serializer):
 class SubscriptionRequestSerializer(serializers.ModelSerializer):
     class Meta:
         model = Subscription
-        fields = "__all__"
+        # Служебное поле свипа продления наружу не отдаем
+        exclude = ["sweep_locked_until"]
 
 
 class RenewSubscriptionRequestSerializer(serializers.Serializer):
@@ -96,7 +99,42 @@ class RenewSubscriptionResponseSerializer(CreateSubscriptionResponseSerializer):
     pass
 
 
-class PaymentHistoryResponseSerializer(serializers.ModelSerializer):
+class PaymentHistoryResponseSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = Payment
         fields = "__all__"
+
+
+class CheckSubscriptionsRequestSerializer(serializers.Serializer):
+    user_uuids = serializers.ListField(
+        child=serializers.UUIDField(),
+        allow_empty=False,
+        max_length=settings.BULK_CHECK_MAX_UUIDS,
+    )
+
+
+class SubscriptionEntitlementSerializer(serializers.Serializer):
+    status = serializers.CharField()
+    end_date = serializers.DateTimeField()
+    plan_id = serializers.IntegerField()
+
+
+class CheckSubscriptionsResponseSerializer(serializers.Serializer):
+    subscriptions = serializers.DictField(
+        child=SubscriptionEntitlementSerializer(allow_null=True),
+        help_text="UUID пользователя -> подписка или null, если подписки нет",
+    )
+
+
+class EntitlementSerializer(serializers.Serializer):
+    entitled = serializers.BooleanField(help_text="Есть ли доступ сейчас")
+    active_until = serializers.DateTimeField(allow_null=True)
+    plan_id = serializers.IntegerField()
+    auto_renew = serializers.BooleanField()
+
+
+class CheckEntitlementsResponseSerializer(serializers.Serializer):
+    entitlements = serializers.DictField(
+        child=EntitlementSerializer(allow_null=True),
+        help_text="UUID пользователя -> доступ или null, если подписки нет",
+    )
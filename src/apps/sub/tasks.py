@@ -1,81 +1,99 @@
 from celery import shared_task
-from django.db import transaction
+from django.conf import settings
 
-from . import logic, models, exceptions
+from . import logic
+from .autopayment import AutopaymentExecutor
+from .provider_sync import ProviderPaymentSync
+from .reconciliation import PaymentReconciliation
 
 
 @shared_task
-def make_autopayment(subscription_id: int) -> None:
+def make_autopayment(subscription_ids: list[int]) -> None:
     """
-    Таска для автоматического продления платежа
+    Таска для автоматического продления пачки подписок
     """
     import logging
 
     logger = logging.getLogger("sub")
-    logger.info("Выполняем автоплатеж")
-    try:
-        auto_payment = models.AutoSubscriptionTasks.objects.get(
-            subscription__id=subscription_id,
-        )
-    except models.Subscription.DoesNotExist:
-        msg = "Подписка не найдена"
-        raise exceptions.SubAppError(msg)
-
-    make_autopayment_periodic_task = auto_payment.task
-
-    logic.PeriodicTasksLogic.remove_periodic_task_with_clocked(
-        make_autopayment_periodic_task
-    )
+    logger.info(f"Выполняем автоплатеж для {len(subscription_ids)} подписок")
 
-    # Выполняем автоплатеж
-    if logic.SubscriptionLogic.renew_subscription(subscription_id) is not None:
-        # Создаем снова таску на продление подписки
-        logger.info("Платеж прошел успешно")
-        subscription = models.Subscription.objects.get(pk=subscription_id)
-        auto_payment_task = logic.PeriodicTasksLogic.create_auto_payment_task(
-            subscription.pk, subscription.plan.days
-        )
+    stats = AutopaymentExecutor.run(subscription_ids)
 
-        auto_payment.subscription = subscription
-        auto_payment.task = auto_payment_task
-        auto_payment.save()
-    else:
-        auto_payment.delete()
+    logger.info(
+        f"Продлено подписок: {stats['renewed']}, ждут подтверждения: "
+        f"{stats['pending']}, отменено: {stats['cancelled']}, "
+        f"остановлено: {stats['stopped']}, ошибок: {stats['failed']}"
+    )
 
 
 @shared_task
-def stop_subscription(subscription_id: int) -> None:
+def retry_autopayment(retry_ids: list[int]) -> None:
     """
-    Таска для остановки подписки по истечению её времени
+    Таска для повторных списаний пачки подписок в past_due
     """
     import logging
 
     logger = logging.getLogger("sub")
-    logger.info("Выполняем остановку подписки")
-    try:
-        auto_payment = models.AutoSubscriptionTasks.objects.get(
-            subscription__id=subscription_id,
-        )
-    except models.AutoSubscriptionTasks.DoesNotExist:
-        msg = "Задача на остановку подписки не найдена"
-        raise exceptions.SubAppError(msg)
-
-    try:
-        subscription = models.Subscription.objects.get(
-            pk=subscription_id,
-        )
-    except models.AutoSubscriptionTasks.DoesNotExist:
-        msg = "Подписка не найдена"
-        raise exceptions.SubAppError(msg)
-
-    make_autopayment_periodic_task = auto_payment.task
-
-    logic.PeriodicTasksLogic.remove_periodic_task_with_clocked(
-        make_autopayment_periodic_task
+    logger.info(f"Повторяем автоплатеж для {len(retry_ids)} подписок")
+
+    stats = AutopaymentExecutor.run_retries(retry_ids)
+
+    logger.info(
+        f"Восстановлено подписок: {stats['recovered']}, перенесено попыток: "
+        f"{stats['scheduled']}, отменено: {stats['failed']}, закрыто попыток: "
+        f"{stats['cancelled']}, ошибок: {stats['errors']}"
     )
 
-    auto_payment.delete()
 
-    with transaction.atomic():
-        subscription.status = "cancelled"
-        subscription.save()
+@shared_task
+def process_payment_events() -> None:
+    """
+    Таска для применения сохраненных уведомлений ЮKassa пачками
+    """
+    import logging
+
+    logger = logging.getLogger("sub")
+
+    processed = 0
+    for _ in range(settings.PAYMENT_EVENTS_MAX_BATCHES):
+        batch = logic.PaymentEventLogic.process_events()
+        processed += batch
+        if batch < settings.PAYMENT_EVENTS_BATCH_SIZE:
+            break
+
+    if processed:
+        logger.info(f"Обработано уведомлений ЮKassa: {processed}")
+
+
+@shared_task
+def sync_provider_payments() -> None:
+    """
+    Таска для синхронизации платежей ЮKassa в локальное зеркало
+    """
+    import logging
+
+    logger = logging.getLogger("sub")
+
+    synced = ProviderPaymentSync.run()
+    if synced is None:
+        logger.info("Синхронизация платежей ЮKassa уже выполняется")
+
+
+@shared_task
+def reconcile_payments() -> None:
+    """
+    Таска для сверки платежей с ЮKassa
+    """
+    import logging
+
+    logger = logging.getLogger("sub")
+
+    stats = PaymentReconciliation.run()
+    if stats is None:
+        logger.info("Сверка платежей уже выполняется")
+        return
+
+    logger.info(
+        f"Сверка платежей: проверено {stats['checked']}, ошибок {stats['failed']}, "
+        f"восстановлено уведомлений {stats['repaired']}"
+    )
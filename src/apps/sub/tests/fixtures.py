@@ -0,0 +1,80 @@
+"""
+Общие данные тестов приложения sub.
+"""
+
+import uuid
+from datetime import datetime, timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from ..logic import EntitlementLogic
+from ..models import Payment, Plan, Subscription
+
+
+def create_plan(test_case: type[TestCase], **fields) -> Plan:
+    """
+    Создать план так, чтобы его увидел PlanCatalog: версия справочника
+    меняется в on_commit, а TestCase не коммитит транзакции.
+    """
+    fields = {"name": "Месяц", "price": 100, "days": 30, **fields}
+    with test_case.captureOnCommitCallbacks(execute=True):
+        return Plan.objects.create(**fields)
+
+
+def create_subscription(
+    plan: Plan,
+    status: str = "active",
+    end_date: datetime | None = None,
+    auto_renew: bool = True,
+    payment_method_id: str | None = None,
+) -> Subscription:
+    """Подписка с доступом по ней и, если задан способ оплаты, его платежом"""
+    if end_date is None:
+        end_date = timezone.now() + timedelta(days=plan.days)
+    subscription = Subscription.objects.create(
+        user_uuid=uuid.uuid4(),
+        plan=plan,
+        status=status,
+        start_date=end_date - timedelta(days=plan.days),
+        end_date=end_date,
+        auto_renew=auto_renew,
+    )
+    EntitlementLogic.refresh(subscription)
+    if payment_method_id is not None:
+        Payment.objects.create(
+            subscription=subscription,
+            amount=plan.price,
+            user_uuid=subscription.user_uuid,
+            yk_payment_id=str(uuid.uuid4()),
+            yk_payment_method_id=payment_method_id,
+        )
+    return subscription
+
+
+def notification(
+    yk_payment_id: str, paid: bool, payment_method_id: str | None = None
+) -> dict:
+    """Тело уведомления ЮKassa об успешном или отмененном платеже"""
+    payment = {
+        "id": yk_payment_id,
+        "status": "succeeded" if paid else "canceled",
+        "paid": paid,
+        "amount": {"value": "100.00", "currency": "RUB"},
+        "created_at": "2026-10-01T10:00:00.000Z",
+        "description": "Тестовый платеж",
+        "metadata": {},
+        "refundable": paid,
+        "test": True,
+    }
+    if payment_method_id is not None:
+        payment["payment_method"] = {
+            "type": "bank_card",
+            "id": payment_method_id,
+            "saved": True,
+        }
+    return {
+        "type": "notification",
+        "event": "payment.succeeded" if paid else "payment.canceled",
+        "object": payment,
+    }
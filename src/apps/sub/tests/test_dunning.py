@@ -0,0 +1,179 @@
+import uuid
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from ..exceptions import YooKassaError
+from ..logic import DunningLogic, SubscriptionLogic
+from ..models import Entitlement, Payment, RenewalRetry
+from .fixtures import create_plan, create_subscription
+
+HOUR = 3600
+
+
+def declined(reason: str = "insufficient_funds") -> dict:
+    return {
+        "payment_id": str(uuid.uuid4()),
+        "status": "canceled",
+        "cancellation_details": {"reason": reason},
+    }
+
+
+def succeeded() -> dict:
+    return {"payment_id": str(uuid.uuid4()), "status": "succeeded"}
+
+
+@override_settings(
+    DUNNING_RETRY_SCHEDULE=[HOUR, 6 * HOUR], DUNNING_GRACE_SECONDS=7 * 24 * HOUR
+)
+class DunningTransitionsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.plan = create_plan(cls)
+
+    def setUp(self):
+        cache.clear()
+        self.subscription = create_subscription(
+            self.plan,
+            end_date=timezone.now() - timedelta(minutes=1),
+            payment_method_id="pm-1",
+        )
+
+    def decline_autopayment(self, reason: str = "insufficient_funds") -> None:
+        SubscriptionLogic.apply_autopayment(
+            self.subscription.pk, self.subscription.end_date, "pm-1", declined(reason)
+        )
+        self.subscription.refresh_from_db()
+
+    def test_declined_autopayment_moves_subscription_to_past_due(self):
+        self.decline_autopayment()
+
+        self.assertEqual(self.subscription.status, "past_due")
+        retry = RenewalRetry.objects.get(subscription=self.subscription)
+        self.assertEqual(
+            (retry.status, retry.attempts, retry.decline_reason),
+            ("scheduled", 1, "insufficient_funds"),
+        )
+        self.assertEqual(retry.period_end, self.subscription.end_date)
+        # Доступ сохраняется до конца льготного периода
+        self.assertEqual(
+            Entitlement.objects.get(user_uuid=self.subscription.user_uuid).active_until,
+            DunningLogic.grace_until(self.subscription.end_date),
+        )
+
+    def test_final_decline_cancels_without_retries(self):
+        self.decline_autopayment("card_expired")
+
+        self.assertEqual(self.subscription.status, "cancelled")
+        self.assertFalse(RenewalRetry.objects.exists())
+
+    def test_successful_retry_recovers_subscription(self):
+        self.decline_autopayment()
+        retry = RenewalRetry.objects.get()
+        period_end = self.subscription.end_date
+
+        status = DunningLogic.apply_retry(retry.pk, 1, "pm-1", succeeded())
+
+        self.assertEqual(status, "recovered")
+        self.subscription.refresh_from_db()
+        self.assertEqual(self.subscription.status, "active")
+        self.assertEqual(
+            self.subscription.end_date, period_end + timedelta(days=self.plan.days)
+        )
+        self.assertEqual(
+            Payment.objects.filter(subscription=self.subscription).count(), 2
+        )
+
+    def test_declined_retry_is_rescheduled_then_fails(self):
+        self.decline_autopayment()
+        retry = RenewalRetry.objects.get()
+
+        self.assertEqual(
+            DunningLogic.apply_retry(retry.pk, 1, "pm-1", declined()), "scheduled"
+        )
+        retry.refresh_from_db()
+        self.assertEqual(retry.attempts, 2)
+        self.assertIsNotNone(retry.next_retry_at)
+
+        # Расписание из двух задержек: третий отказ последний
+        self.assertEqual(
+            DunningLogic.apply_retry(retry.pk, 2, "pm-1", declined()), "failed"
+        )
+        self.subscription.refresh_from_db()
+        self.assertEqual(self.subscription.status, "cancelled")
+
+    def test_stale_retry_result_is_ignored(self):
+        self.decline_autopayment()
+        retry = RenewalRetry.objects.get()
+        DunningLogic.apply_retry(retry.pk, 1, "pm-1", declined())
+
+        # Результат первой попытки пришел повторно
+        self.assertEqual(
+            DunningLogic.apply_retry(retry.pk, 1, "pm-1", succeeded()), "scheduled"
+        )
+        self.subscription.refresh_from_db()
+        self.assertEqual(self.subscription.status, "past_due")
+
+    def test_retry_of_manually_renewed_subscription_is_cancelled(self):
+        self.decline_autopayment()
+        retry = RenewalRetry.objects.get()
+        grace_until = DunningLogic.grace_until(self.subscription.end_date)
+        SubscriptionLogic.store_renewal_checkout(
+            self.subscription, self.plan, True, {"payment_id": str(uuid.uuid4())}
+        )
+
+        # Пока платеж продления не завершен, доступ льготного периода сохраняется
+        self.assertEqual(
+            Entitlement.objects.get(user_uuid=self.subscription.user_uuid).active_until,
+            grace_until,
+        )
+        self.assertEqual(
+            DunningLogic.apply_retry(retry.pk, 1, "pm-1", succeeded()), "cancelled"
+        )
+
+    def test_provider_errors_become_declines(self):
+        rejected = DunningLogic.error_payment_data(YooKassaError(400, "bad request"))
+        unavailable = DunningLogic.error_payment_data(YooKassaError(503, "down"))
+
+        self.assertEqual(DunningLogic.decline_reason(rejected), "provider_rejected")
+        self.assertEqual(
+            DunningLogic.decline_reason(unavailable), "provider_unavailable"
+        )
+
+        self.decline_autopayment("provider_rejected")
+        self.assertEqual(self.subscription.status, "cancelled")
+
+
+@override_settings(DUNNING_RETRY_SCHEDULE=[HOUR, 6 * HOUR])
+class NextRetryAtTest(TestCase):
+    def test_follows_schedule_within_grace(self):
+        now = timezone.now()
+        grace_until = now + timedelta(days=7)
+
+        self.assertEqual(
+            DunningLogic.next_retry_at(1, grace_until, "insufficient_funds", now),
+            now + timedelta(hours=1),
+        )
+        self.assertEqual(
+            DunningLogic.next_retry_at(2, grace_until, "insufficient_funds", now),
+            now + timedelta(hours=6),
+        )
+        self.assertIsNone(
+            DunningLogic.next_retry_at(3, grace_until, "insufficient_funds", now)
+        )
+
+    def test_no_retry_after_grace_or_final_decline(self):
+        now = timezone.now()
+
+        self.assertIsNone(
+            DunningLogic.next_retry_at(
+                1, now + timedelta(minutes=30), "insufficient_funds", now
+            )
+        )
+        self.assertIsNone(
+            DunningLogic.next_retry_at(
+                1, now + timedelta(days=7), "permission_revoked", now
+            )
+        )
@@ -0,0 +1,105 @@
+import uuid
+
+from django.test import TestCase
+
+from ..importer import SubscriptionImport, imported_payment_id
+from ..models import Entitlement, Payment, Plan, Subscription
+from .fixtures import create_plan, create_subscription
+
+PLANS = [{"name": "Партнерский", "price": "199.00", "days": "30"}]
+
+
+def subscription_row(user_uuid=None, **fields) -> dict:
+    return {
+        "user_uuid": str(user_uuid or uuid.uuid4()),
+        "plan": "Партнерский",
+        "status": "active",
+        "start_date": "2026-10-01T00:00:00Z",
+        "end_date": "2026-11-01T00:00:00Z",
+        "auto_renew": "1",
+        "payment_method_id": "pm-import",
+        **fields,
+    }
+
+
+class SubscriptionImportTest(TestCase):
+    def test_import_creates_subscriptions_payment_methods_and_access(self):
+        rows = [
+            subscription_row(),
+            subscription_row(auto_renew="0", payment_method_id=""),
+        ]
+
+        report = SubscriptionImport().run(PLANS, rows)
+
+        self.assertEqual(
+            (
+                report.rows,
+                report.imported,
+                report.payment_methods,
+                report.plans_created,
+            ),
+            (2, 2, 1, 1),
+        )
+        self.assertEqual(Subscription.objects.count(), 2)
+        self.assertEqual(Entitlement.objects.count(), 2)
+        payment = Payment.objects.get()
+        self.assertEqual(payment.yk_payment_id, imported_payment_id(payment.user_uuid))
+        self.assertEqual(payment.yk_payment_method_id, "pm-import")
+
+    def test_dry_run_writes_nothing(self):
+        rows = [subscription_row(), subscription_row(status="pending")]
+
+        report = SubscriptionImport(dry_run=True).run(PLANS, rows)
+
+        self.assertEqual(
+            (report.imported, report.invalid, report.plans_created), (1, 1, 1)
+        )
+        self.assertIn("неверный статус", report.errors[0])
+        self.assertFalse(Plan.objects.exists())
+        self.assertFalse(Subscription.objects.exists())
+        self.assertFalse(Payment.objects.exists())
+
+    def test_duplicates_in_file_and_existing_users_are_skipped(self):
+        plan = create_plan(self, name="Партнерский")
+        existing = create_subscription(plan)
+        repeated = uuid.uuid4()
+        rows = [
+            subscription_row(repeated),
+            subscription_row(repeated),
+            subscription_row(existing.user_uuid),
+        ]
+
+        report = SubscriptionImport().run(PLANS, rows)
+
+        self.assertEqual(
+            (report.imported, report.duplicates, report.existing, report.plans_created),
+            (1, 1, 1, 0),
+        )
+        self.assertEqual(Subscription.objects.count(), 2)
+
+    def test_previously_imported_payment_method_is_reported(self):
+        user_uuid = uuid.uuid4()
+        SubscriptionImport().run(PLANS, [subscription_row(user_uuid)])
+        # Подписка перешла другому пользователю, платеж импорта остался
+        Subscription.objects.filter(user_uuid=user_uuid).update(user_uuid=uuid.uuid4())
+
+        report = SubscriptionImport().run(
+            PLANS, [subscription_row(user_uuid), subscription_row()]
+        )
+
+        self.assertEqual((report.imported, report.imported_before), (1, 1))
+        self.assertFalse(Subscription.objects.filter(user_uuid=user_uuid).exists())
+
+    def test_invalid_rows_are_reported(self):
+        rows = [
+            subscription_row(user_uuid="not-a-uuid"),
+            subscription_row(plan="Неизвестный"),
+            subscription_row(end_date="2026-09-01T00:00:00Z"),
+            subscription_row(payment_method_id=""),
+        ]
+
+        report = SubscriptionImport().run(PLANS, rows)
+
+        self.assertEqual((report.imported, report.invalid), (0, 4))
+        self.assertEqual(len(report.errors), 4)
+        self.assertTrue(report.errors[0].startswith("строка 2:"))
@@ -0,0 +1,84 @@
+import uuid
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from ..models import Payment
+from ..views import PaymentHistoryPagination
+from .fixtures import create_plan, create_subscription
+
+
+class KeysetPaginationTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        subscription = create_subscription(create_plan(cls))
+        cls.user_uuid = subscription.user_uuid
+        payments = Payment.objects.bulk_create(
+            Payment(
+                subscription=subscription,
+                amount=100,
+                user_uuid=subscription.user_uuid,
+                yk_payment_id=str(uuid.uuid4()),
+            )
+            for _ in range(7)
+        )
+        # Часть платежей с одинаковой датой: порядок среди них задает id
+        now = timezone.now()
+        for i, payment in enumerate(payments):
+            Payment.objects.filter(pk=payment.pk).update(
+                payment_date=now - timedelta(days=i // 2)
+            )
+
+    def paginate(self, **params):
+        pagination = PaymentHistoryPagination()
+        request = Request(APIRequestFactory().get("/", params))
+        page = pagination.paginate_queryset(
+            Payment.objects.filter(user_uuid=self.user_uuid), request
+        )
+        return pagination, page
+
+    def expected_order(self) -> list[int]:
+        return list(
+            Payment.objects.order_by("-payment_date", "-id").values_list(
+                "id", flat=True
+            )
+        )
+
+    def test_pages_cover_all_rows_in_order(self):
+        seen = []
+        cursor = None
+        while True:
+            params = {"page_size": 3}
+            if cursor:
+                params["cursor"] = cursor
+            pagination, page = self.paginate(**params)
+            seen += [payment.pk for payment in page]
+            cursor = pagination.next_cursor
+            if cursor is None:
+                break
+
+        self.assertEqual(seen, self.expected_order())
+
+    def test_total_is_counted_on_request(self):
+        pagination, _ = self.paginate(page_size=3)
+        self.assertIsNone(pagination.total)
+
+        pagination, _ = self.paginate(page_size=3, with_total="true")
+        self.assertEqual(pagination.total, 7)
+        self.assertEqual(pagination.get_paginated_response([]).data["total"], 7)
+
+    def test_page_size_is_limited(self):
+        pagination, _ = self.paginate(page_size=0)
+        self.assertEqual(pagination.page_size, PaymentHistoryPagination.page_size)
+
+        pagination, _ = self.paginate(page_size=10**6)
+        self.assertEqual(pagination.page_size, PaymentHistoryPagination.max_page_size)
+
+    def test_invalid_cursor(self):
+        for cursor in ("not-base64!", "W10=", "WyJ4IiwgMV0="):
+            with self.subTest(cursor=cursor), self.assertRaises(NotFound):
+                self.paginate(cursor=cursor)
@@ -0,0 +1,131 @@
+import uuid
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from ..logic import PaymentEventLogic
+from ..models import Entitlement, Payment, PaymentEvent
+from .fixtures import create_plan, create_subscription, notification
+
+
+class PaymentEventDedupeTest(TestCase):
+    def test_repeated_notification_is_stored_once(self):
+        payload = notification("pay-1", paid=True)
+
+        self.assertTrue(
+            PaymentEventLogic.store_event("payment.succeeded", "pay-1", payload)
+        )
+        self.assertFalse(
+            PaymentEventLogic.store_event("payment.succeeded", "pay-1", payload)
+        )
+        self.assertEqual(PaymentEvent.objects.count(), 1)
+
+    def test_other_event_of_same_payment_is_stored(self):
+        PaymentEventLogic.store_event(
+            "payment.waiting_for_capture", "pay-1", notification("pay-1", paid=False)
+        )
+        PaymentEventLogic.store_event(
+            "payment.succeeded", "pay-1", notification("pay-1", paid=True)
+        )
+
+        self.assertEqual(
+            set(PaymentEvent.objects.values_list("dedupe_key", flat=True)),
+            {"payment.waiting_for_capture:pay-1", "payment.succeeded:pay-1"},
+        )
+
+    def test_parse_notification_rejects_invalid_body(self):
+        self.assertIsNone(PaymentEventLogic.parse_notification(b"not json"))
+        self.assertIsNone(PaymentEventLogic.parse_notification(b"[1]"))
+        self.assertIsNone(
+            PaymentEventLogic.parse_notification(b'{"event": "payment.succeeded"}')
+        )
+
+        event, yk_payment_id, _ = PaymentEventLogic.parse_notification(
+            b'{"event": "payment.succeeded", "object": {"id": "pay-1"}}'
+        )
+        self.assertEqual((event, yk_payment_id), ("payment.succeeded", "pay-1"))
+
+
+class PaymentEventApplyTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.plan = create_plan(cls)
+
+    def setUp(self):
+        cache.clear()
+
+    def pending_subscription(self):
+        subscription = create_subscription(self.plan, status="pending")
+        payment = Payment.objects.create(
+            subscription=subscription,
+            amount=self.plan.price,
+            user_uuid=subscription.user_uuid,
+            yk_payment_id=str(uuid.uuid4()),
+        )
+        return subscription, payment
+
+    def store(self, payload):
+        PaymentEventLogic.store_event(
+            payload["event"], payload["object"]["id"], payload
+        )
+
+    def test_succeeded_payment_activates_subscription(self):
+        subscription, payment = self.pending_subscription()
+        self.store(
+            notification(payment.yk_payment_id, paid=True, payment_method_id="pm-1")
+        )
+
+        self.assertEqual(PaymentEventLogic.process_events(), 1)
+
+        subscription.refresh_from_db()
+        payment.refresh_from_db()
+        self.assertEqual(subscription.status, "active")
+        self.assertEqual(payment.yk_payment_method_id, "pm-1")
+        self.assertEqual(
+            Entitlement.objects.get(user_uuid=subscription.user_uuid).active_until,
+            subscription.end_date,
+        )
+        self.assertEqual(PaymentEvent.objects.get().status, "processed")
+
+    def test_canceled_payment_cancels_subscription(self):
+        subscription, payment = self.pending_subscription()
+        self.store(notification(payment.yk_payment_id, paid=False))
+
+        PaymentEventLogic.process_events()
+
+        subscription.refresh_from_db()
+        self.assertEqual(subscription.status, "cancelled")
+        self.assertIsNone(
+            Entitlement.objects.get(user_uuid=subscription.user_uuid).active_until
+        )
+
+    def test_unknown_payment_is_skipped(self):
+        self.store(notification("unknown", paid=True))
+
+        PaymentEventLogic.process_events()
+
+        self.assertEqual(PaymentEvent.objects.get().status, "skipped")
+
+    def test_processed_events_are_not_applied_again(self):
+        subscription, payment = self.pending_subscription()
+        self.store(notification(payment.yk_payment_id, paid=True))
+        PaymentEventLogic.process_events()
+
+        self.assertEqual(PaymentEventLogic.process_events(), 0)
+
+    def test_broken_event_does_not_block_batch(self):
+        subscription, payment = self.pending_subscription()
+        PaymentEventLogic.store_event(
+            "payment.succeeded", "broken", {"event": "payment.succeeded", "object": {}}
+        )
+        self.store(notification(payment.yk_payment_id, paid=True))
+
+        with self.assertLogs("sub", level="ERROR"):
+            PaymentEventLogic.process_events()
+
+        self.assertEqual(
+            dict(PaymentEvent.objects.values_list("yk_payment_id", "status")),
+            {"broken": "failed", payment.yk_payment_id: "processed"},
+        )
+        subscription.refresh_from_db()
+        self.assertEqual(subscription.status, "active")
@@ -0,0 +1,108 @@
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from ..logic import RenewalLogic
+from ..models import Entitlement, Subscription, SubscriptionEvent
+from .fixtures import create_plan, create_subscription
+
+
+class ClaimDueSubscriptionsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.plan = create_plan(cls)
+
+    def test_claims_only_due_active_auto_renew_subscriptions(self):
+        past = timezone.now() - timedelta(minutes=1)
+        due = create_subscription(self.plan, end_date=past)
+        create_subscription(self.plan, end_date=timezone.now() + timedelta(days=1))
+        create_subscription(self.plan, end_date=past, auto_renew=False)
+        create_subscription(self.plan, end_date=past, status="past_due")
+
+        claimed = RenewalLogic.claim_due_subscriptions()
+
+        self.assertEqual([row.id for row in claimed], [due.pk])
+        self.assertEqual(claimed[0].user_uuid, due.user_uuid)
+        due.refresh_from_db()
+        self.assertGreater(due.sweep_locked_until, timezone.now())
+
+    def test_claimed_subscription_is_not_claimed_again_until_lock_expires(self):
+        due = create_subscription(
+            self.plan, end_date=timezone.now() - timedelta(minutes=1)
+        )
+        RenewalLogic.claim_due_subscriptions()
+
+        self.assertEqual(RenewalLogic.claim_due_subscriptions(), [])
+
+        Subscription.objects.filter(pk=due.pk).update(
+            sweep_locked_until=timezone.now() - timedelta(seconds=1)
+        )
+        self.assertEqual(
+            [row.id for row in RenewalLogic.claim_due_subscriptions()], [due.pk]
+        )
+
+    def test_limit_takes_oldest_end_date_first(self):
+        now = timezone.now()
+        older = create_subscription(self.plan, end_date=now - timedelta(days=2))
+        newer = create_subscription(self.plan, end_date=now - timedelta(days=1))
+
+        self.assertEqual(
+            [row.id for row in RenewalLogic.claim_due_subscriptions(limit=1)],
+            [older.pk],
+        )
+        self.assertEqual(
+            [row.id for row in RenewalLogic.claim_due_subscriptions(limit=1)],
+            [newer.pk],
+        )
+
+
+class ExpireDueSubscriptionsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.plan = create_plan(cls)
+
+    def test_expires_due_subscriptions_without_auto_renew(self):
+        past = timezone.now() - timedelta(minutes=1)
+        expiring = create_subscription(self.plan, end_date=past, auto_renew=False)
+        renewing = create_subscription(self.plan, end_date=past)
+        current = create_subscription(
+            self.plan, end_date=timezone.now() + timedelta(days=1), auto_renew=False
+        )
+
+        self.assertEqual(RenewalLogic.expire_due_subscriptions(), 1)
+
+        statuses = dict(Subscription.objects.values_list("id", "status"))
+        self.assertEqual(
+            statuses,
+            {expiring.pk: "expired", renewing.pk: "active", current.pk: "active"},
+        )
+        self.assertIsNone(
+            Entitlement.objects.get(user_uuid=expiring.user_uuid).active_until
+        )
+        event = SubscriptionEvent.objects.get()
+        self.assertEqual(
+            (event.event, event.subscription_id, event.end_date),
+            ("subscription.expired", expiring.pk, expiring.end_date),
+        )
+
+    def test_expiry_is_chunked(self):
+        past = timezone.now() - timedelta(minutes=1)
+        for _ in range(3):
+            create_subscription(self.plan, end_date=past, auto_renew=False)
+
+        self.assertEqual(RenewalLogic.expire_due_subscriptions(limit=2), 2)
+        self.assertEqual(RenewalLogic.expire_due_subscriptions(limit=2), 1)
+        self.assertEqual(RenewalLogic.expire_due_subscriptions(limit=2), 0)
+
+    def test_stop_subscriptions_skips_not_due(self):
+        due = create_subscription(
+            self.plan, end_date=timezone.now() - timedelta(minutes=1)
+        )
+        current = create_subscription(self.plan)
+
+        self.assertEqual(RenewalLogic.stop_subscriptions([due.pk, current.pk]), 1)
+        self.assertEqual(
+            dict(Subscription.objects.values_list("id", "status")),
+            {due.pk: "expired", current.pk: "active"},
+        )
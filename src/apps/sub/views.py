@@ -1,23 +1,37 @@
-import json
-
+import hmac
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+from django.http import HttpRequest, HttpResponse, StreamingHttpResponse
+from django.utils.dateparse import parse_datetime
+from django.views.decorators.http import require_GET
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
 from rest_framework.request import Request
 from rest_framework.response import Response
-from drf_spectacular.utils import extend_schema
-from yookassa.domain.notification import WebhookNotification
+from drf_spectacular.utils import extend_schema, OpenApiParameter
 
 
+from lib.django_utils.pagination import KeysetPagination
 from .models import Plan, Subscription
-from . import serializers, sub_types, logic, models
+from . import serializers, sub_types, logic, models, tasks
+from .cache import PlanCatalog, SubscriptionCache
+from .export import Export, ExportError
+from .importer import IMPORTED_PAYMENT_PREFIX
+from .metrics import ViewMetricsMixin
+
+
+class PaymentHistoryPagination(KeysetPagination):
+    ordering = ("-payment_date", "-id")
 
 
-class PlanViewSet(viewsets.ModelViewSet):
+class PlanViewSet(ViewMetricsMixin, viewsets.ModelViewSet):
     queryset = Plan.objects.all()
     serializer_class = serializers.PlanSerializer
 
 
-class SubcriptionViewSet(viewsets.GenericViewSet):
+class SubcriptionViewSet(ViewMetricsMixin, viewsets.GenericViewSet):
 
     @extend_schema(
         request=serializers.CreateSubscriptionRequestSerializer,
@@ -42,7 +56,7 @@ class SubcriptionViewSet(viewsets.GenericViewSet):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        if Plan.objects.filter(pk=create_sub_body["plan_id"]).exists() is False:
+        if PlanCatalog.get(create_sub_body["plan_id"]) is None:
             return Response(
                 {"detail": "plan not found"},
                 status=status.HTTP_404_NOT_FOUND,
@@ -72,14 +86,93 @@ class SubcriptionViewSet(viewsets.GenericViewSet):
                 {"detail": "user_uuid is required"}, status=status.HTTP_400_BAD_REQUEST
             )
 
-        subscription = models.Subscription.objects.filter(user_uuid=user_uuid).first()
-        if subscription is None:
+        try:
+            user_uuid = uuid.UUID(user_uuid)
+        except ValueError:
+            return Response(
+                {"detail": "user_uuid is invalid"}, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        subscription_data = SubscriptionCache.get(user_uuid)
+        if subscription_data is None:
             return Response(
                 {"detail": "Subscription not found"}, status=status.HTTP_404_NOT_FOUND
             )
 
-        serializer = serializers.SubscriptionRequestSerializer(subscription)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return Response(subscription_data, status=status.HTTP_200_OK)
+
+    @extend_schema(
+        request=serializers.CheckSubscriptionsRequestSerializer,
+        responses={200: serializers.CheckSubscriptionsResponseSerializer},
+    )
+    @action(methods=["POST"], detail=False)
+    def check_subscriptions(self, request: Request) -> Response:
+        """
+        Ручка для массовой проверки подписок по списку user_uuid
+
+        Возвращает компактный словарь user_uuid -> {status, end_date, plan_id}
+        """
+        request_serializer = serializers.CheckSubscriptionsRequestSerializer(
+            data=request.data,
+        )
+        request_serializer.is_valid(raise_exception=True)
+
+        # Убираем дубли с сохранением порядка
+        user_uuids = list(
+            dict.fromkeys(
+                str(user_uuid)
+                for user_uuid in request_serializer.validated_data["user_uuids"]
+            )
+        )
+
+        subscriptions = {}
+        chunk_size = settings.BULK_CHECK_CHUNK_SIZE
+        for i in range(0, len(user_uuids), chunk_size):
+            chunk = SubscriptionCache.get_many(user_uuids[i : i + chunk_size])
+            for user_uuid, data in chunk.items():
+                subscriptions[user_uuid] = (
+                    {
+                        "status": data["status"],
+                        "end_date": data["end_date"],
+                        "plan_id": data["plan"],
+                    }
+                    if data is not None
+                    else None
+                )
+
+        return Response({"subscriptions": subscriptions}, status=status.HTTP_200_OK)
+
+    @extend_schema(
+        request=serializers.CheckSubscriptionsRequestSerializer,
+        responses={200: serializers.CheckEntitlementsResponseSerializer},
+    )
+    @action(methods=["POST"], detail=False)
+    def check_entitlements(self, request: Request) -> Response:
+        """
+        Ручка для массовой проверки доступа по списку user_uuid
+
+        Читает только таблицу entitlement, без кэша, подписок и платежей
+        """
+        request_serializer = serializers.CheckSubscriptionsRequestSerializer(
+            data=request.data,
+        )
+        request_serializer.is_valid(raise_exception=True)
+
+        user_uuids = list(
+            dict.fromkeys(
+                str(user_uuid)
+                for user_uuid in request_serializer.validated_data["user_uuids"]
+            )
+        )
+
+        entitlements = {}
+        chunk_size = settings.BULK_CHECK_CHUNK_SIZE
+        for i in range(0, len(user_uuids), chunk_size):
+            entitlements.update(
+                logic.EntitlementLogic.get_many(user_uuids[i : i + chunk_size])
+            )
+
+        return Response({"entitlements": entitlements}, status=status.HTTP_200_OK)
 
     @extend_schema(
         request=serializers.RenewSubscriptionRequestSerializer,
@@ -90,7 +183,7 @@ class SubcriptionViewSet(viewsets.GenericViewSet):
         """
         Ручка для ручного продления подписки
 
-        Можно продлить только cancelled подписку
+        Можно продлить только cancelled, expired или past_due подписку
         """
         request_serializer = serializers.RenewSubscriptionRequestSerializer(
             data=request.data,
@@ -109,9 +202,9 @@ class SubcriptionViewSet(viewsets.GenericViewSet):
                 {"detail": "Subscription not found"}, status=status.HTTP_404_NOT_FOUND
             )
 
-        if subscription.status != "cancelled":
+        if subscription.status not in ("cancelled", "expired", "past_due"):
             return Response(
-                {"detail": "Subscription is not cancelled"},
+                {"detail": "Subscription is not cancelled, expired or past due"},
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
@@ -134,7 +227,7 @@ class SubcriptionViewSet(viewsets.GenericViewSet):
         """
         Ручка для отмены подписки
 
-        Можно отменить только активную подписку
+        Можно отменить только активную подписку или подписку в past_due
         """
         user_uuid = request.query_params.get("user_uuid", None)
         if user_uuid is None:
@@ -151,9 +244,9 @@ class SubcriptionViewSet(viewsets.GenericViewSet):
                 status=status.HTTP_404_NOT_FOUND,
             )
 
-        if subscription.status != "active":
+        if subscription.status not in ("active", "past_due"):
             return Response(
-                {"detail": "subscription is not active"},
+                {"detail": "subscription is not active or past_due"},
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
@@ -172,7 +265,7 @@ class SubcriptionViewSet(viewsets.GenericViewSet):
         """
         Ручка удаления подписки по user_uuid
 
-        Можно удалить только cancelled подписку
+        Можно удалить только cancelled или expired подписку
         """
         user_uuid = request.query_params.get("user_uuid", None)
         if user_uuid is None:
@@ -188,33 +281,34 @@ class SubcriptionViewSet(viewsets.GenericViewSet):
                 status=status.HTTP_404_NOT_FOUND,
             )
 
-        if subscription.status != "cancelled":
+        if subscription.status not in ("cancelled", "expired"):
             return Response(
-                {"detail": "subscription is not cancelled"},
+                {"detail": "subscription is not cancelled or expired"},
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        if subscription.auto_renew:
-            # Удаляем таску на автоматическую оплату
-            auto_payment = models.AutoSubscriptionTasks.objects.filter(
-                subscription=subscription
-            ).first()
-
-            if auto_payment:
-                logic.PeriodicTasksLogic.remove_periodic_task_with_clocked(
-                    auto_payment.task
-                )
-
-                auto_payment.delete()
-
-        subscription.delete()
+        logic.SubscriptionLogic.remove_subscription(subscription)
 
         return Response(status=status.HTTP_204_NO_CONTENT)
 
-    @action(methods=["GET"], detail=False)
+    @extend_schema(
+        parameters=[
+            OpenApiParameter("user_uuid", str, required=True),
+            OpenApiParameter(
+                "fields",
+                str,
+                description="Поля платежа через запятую, по умолчанию все",
+            ),
+        ],
+        responses={200: serializers.PaymentHistoryResponseSerializer(many=True)},
+    )
+    @action(methods=["GET"], detail=False, pagination_class=PaymentHistoryPagination)
     def get_user_payment_history(self, request: Request) -> Response:
         """
         Получение истории оплаты по user_uuid
+
+        Платежи отдаются страницами от новых к старым, следующая страница
+        запрашивается по next_cursor из ответа
         """
 
         user_uuid = request.query_params.get("user_uuid", None)
@@ -225,14 +319,40 @@ class SubcriptionViewSet(viewsets.GenericViewSet):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        payments = models.Payment.objects.filter(user_uuid=user_uuid)
+        try:
+            user_uuid = uuid.UUID(user_uuid)
+        except ValueError:
+            return Response(
+                {"detail": "user_uuid is invalid"}, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        payments = models.Payment.objects.filter(user_uuid=user_uuid).exclude(
+            # Импортированный способ оплаты не платеж пользователя
+            yk_payment_id__startswith=IMPORTED_PAYMENT_PREFIX
+        )
+
+        fields = request.query_params.get("fields", None)
+        if fields:
+            fields = fields.split(",")
+            available_fields = serializers.PaymentHistoryResponseSerializer().fields
+            unknown_fields = set(fields) - set(available_fields)
+            if unknown_fields:
+                return Response(
+                    {"detail": f"unknown fields: {', '.join(sorted(unknown_fields))}"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            # Поля сортировки нужны для курсора следующей страницы
+            payments = payments.only(*fields, "payment_date", "id")
+
+        page = self.paginate_queryset(payments)
 
         response_serializer = serializers.PaymentHistoryResponseSerializer(
-            payments,
+            page,
             many=True,
+            fields=fields or None,
         )
 
-        return Response(response_serializer.data, status=status.HTTP_200_OK)
+        return self.get_paginated_response(response_serializer.data)
 
     @extend_schema(
         request=serializers.PaymentNotificationRequestSerializer,
@@ -241,67 +361,60 @@ class SubcriptionViewSet(viewsets.GenericViewSet):
     def payment_notification(self, request: Request) -> Response:
         """
         Ручка для уведомления об оплате
-        """
-        try:
-            event_json = json.loads(request.body)
-        except json.JSONDecodeError:
-            return Response(status=status.HTTP_400_BAD_REQUEST)
-
-        # Создаём объект уведомления
-        try:
-            notification_object = WebhookNotification(event_json)
-        except Exception:
-            # Если не удалось создать уведомление, вернем ошибку
-            return Response(status=status.HTTP_400_BAD_REQUEST)
-
-        payment = notification_object.object
-
-        if not payment:
-            return Response(status=status.HTTP_400_BAD_REQUEST)
 
-        payment_db = models.Payment.objects.filter(yk_payment_id=payment.id).first()
-
-        if payment_db is None:
+        Уведомление сохраняется и применяется асинхронно таской process_payment_events
+        """
+        notification = logic.PaymentEventLogic.parse_notification(request.body)
+        if notification is None:
             return Response(status=status.HTTP_400_BAD_REQUEST)
 
-        subscription: models.Subscription = payment_db.subscription
-
-        # Если платеж прошел
-        if payment.paid is True:
-
-            # Ставим статус active
-            subscription.status = "active"
-
-            # Если установленно автоматическое продление подписки
-            if subscription.auto_renew and payment.payment_method:
+        event, yk_payment_id, payload = notification
+        is_new = logic.PaymentEventLogic.store_event(
+            event=event, yk_payment_id=yk_payment_id, payload=payload
+        )
+        if is_new:
+            transaction.on_commit(tasks.process_payment_events.delay)
 
-                payment_db.yk_payment_method_id = payment.payment_method.id
-                payment_db.save(update_fields=["yk_payment_method_id"])
+        return Response(status=status.HTTP_200_OK)
 
-                # Таска на автоматическое продление подписки
-                auto_payment_task = logic.PeriodicTasksLogic.create_auto_payment_task(
-                    subscription.pk, subscription.plan.days
-                )
 
-                models.AutoSubscriptionTasks.objects.create(
-                    subscription=subscription, task=auto_payment_task
-                )
+def _export_authorized(request: HttpRequest) -> bool:
+    if not settings.EXPORT_API_TOKEN:
+        return False
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    return scheme == "Bearer" and hmac.compare_digest(
+        token.encode(), settings.EXPORT_API_TOKEN.encode()
+    )
 
-            else:
-                # Создаем таску на остановку подписки по её окончанию
-                stop_sub_task = logic.PeriodicTasksLogic.create_stop_subscription_task(
-                    subscription.pk, subscription.plan.days
-                )
-                models.AutoSubscriptionTasks.objects.create(
-                    subscription=subscription, task=stop_sub_task
-                )
-        else:
-            # Если оплата не прошла
-            subscription.status = "cancelled"
-        subscription.save(
-            update_fields=[
-                "status",
-            ]
-        )
 
-        return Response(status=status.HTTP_200_OK)
+@require_GET
+def export_data(request: HttpRequest, dataset: str) -> HttpResponse:
+    """
+    Потоковая выгрузка подписок или платежей для аналитики
+
+    Параметры запроса:
+        format - csv (по умолчанию), ndjson или parquet
+        since - водяной знак прошлой выгрузки (ISO 8601), выгружаются строки новее
+    """
+    if not _export_authorized(request):
+        return HttpResponse(status=status.HTTP_403_FORBIDDEN)
+
+    since = None
+    if request.GET.get("since"):
+        since = parse_datetime(request.GET["since"])
+        if since is None:
+            return HttpResponse("invalid since", status=status.HTTP_400_BAD_REQUEST)
+
+    export_format = request.GET.get("format", "csv")
+    try:
+        export = Export(dataset, export_format, since)
+    except ExportError as e:
+        return HttpResponse(str(e), status=status.HTTP_400_BAD_REQUEST)
+
+    # Сервис работает под ASGI: синхронный итератор Django прочитал бы
+    # всю выгрузку в память до отправки первого байта
+    response = StreamingHttpResponse(export.astream(), content_type=export.content_type)
+    response["Content-Disposition"] = (
+        f'attachment; filename="{dataset}.{export_format}"'
+    )
+    return response
@@ -0,0 +1,284 @@
+"""
+Запросы к API ЮKassa и разбор ответов.
+
+Общая часть YooKassaClient и AsyncYooKassaClient: функции модуля строят
+ApiRequest и приводят ответы API к формату сервиса, а клиенты только
+выполняют запросы через httpx синхронно или асинхронно.
+"""
+
+import uuid
+from dataclasses import dataclass
+
+import httpx
+from django.conf import settings
+
+from . import exceptions, sub_types
+
+
+@dataclass
+class ApiRequest:
+    """
+    Запрос к API ЮKassa.
+
+    operation - имя операции для RetryPolicy (таймаут, ретраи, circuit breaker)
+    """
+
+    operation: str
+    method: str
+    path: str
+    body: dict | None = None
+    params: dict | None = None
+    idempotence_key: str | None = None
+
+    @property
+    def headers(self) -> dict:
+        if self.idempotence_key is None:
+            return {}
+        return {"Idempotence-Key": self.idempotence_key}
+
+
+def http_options(account_id: str, secret_key: str) -> dict:
+    """Параметры httpx.Client и httpx.AsyncClient для API ЮKassa"""
+    return {
+        "base_url": settings.YOOKASSA_API_URL,
+        "auth": (account_id or "", secret_key or ""),
+        "limits": httpx.Limits(
+            max_connections=settings.YOOKASSA_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.YOOKASSA_HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=settings.YOOKASSA_HTTP_KEEPALIVE_EXPIRY,
+        ),
+        "timeout": settings.YOOKASSA_HTTP_TIMEOUT,
+    }
+
+
+def parse_response(response: httpx.Response) -> dict:
+    """
+    Тело ответа API.
+
+    :raises exceptions.YooKassaError: если API ответил не 200
+    """
+    if response.status_code != 200:
+        try:
+            content = response.json()
+        except ValueError:
+            content = response.text
+        raise exceptions.YooKassaError(response.status_code, content)
+    return response.json()
+
+
+def create_payment(
+    amount: float,
+    currency: str,
+    return_url: str,
+    user_id: str,
+    save_payment_method: bool = False,
+    description: str = None,
+    idempotence_key: str | None = None,
+) -> ApiRequest:
+    """
+    Создание платежа с переходом на страницу оплаты.
+
+    :param amount: сумма платежа, float
+    :param currency: код валюты, например 'RUB'
+    :param return_url: URL, на который пользователь вернется после оплаты
+    :param user_id: идентификатор пользователя (UUID), сохраняется в metadata
+    :param save_payment_method: сохранить ли способ оплаты для автоплатежей
+    :param description: описание платежа, можно указать информацию о подписке, или user_id
+    :param idempotence_key: ключ идемпотентности, по умолчанию случайный
+    """
+    if description is None:
+        description = f"Payment for user {user_id}"
+
+    return ApiRequest(
+        "create_payment",
+        "POST",
+        "/payments",
+        body={
+            "amount": {"value": f"{amount:.2f}", "currency": currency},
+            "confirmation": {"type": "redirect", "return_url": return_url},
+            "capture": True,
+            "description": description,
+            "save_payment_method": save_payment_method,
+            "metadata": {"user_id": user_id},
+        },
+        idempotence_key=idempotence_key or str(uuid.uuid4()),
+    )
+
+
+def cancel_payment(payment_id: str, idempotence_key: str | None = None) -> ApiRequest:
+    """
+    Отмена платежа в статусе waiting_for_capture.
+
+    :param payment_id: идентификатор платежа
+    :param idempotence_key: ключ идемпотентности, по умолчанию случайный
+    """
+    return ApiRequest(
+        "cancel_payment",
+        "POST",
+        f"/payments/{payment_id}/cancel",
+        body={},
+        idempotence_key=idempotence_key or str(uuid.uuid4()),
+    )
+
+
+def list_payments(limit: int = 100, cursor: str | None = None, **filters) -> ApiRequest:
+    """
+    Страница списка платежей магазина, новые сверху.
+
+    Список читает синхронизация локального зеркала provider_payment
+    (provider_sync), остальной код читает зеркало, а не этот список.
+
+    :param limit: размер страницы, не больше 100
+    :param cursor: курсор страницы из предыдущего ответа
+    :param filters: фильтры списка, например {"created_at.gte": "..."}
+    """
+    params = {"limit": limit, **filters}
+    if cursor is not None:
+        params["cursor"] = cursor
+    return ApiRequest("list_payments", "GET", "/payments", params=params)
+
+
+def get_payment(payment_id: str) -> ApiRequest:
+    """
+    Платеж по идентификатору.
+
+    :param payment_id: идентификатор платежа
+    """
+    return ApiRequest("get_payment", "GET", f"/payments/{payment_id}")
+
+
+def charge_autopayment(
+    user_id: str,
+    amount: float,
+    currency: str,
+    payment_method_id: str,
+    description: str,
+    idempotence_key: str | None = None,
+) -> ApiRequest:
+    """
+    Автоплатеж с сохраненным способом оплаты.
+
+    :param amount: сумма списания
+    :param currency: валюта
+    :param payment_method_id: идентификатор сохраненного способа оплаты (получен из успешного платежа)
+    :param description: описание платежа
+    :param idempotence_key: ключ идемпотентности, по умолчанию случайный
+    """
+    return ApiRequest(
+        "charge_autopayment",
+        "POST",
+        "/payments",
+        body={
+            "amount": {"value": f"{amount:.2f}", "currency": currency},
+            "capture": True,
+            "payment_method_id": payment_method_id,
+            "description": description,
+            "metadata": {"user_id": user_id},
+        },
+        idempotence_key=idempotence_key or str(uuid.uuid4()),
+    )
+
+
+def refund_payment(
+    payment_id: str,
+    amount: float,
+    currency: str = "RUB",
+    idempotence_key: str | None = None,
+) -> ApiRequest:
+    """
+    Возврат платежа.
+
+    :param payment_id: идентификатор исходного платежа
+    :param amount: сумма возврата
+    :param currency: валюта
+    :param idempotence_key: ключ идемпотентности, по умолчанию случайный
+    """
+    return ApiRequest(
+        "create_refund",
+        "POST",
+        "/refunds",
+        body={
+            "payment_id": payment_id,
+            "amount": {"value": f"{amount:.2f}", "currency": currency},
+        },
+        idempotence_key=idempotence_key or str(uuid.uuid4()),
+    )
+
+
+def checkout_info(payment: dict) -> dict:
+    """Созданный платеж с confirmation_url для оплаты"""
+    confirmation = payment.get("confirmation")
+    return {
+        "payment_id": payment["id"],
+        "status": payment["status"],
+        "paid": payment["paid"],
+        "amount": payment["amount"],
+        "created_at": payment["created_at"],
+        "confirmation_url": (
+            confirmation.get("confirmation_url") if confirmation else None
+        ),
+        "description": payment.get("description"),
+        "metadata": payment.get("metadata"),
+    }
+
+
+def cancellation_info(payment: dict) -> dict:
+    """Отмененный платеж"""
+    return {
+        "payment_id": payment["id"],
+        "status": payment["status"],
+        "cancellation_details": payment.get("cancellation_details"),
+    }
+
+
+def autopayment_info(payment: dict) -> dict:
+    """Платеж автоплатежа с причиной отказа банка"""
+    return {
+        "payment_id": payment["id"],
+        "status": payment["status"],
+        "paid": payment["paid"],
+        "amount": payment["amount"],
+        "created_at": payment["created_at"],
+        "description": payment.get("description"),
+        "metadata": payment.get("metadata"),
+        "cancellation_details": payment.get("cancellation_details"),
+    }
+
+
+def payment_info(payment: dict) -> dict:
+    """Платеж из ответа API или объекта уведомления"""
+    payment_method = payment.get("payment_method")
+    return {
+        "payment_id": payment["id"],
+        "status": payment["status"],
+        "paid": payment["paid"],
+        "amount": payment["amount"],
+        "created_at": payment["created_at"],
+        "description": payment.get("description"),
+        "metadata": payment.get("metadata"),
+        "payment_method_id": payment_method["id"] if payment_method else None,
+    }
+
+
+def payments_page(page: dict) -> tuple[list[dict], str | None]:
+    """Платежи страницы списка и курсор следующей страницы"""
+    return [payment_info(p) for p in page.get("items", [])], page.get("next_cursor")
+
+
+def refund_info(refund: dict) -> sub_types.RefundResponse:
+    """Созданный возврат"""
+    refund_amount = refund.get("amount")
+    return sub_types.RefundResponse(
+        refund_id=refund.get("id"),
+        status=refund.get("status"),
+        payment_id=refund.get("payment_id"),
+        amount=(
+            sub_types.RefundAmount(
+                value=refund_amount["value"], currency=refund_amount["currency"]
+            )
+            if refund_amount
+            else None
+        ),
+        created_at=refund.get("created_at"),
+        description=refund.get("description"),
+    )
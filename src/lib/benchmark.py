@@ -0,0 +1,142 @@
+"""
+Общие утилиты бенчмарков: замер задержек, параллельный прогон и baseline.
+"""
+
+import json
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Iterable
+
+
+def percentiles(timings: list[float]) -> dict[str, float]:
+    """p50/p95/p99 списка замеров"""
+    if not timings:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0}
+    if len(timings) == 1:
+        return dict.fromkeys(("p50", "p95", "p99"), timings[0])
+
+    quantiles = statistics.quantiles(timings, n=100, method="inclusive")
+    return {"p50": quantiles[49], "p95": quantiles[94], "p99": quantiles[98]}
+
+
+@dataclass
+class BenchResult:
+    """
+    Результат сценария бенчмарка.
+
+    timings - задержки операций в миллисекундах, items - количество
+    обработанных единиц (может быть больше числа операций при пачечной обработке)
+    """
+
+    name: str
+    elapsed: float
+    timings: list[float] = field(default_factory=list)
+    errors: int = 0
+    items: int | None = None
+
+    def summary(self) -> dict[str, float]:
+        items = self.items if self.items is not None else len(self.timings)
+        return {
+            "ops": len(self.timings),
+            "errors": self.errors,
+            "throughput": items / self.elapsed if self.elapsed else 0.0,
+            **percentiles(self.timings),
+        }
+
+
+def run_concurrent(
+    name: str,
+    func: Callable,
+    items: Iterable,
+    concurrency: int,
+    teardown: Callable | None = None,
+) -> BenchResult:
+    """
+    Выполняет func для каждого элемента в пуле потоков и замеряет задержку.
+    Исключение или False в ответе func считается ошибкой.
+    teardown вызывается после каждого замера, его время не учитывается.
+    """
+    timings: list[float] = []
+    errors = 0
+    lock = threading.Lock()
+
+    def call(item) -> None:
+        nonlocal errors
+        started = time.perf_counter()
+        try:
+            ok = func(item) is not False
+        except Exception:
+            ok = False
+        duration = (time.perf_counter() - started) * 1000
+        if teardown is not None:
+            teardown()
+        with lock:
+            timings.append(duration)
+            if not ok:
+                errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(call, items))
+
+    return BenchResult(
+        name=name,
+        elapsed=time.perf_counter() - started,
+        timings=timings,
+        errors=errors,
+    )
+
+
+def load_baseline(path: Path) -> dict[str, dict]:
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text())
+
+
+def save_baseline(path: Path, summaries: dict[str, dict]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(summaries, indent=2, ensure_ascii=False))
+
+
+def find_regressions(
+    summaries: dict[str, dict], baseline: dict[str, dict], tolerance: float
+) -> list[str]:
+    """
+    Сценарии, у которых p95 вырос или пропускная способность упала
+    больше чем на tolerance (доля) относительно baseline
+    """
+    regressions = []
+    for name, summary in summaries.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if summary["p95"] > base["p95"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {base['p95']:.2f} -> {summary['p95']:.2f}")
+        if summary["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append(
+                f"{name}: throughput {base['throughput']:.1f} -> {summary['throughput']:.1f}"
+            )
+    return regressions
+
+
+def print_summaries(summaries: dict[str, dict], baseline: dict[str, dict]) -> None:
+    print(
+        f"{'сценарий':<28}{'ops':>8}{'ошибки':>8}{'ед/с':>10}"
+        f"{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}{'Δp95':>9}"
+    )
+    for name, summary in summaries.items():
+        base = baseline.get(name)
+        delta = (
+            f"{(summary['p95'] / base['p95'] - 1) * 100:+.0f}%"
+            if base and base["p95"]
+            else "-"
+        )
+        print(
+            f"{name:<28}{summary['ops']:>8}{summary['errors']:>8}"
+            f"{summary['throughput']:>10.1f}{summary['p50']:>10.2f}"
+            f"{summary['p95']:>10.2f}{summary['p99']:>10.2f}{delta:>9}"
+        )
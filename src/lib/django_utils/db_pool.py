@@ -0,0 +1,15 @@
+from django.db import connections
+
+
+def get_pool_stats() -> dict[str, dict[str, int]]:
+    """
+    Статистика пулов соединений psycopg текущего процесса по алиасам БД.
+
+    Алиасы без пула (DB_CONN_MODE не pool) в результат не попадают.
+    """
+    stats = {}
+    for connection in connections.all():
+        pool = getattr(connection, "pool", None)
+        if pool is not None:
+            stats[connection.alias] = pool.get_stats()
+    return stats
@@ -1,5 +1,13 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Model, Q, QuerySet
 from django.utils.encoding import force_str
 from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
 from rest_framework.response import Response
 
 
@@ -19,7 +27,7 @@ class ExtPagination(pagination.PageNumberPagination):
                 "current_page": (
                     int(current_page_from_request) if current_page_from_request else 1
                 ),
-                "total_pages": self.page.paginator.count,
+                "total_pages": self.page.paginator.num_pages,
             },
         )
 
@@ -65,3 +73,163 @@ class ExtPagination(pagination.PageNumberPagination):
                 },
             )
         return parameters
+
+
+class KeysetPagination(pagination.BasePagination):
+    """
+    Пагинация по ключу сортировки (keyset) без COUNT(*).
+
+    Позиция последней записи страницы передается клиенту в непрозрачном курсоре,
+    следующая страница выбирается условием по полям ordering, поэтому стоимость
+    запроса не зависит от номера страницы. Общее количество записей считается
+    только по запросу (with_total=true).
+    """
+
+    cursor_query_param = "cursor"
+    cursor_query_description = "Курсор следующей страницы"
+    page_size_query_param = "page_size"
+    total_query_param = "with_total"
+
+    page_size = 50
+    max_page_size = 1000
+
+    # Поля сортировки, последнее поле должно быть уникальным (например, id)
+    ordering: tuple[str, ...] = ("-id",)
+
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(
+        self, queryset: QuerySet, request: Request, view=None
+    ) -> list[Model]:
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.total = None
+
+        if self.with_total(request):
+            self.total = queryset.count()
+
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(request, queryset.model)
+        if position is not None:
+            queryset = queryset.filter(self.keyset_filter(position))
+
+        # Берем на одну запись больше, чтобы понять, есть ли следующая страница
+        rows = list(queryset[: self.page_size + 1])
+        has_next = len(rows) > self.page_size
+        rows = rows[: self.page_size]
+
+        self.next_cursor = self.encode_cursor(rows[-1]) if has_next else None
+        return rows
+
+    def get_page_size(self, request: Request) -> int:
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def with_total(self, request: Request) -> bool:
+        return request.query_params.get(self.total_query_param, "").lower() in (
+            "1",
+            "true",
+        )
+
+    def keyset_filter(self, position: list) -> Q:
+        """
+        Условие "строго после позиции" для сортировки ordering:
+        (a < x) OR (a = x AND b < y) OR ...
+        """
+        condition = Q()
+        for i, field in enumerate(self.ordering):
+            name = field.lstrip("-")
+            lookup = "lt" if field.startswith("-") else "gt"
+            step = Q(**{f"{name}__{lookup}": position[i]})
+            for prev_field, prev_value in zip(self.ordering[:i], position[:i]):
+                step &= Q(**{prev_field.lstrip("-"): prev_value})
+            condition |= step
+
+        # Ограничение по первому полю позволяет использовать индекс как диапазон
+        first = self.ordering[0]
+        first_lookup = "lte" if first.startswith("-") else "gte"
+        return Q(**{f"{first.lstrip('-')}__{first_lookup}": position[0]}) & condition
+
+    def encode_cursor(self, row: Model) -> str:
+        position = []
+        for field in self.ordering:
+            value = getattr(row, field.lstrip("-"))
+            position.append(value.isoformat() if hasattr(value, "isoformat") else value)
+        return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+    def decode_cursor(self, request: Request, model: type[Model]) -> list | None:
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+
+        try:
+            raw_position = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            if len(raw_position) != len(self.ordering):
+                raise ValueError
+            return [
+                model._meta.get_field(field.lstrip("-")).to_python(value)
+                for field, value in zip(self.ordering, raw_position)
+            ]
+        except (TypeError, ValueError, binascii.Error, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_paginated_response(self, data):
+        response = {
+            "items": data,
+            "page_size": self.page_size,
+            "next_cursor": self.next_cursor,
+        }
+        if self.total is not None:
+            response["total"] = self.total
+        return Response(response)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["items", "next_cursor"],
+            "properties": {
+                "items": schema,
+                "page_size": {
+                    "type": "integer",
+                    "example": 50,
+                },
+                "next_cursor": {
+                    "type": "string",
+                    "nullable": True,
+                },
+                "total": {
+                    "type": "integer",
+                    "example": 123,
+                },
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                "name": self.cursor_query_param,
+                "required": False,
+                "in": "query",
+                "description": force_str(self.cursor_query_description),
+                "schema": {"type": "string"},
+            },
+            {
+                "name": self.page_size_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Number of results to return per page.",
+                "schema": {"type": "integer", "example": self.page_size},
+            },
+            {
+                "name": self.total_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Посчитать общее количество записей",
+                "schema": {"type": "boolean", "example": False},
+            },
+        ]
@@ -0,0 +1,57 @@
+"""
+Распределенный лимит запросов token bucket в Redis.
+"""
+
+import asyncio
+
+import redis.asyncio as redis
+
+# Время берется из Redis, чтобы расхождение часов воркеров не влияло на лимит.
+# Возвращает сколько секунд нужно подождать, 0 - токен выдан
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local time = redis.call("TIME")
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "updated")
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(now - updated, 0) * rate)
+
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "updated", tostring(now))
+redis.call("EXPIRE", KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(wait)
+"""
+
+
+class RedisTokenBucket:
+    """
+    Token bucket, общий для всех процессов, которые ходят в один Redis.
+
+    rate - токенов в секунду, capacity - максимальный всплеск запросов.
+    """
+
+    def __init__(self, client: redis.Redis, key: str, rate: float, capacity: float):
+        self.client = client
+        self.key = key
+        self.rate = rate
+        self.capacity = capacity
+        self.script = client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    async def acquire(self) -> None:
+        """Дождаться свободного токена"""
+        while True:
+            wait = float(
+                await self.script(keys=[self.key], args=[self.rate, self.capacity])
+            )
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
@@ -0,0 +1,179 @@
+"""
+Супервизор дочерних процессов: запуск, перезапуск упавших с экспоненциальной
+задержкой, остановка по SIGTERM/SIGINT и HTTP ручка здоровья.
+
+Процессы запускаются напрямую через subprocess без оболочки и живут, пока жив
+супервизор, поэтому pid файлы не нужны.
+"""
+
+import json
+import logging
+import os
+import signal
+import subprocess
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger("sub")
+
+
+@dataclass
+class ProcessSpec:
+    name: str
+    argv: list[str]
+    # Переменные окружения поверх окружения супервизора
+    env: dict[str, str] = field(default_factory=dict)
+
+
+@dataclass
+class ManagedProcess:
+    spec: ProcessSpec
+    process: subprocess.Popen | None = None
+    started_at: float = 0.0
+    restarts: int = 0
+    # Когда можно перезапустить упавший процесс
+    restart_at: float | None = None
+    last_exit_code: int | None = None
+
+    @property
+    def running(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def status(self) -> dict:
+        return {
+            "running": self.running,
+            "pid": self.process.pid if self.running else None,
+            "uptime": (
+                round(time.monotonic() - self.started_at, 1) if self.running else 0.0
+            ),
+            "restarts": self.restarts,
+            "last_exit_code": self.last_exit_code,
+        }
+
+
+class Supervisor:
+    def __init__(
+        self,
+        specs: list[ProcessSpec],
+        restart_delay: float = 1.0,
+        max_restart_delay: float = 60.0,
+        stable_seconds: float = 60.0,
+        stop_timeout: float = 30.0,
+        health_port: int | None = None,
+    ):
+        """
+        :param restart_delay: задержка перед первым перезапуском, дальше удваивается
+        :param max_restart_delay: максимальная задержка перед перезапуском
+        :param stable_seconds: процесс, проработавший столько секунд, считается
+            стабильным, и задержка перезапуска сбрасывается
+        :param stop_timeout: сколько ждать завершения процессов после SIGTERM
+            перед SIGKILL
+        :param health_port: порт HTTP ручки здоровья, None - без ручки
+        """
+        self.processes = [ManagedProcess(spec) for spec in specs]
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.stable_seconds = stable_seconds
+        self.stop_timeout = stop_timeout
+        self.health_port = health_port
+        self.stopping = threading.Event()
+
+    def run(self) -> None:
+        """Запустить процессы и следить за ними до SIGTERM или SIGINT"""
+        signal.signal(signal.SIGTERM, self._handle_signal)
+        signal.signal(signal.SIGINT, self._handle_signal)
+
+        health_server = self._start_health_server()
+        for managed in self.processes:
+            self._start(managed)
+
+        try:
+            while not self.stopping.wait(0.5):
+                self._check()
+        finally:
+            self._stop_all()
+            if health_server is not None:
+                health_server.shutdown()
+
+    def status(self) -> dict:
+        processes = {managed.spec.name: managed.status() for managed in self.processes}
+        return {
+            "healthy": all(process["running"] for process in processes.values()),
+            "processes": processes,
+        }
+
+    def _handle_signal(self, signum: int, frame) -> None:
+        logger.info(
+            f"Получен сигнал {signal.Signals(signum).name}, останавливаем процессы"
+        )
+        self.stopping.set()
+
+    def _start(self, managed: ManagedProcess) -> None:
+        managed.process = subprocess.Popen(
+            managed.spec.argv, env={**os.environ, **managed.spec.env}
+        )
+        managed.started_at = time.monotonic()
+        managed.restart_at = None
+        logger.info(f"Запущен {managed.spec.name}, pid {managed.process.pid}")
+
+    def _check(self) -> None:
+        now = time.monotonic()
+        for managed in self.processes:
+            if managed.running:
+                continue
+
+            if managed.restart_at is None:
+                managed.last_exit_code = managed.process.returncode
+                uptime = now - managed.started_at
+                if uptime >= self.stable_seconds:
+                    managed.restarts = 0
+                delay = min(
+                    self.max_restart_delay, self.restart_delay * 2**managed.restarts
+                )
+                managed.restart_at = now + delay
+                logger.error(
+                    f"{managed.spec.name} завершился с кодом {managed.last_exit_code} "
+                    f"через {uptime:.0f} с, перезапуск через {delay:.1f} с"
+                )
+            elif now >= managed.restart_at:
+                managed.restarts += 1
+                self._start(managed)
+
+    def _stop_all(self) -> None:
+        running = [managed for managed in self.processes if managed.running]
+        for managed in running:
+            managed.process.terminate()
+
+        deadline = time.monotonic() + self.stop_timeout
+        for managed in running:
+            try:
+                managed.process.wait(max(deadline - time.monotonic(), 0))
+            except subprocess.TimeoutExpired:
+                logger.warning(f"{managed.spec.name} не завершился, SIGKILL")
+                managed.process.kill()
+                managed.process.wait()
+
+    def _start_health_server(self) -> ThreadingHTTPServer | None:
+        if self.health_port is None:
+            return None
+
+        supervisor = self
+
+        class HealthHandler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                status = supervisor.status()
+                body = json.dumps(status).encode()
+                self.send_response(200 if status["healthy"] else 503)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args) -> None:
+                pass
+
+        server = ThreadingHTTPServer(("0.0.0.0", self.health_port), HealthHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
@@ -0,0 +1,407 @@
+"""
+Симулятор API ЮKassa для локальных бенчмарков и нагрузочных тестов.
+
+Реализует ручки, которыми пользуются YooKassaClient и AsyncYooKassaClient:
+создание, получение, список и отмену платежей, автоплатежи по сохраненному
+способу оплаты и возвраты. Данные хранятся в памяти процесса.
+
+Задержки, отказы, лимит запросов и отправка уведомлений в payment_notification
+настраиваются конфигом (см. lib.yookassa_fake.config). Служебные ручки:
+    GET /_fake/stats - количество ответов по операциям и статусам
+    POST /_fake/config - заменить конфиг
+    POST /_fake/reset - очистить платежи, возвраты и статистику
+
+uvicorn lib.yookassa_fake.app:app --port 8081
+YOOKASSA_API_URL=http://127.0.0.1:8081/v3
+"""
+
+import asyncio
+import json
+import random
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from typing import Awaitable, Callable
+from urllib.parse import parse_qsl
+
+import httpx
+
+from .config import OperationConfig, SimulatorConfig
+
+Scope = dict
+Receive = Callable[[], Awaitable[dict]]
+Send = Callable[[dict], Awaitable[None]]
+Handler = Callable[[dict, Scope, OperationConfig], tuple[int, dict]]
+
+API_PREFIX = "/v3"
+
+
+def now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="milliseconds")
+
+
+def error_body(code: str, description: str) -> dict:
+    return {
+        "type": "error",
+        "id": str(uuid.uuid4()),
+        "code": code,
+        "description": description,
+    }
+
+
+class FakeYooKassa:
+    """
+    ASGI приложение симулятора ЮKassa.
+
+    Обычный платеж создается в статусе pending с confirmation_url, автоплатеж
+    по payment_method_id проходит сразу (или отклоняется с decline_rate).
+    Повторный запрос с тем же Idempotence-Key возвращает сохраненный ответ,
+    как в настоящем API.
+    """
+
+    def __init__(self, config: SimulatorConfig | None = None):
+        self.config = config or SimulatorConfig()
+        self.payments: dict[str, dict] = {}
+        self.refunds: dict[str, dict] = {}
+        self.idempotence: dict[tuple[str, str], tuple[int, dict]] = {}
+        self.stats: defaultdict[str, Counter] = defaultdict(Counter)
+        self.background: set[asyncio.Task] = set()
+        self.webhook_client: httpx.AsyncClient | None = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+
+        body = b""
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+        status, content = await self.handle(scope, body)
+        await self.respond(send, status, content)
+
+    async def lifespan(self, receive: Receive, send: Send) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self.webhook_client is not None:
+                    await self.webhook_client.aclose()
+                    self.webhook_client = None
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    @staticmethod
+    async def respond(send: Send, status: int, content: dict) -> None:
+        payload = json.dumps(content).encode()
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(payload)).encode()),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": payload})
+
+    async def handle(self, scope: Scope, body: bytes) -> tuple[int, dict]:
+        """Маршрутизация, лимит запросов, инъекция задержек и отказов"""
+        method = scope["method"]
+        path = scope["path"].removeprefix(API_PREFIX).rstrip("/")
+        headers = dict(scope["headers"])
+
+        try:
+            data = json.loads(body) if body else {}
+        except json.JSONDecodeError:
+            return 400, error_body("invalid_request", "Malformed JSON")
+
+        if path.startswith("/_fake/"):
+            return self.admin(method, path, data)
+
+        operation, handler = self.resolve(method, path, data)
+        if handler is None:
+            return 404, error_body("not_found", f"{method} {path} is not supported")
+
+        status, content = await self.call(operation, handler, data, scope, headers)
+        self.stats[operation][status] += 1
+        return status, content
+
+    async def call(
+        self,
+        operation: str,
+        handler: Handler,
+        data: dict,
+        scope: Scope,
+        headers: dict,
+    ) -> tuple[int, dict]:
+        op_config = self.config.for_operation(operation)
+
+        if not self.config.rate_limit.acquire():
+            return 429, error_body("too_many_requests", "Rate limit exceeded")
+
+        await asyncio.sleep(op_config.latency.sample())
+
+        roll = random.random()
+        if roll < op_config.timeout_rate:
+            await asyncio.sleep(op_config.hang_seconds)
+            return 500, error_body("internal_server_error", "Request timed out")
+        if roll < op_config.timeout_rate + op_config.error_rate:
+            return 500, error_body("internal_server_error", "Injected failure")
+
+        idempotence_key = headers.get(b"idempotence-key")
+        if scope["method"] != "POST" or idempotence_key is None:
+            return handler(data, scope, op_config)
+
+        key = (scope["path"], idempotence_key.decode())
+        if key in self.idempotence:
+            return self.idempotence[key]
+        result = handler(data, scope, op_config)
+        if result[0] == 200:
+            self.idempotence[key] = result
+        return result
+
+    def resolve(self, method: str, path: str, data: dict) -> tuple[str, Handler | None]:
+        parts = path.strip("/").split("/")
+
+        if parts == ["payments"] and method == "POST":
+            if data.get("payment_method_id"):
+                return "charge_autopayment", self.charge_autopayment
+            return "create_payment", self.create_payment
+        if parts == ["payments"] and method == "GET":
+            return "list_payments", self.list_payments
+        if len(parts) == 2 and parts[0] == "payments" and method == "GET":
+            return "get_payment", self.find_payment
+        if len(parts) == 3 and parts[0] == "payments" and parts[2] == "cancel":
+            return "cancel_payment", self.cancel_payment
+        if parts == ["refunds"] and method == "POST":
+            return "create_refund", self.create_refund
+
+        return "", None
+
+    def admin(self, method: str, path: str, data: dict) -> tuple[int, dict]:
+        if path == "/_fake/stats" and method == "GET":
+            return 200, {
+                "payments": len(self.payments),
+                "refunds": len(self.refunds),
+                "operations": {
+                    operation: {str(status): count for status, count in counter.items()}
+                    for operation, counter in self.stats.items()
+                },
+            }
+        if path == "/_fake/config" and method == "POST":
+            try:
+                self.config = SimulatorConfig.from_dict(data)
+            except (TypeError, ValueError) as error:
+                return 400, error_body("invalid_request", str(error))
+            return 200, data
+        if path == "/_fake/reset" and method == "POST":
+            self.payments.clear()
+            self.refunds.clear()
+            self.idempotence.clear()
+            self.stats.clear()
+            return 200, {}
+
+        return 404, error_body("not_found", f"{method} {path} is not supported")
+
+    def create_payment(
+        self, data: dict, scope: Scope, op_config: OperationConfig
+    ) -> tuple[int, dict]:
+        if "amount" not in data:
+            return 400, error_body("invalid_request", "Parameter amount is required")
+
+        payment = self.new_payment(data)
+        payment["confirmation"] = {
+            "type": "redirect",
+            "return_url": data.get("confirmation", {}).get("return_url"),
+            "confirmation_url": f"https://yoomoney.ru/checkout/payments/v2/contract?orderId={payment['id']}",
+        }
+        payment["payment_method"] = {
+            "type": "bank_card",
+            "id": str(uuid.uuid4()),
+            "saved": bool(data.get("save_payment_method")),
+        }
+
+        if self.config.webhook.auto_confirm:
+            self.run_in_background(self.confirm_later(payment["id"]))
+        return 200, payment
+
+    def charge_autopayment(
+        self, data: dict, scope: Scope, op_config: OperationConfig
+    ) -> tuple[int, dict]:
+        if "amount" not in data:
+            return 400, error_body("invalid_request", "Parameter amount is required")
+
+        payment = self.new_payment(data)
+        payment["payment_method"] = {
+            "type": "bank_card",
+            "id": data["payment_method_id"],
+            "saved": True,
+        }
+
+        if random.random() < op_config.decline_rate:
+            payment.update(
+                status="canceled",
+                cancellation_details={
+                    "party": "payment_network",
+                    "reason": "insufficient_funds",
+                },
+            )
+        else:
+            payment.update(
+                status="succeeded",
+                paid=True,
+                refundable=True,
+                captured_at=now_iso(),
+            )
+
+        self.notify(payment)
+        return 200, payment
+
+    def new_payment(self, data: dict) -> dict:
+        payment_id = str(uuid.uuid4())
+        payment = {
+            "id": payment_id,
+            "status": "pending",
+            "paid": False,
+            "amount": data["amount"],
+            "description": data.get("description"),
+            "metadata": data.get("metadata", {}),
+            "created_at": now_iso(),
+            "refundable": False,
+            "test": True,
+        }
+        self.payments[payment_id] = payment
+        return payment
+
+    def find_payment(
+        self, data: dict, scope: Scope, op_config: OperationConfig
+    ) -> tuple[int, dict]:
+        payment_id = scope["path"].rstrip("/").split("/")[-1]
+        payment = self.payments.get(payment_id)
+        if payment is None:
+            return 404, error_body("not_found", "Payment not found")
+        return 200, payment
+
+    def list_payments(
+        self, data: dict, scope: Scope, op_config: OperationConfig
+    ) -> tuple[int, dict]:
+        params = dict(parse_qsl(scope["query_string"].decode()))
+        limit = int(params.get("limit", 10))
+        # Как в ЮKassa: новые сверху, cursor - непрозрачная позиция следующей страницы
+        items = list(self.payments.values())[::-1]
+        if "created_at.gte" in params:
+            gte = datetime.fromisoformat(
+                params["created_at.gte"].replace("Z", "+00:00")
+            )
+            items = [
+                payment
+                for payment in items
+                if datetime.fromisoformat(payment["created_at"]) >= gte
+            ]
+
+        offset = int(params.get("cursor", 0))
+        body = {"type": "list", "items": items[offset : offset + limit]}
+        if offset + limit < len(items):
+            body["next_cursor"] = str(offset + limit)
+        return 200, body
+
+    def cancel_payment(
+        self, data: dict, scope: Scope, op_config: OperationConfig
+    ) -> tuple[int, dict]:
+        payment_id = scope["path"].rstrip("/").split("/")[-2]
+        payment = self.payments.get(payment_id)
+        if payment is None:
+            return 404, error_body("not_found", "Payment not found")
+        if payment["status"] not in ("pending", "waiting_for_capture"):
+            return 400, error_body(
+                "invalid_request", "Payment cannot be canceled in this status"
+            )
+
+        payment.update(
+            status="canceled",
+            cancellation_details={
+                "party": "merchant",
+                "reason": "canceled_by_merchant",
+            },
+        )
+        self.notify(payment)
+        return 200, payment
+
+    def create_refund(
+        self, data: dict, scope: Scope, op_config: OperationConfig
+    ) -> tuple[int, dict]:
+        payment = self.payments.get(data.get("payment_id"))
+        if payment is None:
+            return 400, error_body("invalid_request", "Payment not found")
+
+        refund_id = str(uuid.uuid4())
+        refund = {
+            "id": refund_id,
+            "payment_id": payment["id"],
+            "status": "succeeded",
+            "amount": data.get("amount", payment["amount"]),
+            "created_at": now_iso(),
+            "description": data.get("description"),
+        }
+        self.refunds[refund_id] = refund
+        return 200, refund
+
+    def run_in_background(self, coroutine: Awaitable) -> None:
+        task = asyncio.ensure_future(coroutine)
+        self.background.add(task)
+        task.add_done_callback(self.background.discard)
+
+    async def confirm_later(self, payment_id: str) -> None:
+        """Пользователь оплачивает платеж на странице ЮKassa через webhook.delay"""
+        await asyncio.sleep(self.config.webhook.delay.sample())
+        payment = self.payments.get(payment_id)
+        if payment is None or payment["status"] != "pending":
+            return
+
+        payment.update(
+            status="succeeded", paid=True, refundable=True, captured_at=now_iso()
+        )
+        await self.send_notification(payment)
+
+    def notify(self, payment: dict) -> None:
+        """Отправить уведомление о смене статуса платежа через webhook.delay"""
+        if not self.config.webhook.url:
+            return
+
+        async def send_later() -> None:
+            await asyncio.sleep(self.config.webhook.delay.sample())
+            await self.send_notification(payment)
+
+        self.run_in_background(send_later())
+
+    async def send_notification(self, payment: dict) -> None:
+        webhook = self.config.webhook
+        if not webhook.url:
+            return
+
+        if self.webhook_client is None:
+            self.webhook_client = httpx.AsyncClient(timeout=10)
+
+        notification = {
+            "type": "notification",
+            "event": f"payment.{payment['status']}",
+            "object": payment,
+        }
+        attempts = 2 if random.random() < webhook.duplicate_rate else 1
+        for _ in range(attempts):
+            try:
+                response = await self.webhook_client.post(
+                    webhook.url, json=notification
+                )
+                self.stats["webhook"][response.status_code] += 1
+            except httpx.HTTPError:
+                self.stats["webhook"]["error"] += 1
+
+
+app = FakeYooKassa(SimulatorConfig.from_env())
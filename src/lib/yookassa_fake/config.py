@@ -0,0 +1,203 @@
+"""
+Настройки симулятора ЮKassa: распределения задержек, отказы и лимит запросов.
+
+Конфиг задается JSON (строкой или путем до файла) в YOOKASSA_FAKE_CONFIG
+или на лету через POST /_fake/config:
+
+{
+    "latency": {"kind": "lognormal", "median_ms": 120, "sigma": 0.5},
+    "error_rate": 0.01,
+    "timeout_rate": 0.001,
+    "hang_seconds": 60,
+    "rate_limit": {"rps": 50, "burst": 100},
+    "operations": {
+        "charge_autopayment": {
+            "latency": {"kind": "uniform", "min_ms": 300, "max_ms": 2000},
+            "decline_rate": 0.05
+        }
+    },
+    "webhook": {
+        "url": "http://app:8000/api/sub/payment_notification/",
+        "delay": {"kind": "fixed", "ms": 500},
+        "duplicate_rate": 0.1,
+        "auto_confirm": true
+    }
+}
+
+Операции: create_payment, charge_autopayment, get_payment, list_payments,
+cancel_payment, create_refund. Настройки operations переопределяют общие.
+"""
+
+import json
+import math
+import os
+import random
+import time
+from dataclasses import dataclass, field, fields
+
+OPERATIONS = (
+    "create_payment",
+    "charge_autopayment",
+    "get_payment",
+    "list_payments",
+    "cancel_payment",
+    "create_refund",
+)
+
+
+@dataclass
+class LatencyDistribution:
+    """
+    Распределение задержки ответа:
+        fixed - ms
+        uniform - min_ms, max_ms
+        normal - mean_ms, stddev_ms (отрицательные значения обрезаются до 0)
+        lognormal - median_ms, sigma (длинный хвост, как у реальных API)
+    """
+
+    kind: str = "fixed"
+    ms: float = 0
+    min_ms: float = 0
+    max_ms: float = 0
+    mean_ms: float = 0
+    stddev_ms: float = 0
+    median_ms: float = 0
+    sigma: float = 0
+
+    def sample(self) -> float:
+        """Задержка в секундах"""
+        if self.kind == "fixed":
+            value = self.ms
+        elif self.kind == "uniform":
+            value = random.uniform(self.min_ms, self.max_ms)
+        elif self.kind == "normal":
+            value = random.gauss(self.mean_ms, self.stddev_ms)
+        elif self.kind == "lognormal":
+            value = random.lognormvariate(math.log(self.median_ms), self.sigma)
+        else:
+            raise ValueError(f"Неизвестное распределение {self.kind}")
+        return max(value, 0) / 1000
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "LatencyDistribution":
+        distribution = cls(**data)
+        if distribution.kind == "lognormal" and distribution.median_ms <= 0:
+            raise ValueError("Для lognormal нужен median_ms > 0")
+        return distribution
+
+
+@dataclass
+class OperationConfig:
+    """Поведение одной операции API"""
+
+    latency: LatencyDistribution = field(default_factory=LatencyDistribution)
+    # Доля ответов 500 internal_server_error
+    error_rate: float = 0
+    # Доля запросов, на которые сервер не отвечает hang_seconds
+    timeout_rate: float = 0
+    hang_seconds: float = 60
+    # Доля автоплатежей, отклоненных банком (статус canceled)
+    decline_rate: float = 0
+
+    @classmethod
+    def from_dict(
+        cls, data: dict, base: "OperationConfig | None" = None
+    ) -> "OperationConfig":
+        names = {f.name for f in fields(cls)}
+        values = {name: getattr(base, name) for name in names} if base else {}
+        for key, value in data.items():
+            if key not in names:
+                raise ValueError(f"Неизвестный параметр {key}")
+            if key == "latency":
+                value = LatencyDistribution.from_dict(value)
+            values[key] = value
+        return cls(**values)
+
+
+@dataclass
+class RateLimit:
+    """Лимит запросов token bucket, при превышении отвечает 429"""
+
+    rps: float = 0
+    burst: float = 0
+
+    def __post_init__(self):
+        self.tokens = self.burst or self.rps
+        self.updated = time.monotonic()
+
+    def acquire(self) -> bool:
+        if self.rps <= 0:
+            return True
+
+        now = time.monotonic()
+        capacity = self.burst or self.rps
+        self.tokens = min(capacity, self.tokens + (now - self.updated) * self.rps)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+@dataclass
+class WebhookConfig:
+    """
+    Отправка уведомлений в payment_notification.
+    auto_confirm - ожидающий оплаты платеж сам проходит через delay,
+    как если бы пользователь оплатил его на странице ЮKassa.
+    """
+
+    url: str = ""
+    delay: LatencyDistribution = field(default_factory=LatencyDistribution)
+    duplicate_rate: float = 0
+    auto_confirm: bool = False
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "WebhookConfig":
+        data = dict(data)
+        if "delay" in data:
+            data["delay"] = LatencyDistribution.from_dict(data["delay"])
+        return cls(**data)
+
+
+@dataclass
+class SimulatorConfig:
+    default: OperationConfig = field(default_factory=OperationConfig)
+    operations: dict[str, OperationConfig] = field(default_factory=dict)
+    rate_limit: RateLimit = field(default_factory=RateLimit)
+    webhook: WebhookConfig = field(default_factory=WebhookConfig)
+
+    def for_operation(self, operation: str) -> OperationConfig:
+        return self.operations.get(operation, self.default)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "SimulatorConfig":
+        data = dict(data)
+        operations = data.pop("operations", {})
+        rate_limit = RateLimit(**data.pop("rate_limit", {}))
+        webhook = WebhookConfig.from_dict(data.pop("webhook", {}))
+        default = OperationConfig.from_dict(data)
+
+        unknown = set(operations) - set(OPERATIONS)
+        if unknown:
+            raise ValueError(f"Неизвестные операции {', '.join(sorted(unknown))}")
+
+        return cls(
+            default=default,
+            operations={
+                name: OperationConfig.from_dict(value, base=default)
+                for name, value in operations.items()
+            },
+            rate_limit=rate_limit,
+            webhook=webhook,
+        )
+
+    @classmethod
+    def from_env(cls) -> "SimulatorConfig":
+        raw = os.getenv("YOOKASSA_FAKE_CONFIG", "")
+        if not raw:
+            return cls()
+        if not raw.lstrip().startswith("{"):
+            with open(raw) as config_file:
+                raw = config_file.read()
+        return cls.from_dict(json.loads(raw))
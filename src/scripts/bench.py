@@ -0,0 +1,511 @@
+"""
+Бенчмарк API подписок и пайплайна продлений.
+
+Поднимает фейковую ЮKassa (lib.yookassa_fake) в фоновом потоке и прогоняет сценарии:
+    create_subscription - создание подписок
+    get_subscription - чтение подписки по user_uuid
+    payment_notification - шторм вебхуков с дублями
+    payment_events_drain - применение накопленных уведомлений
+    renewal_sweep - продление N подписок, у которых подошел срок
+    expiry_sweep - истечение N подписок без автопродления
+    export_stream - выгрузка N подписок через ASGI приложение; завершается
+        ошибкой, если Django буферизует ответ целиком вместо потоковой отдачи
+    get_subscription_async, payment_notification_async - то же через async views
+
+Запросов в секунду на один воркер для sync и async ручек (один процесс uvicorn
+с сервисом поднимается в бенчмарке):
+python3 manage.py runscript bench --script-args asgi_port=8090 scenarios=create_subscription,get_subscription,get_subscription_async,payment_notification,payment_notification_async
+
+Печатает пропускную способность и p50/p95/p99, сравнивает с сохраненным
+baseline и завершается с кодом 1 при регрессии больше tolerance.
+
+Запускать только на локальной или стендовой БД и Redis: свип продлевает все
+подписки с подошедшим сроком, а не только созданные бенчмарком.
+
+python3 manage.py runscript bench --script-args n=1000 renewals=1000 concurrency=8 save=1
+    n - количество подписок для API сценариев
+    renewals - количество подписок для свипов продления и истечения
+    concurrency - количество параллельных клиентов (воркеров для свипа)
+    duplicates - сколько раз отправляется каждое уведомление
+    reads - сколько раз читается каждая подписка
+    scenarios - сценарии через запятую, по умолчанию все
+    base_url - адрес запущенного сервиса вместо in-process клиента Django,
+        сервис должен быть запущен с YOOKASSA_API_URL фейковой ЮKassa
+    asgi_port - поднять сервис в процессе бенчмарка на uvicorn (один воркер)
+        на этом порту и ходить в него по HTTP вместо in-process клиента Django
+    fake_port - порт фейковой ЮKassa
+    fake_config - JSON конфиг симулятора ЮKassa (задержки, отказы, лимиты),
+        см. lib.yookassa_fake.config
+    baseline - путь до файла baseline
+    save - сохранить результаты как новый baseline
+    tolerance - допустимое ухудшение p95 и пропускной способности, доля
+"""
+
+import asyncio
+import contextlib
+import json
+import random
+import threading
+import time
+import uuid
+import warnings
+from datetime import timedelta
+from pathlib import Path
+
+import httpx
+import uvicorn
+from django.conf import settings
+from django.db import connections
+from django.test import Client, override_settings
+from django.utils import timezone
+
+from apps.back.asgi import application
+from apps.sub import tasks
+from apps.sub.logic import RenewalLogic, SubscriptionLogic, YooKassaClient
+from apps.sub.models import (
+    Payment,
+    PaymentEvent,
+    Plan,
+    Subscription,
+    SubscriptionEvent,
+)
+from lib import benchmark
+from lib.yookassa_fake.app import app as fake_yookassa
+from lib.yookassa_fake.config import SimulatorConfig
+
+DEFAULTS = {
+    "n": 1000,
+    "renewals": 1000,
+    "concurrency": 8,
+    "duplicates": 3,
+    "reads": 5,
+    "scenarios": "create_subscription,get_subscription,payment_notification,renewal_sweep,expiry_sweep",
+    "base_url": "",
+    "asgi_port": 0,
+    "fake_port": 8081,
+    "fake_config": "",
+    "baseline": str(settings.BASE_DIR / "bench" / "baseline.json"),
+    "save": 0,
+    "tolerance": 0.2,
+}
+
+
+def parse_args(args: tuple) -> dict:
+    options = dict(DEFAULTS)
+    for arg in args:
+        key, _, value = arg.partition("=")
+        if key not in DEFAULTS:
+            raise SystemExit(f"Неизвестный параметр {key}")
+        options[key] = type(DEFAULTS[key])(value)
+    return options
+
+
+class UvicornServer:
+    """ASGI приложение на uvicorn в фоновом потоке"""
+
+    def __init__(self, app, port: int):
+        self.url = f"http://127.0.0.1:{port}"
+        self.server = uvicorn.Server(
+            uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning")
+        )
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def __enter__(self) -> "UvicornServer":
+        self.thread.start()
+        while not self.server.started:
+            if not self.thread.is_alive():
+                raise SystemExit(f"Не удалось запустить сервер {self.url}")
+            time.sleep(0.05)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.server.should_exit = True
+        self.thread.join()
+
+
+class FakeYooKassaServer(UvicornServer):
+    """Фейковая ЮKassa на uvicorn в фоновом потоке"""
+
+    def __init__(self, port: int, config_path: str):
+        if config_path:
+            fake_yookassa.config = SimulatorConfig.from_dict(
+                json.loads(Path(config_path).read_text())
+            )
+        super().__init__(fake_yookassa, port)
+        self.url = f"{self.url}/v3"
+
+    def __enter__(self) -> "FakeYooKassaServer":
+        super().__enter__()
+
+        # Клиенты ЮKassa будут ходить в фейковый сервер, он не проверяет ключи
+        settings.YOOKASSA_API_URL = self.url
+        SubscriptionLogic.yoo_client = YooKassaClient(
+            SubscriptionLogic.account_id, SubscriptionLogic.secret_key
+        )
+        return self
+
+
+class ServiceServer(UvicornServer):
+    """Сервис (apps.back.asgi) на uvicorn в фоновом потоке: один воркер"""
+
+    def __init__(self, port: int):
+        super().__init__(application, port)
+
+    def __enter__(self) -> "ServiceServer":
+        settings.ALLOWED_HOSTS = [*settings.ALLOWED_HOSTS, "127.0.0.1"]
+        super().__enter__()
+        return self
+
+
+class ApiClient:
+    """
+    HTTP клиент сценариев: in-process клиент Django или httpx к запущенному сервису.
+    У каждого потока свой клиент.
+    """
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self.local = threading.local()
+
+    def _client(self) -> Client | httpx.Client:
+        client = getattr(self.local, "client", None)
+        if client is None:
+            if self.base_url:
+                client = httpx.Client(base_url=self.base_url, verify=False)
+            else:
+                client = Client(HTTP_HOST="nginx")
+            self.local.client = client
+        return client
+
+    def get(self, path: str, params: dict) -> int:
+        client = self._client()
+        if self.base_url:
+            return client.get(path, params=params).status_code
+        return client.get(path, params).status_code
+
+    def post(self, path: str, body: dict) -> int:
+        client = self._client()
+        if self.base_url:
+            return client.post(path, json=body).status_code
+        return client.post(
+            path, json.dumps(body), content_type="application/json"
+        ).status_code
+
+
+class Bench:
+    def __init__(self, options: dict):
+        self.options = options
+        self.api = ApiClient(options["base_url"])
+        self.plan = Plan.objects.create(name="bench", price=199, days=30)
+        self.user_uuids: list[str] = []
+
+    def run_concurrent(self, name: str, func, items) -> benchmark.BenchResult:
+        return benchmark.run_concurrent(
+            name,
+            func,
+            items,
+            self.options["concurrency"],
+            teardown=connections.close_all,
+        )
+
+    def create_subscription(self) -> list[benchmark.BenchResult]:
+        self.user_uuids = [str(uuid.uuid4()) for _ in range(self.options["n"])]
+
+        def create(user_uuid: str) -> bool:
+            status = self.api.post(
+                "/api/sub/create_subscription/",
+                {
+                    "plan_id": self.plan.pk,
+                    "user_uuid": user_uuid,
+                    "auto_renew": True,
+                    "return_url": "https://example.com/return",
+                },
+            )
+            return status == 200
+
+        return [self.run_concurrent("create_subscription", create, self.user_uuids)]
+
+    def require_subscriptions(self) -> None:
+        if not self.user_uuids:
+            raise SystemExit("Сценарий требует запуска create_subscription перед ним")
+
+    def get_subscription(
+        self, name: str = "get_subscription", prefix: str = "/api/sub/"
+    ) -> list[benchmark.BenchResult]:
+        self.require_subscriptions()
+        user_uuids = self.user_uuids * self.options["reads"]
+        random.shuffle(user_uuids)
+
+        def get(user_uuid: str) -> bool:
+            status = self.api.get(
+                f"{prefix}get_subscription_by_user_uuid/", {"user_uuid": user_uuid}
+            )
+            return status == 200
+
+        return [self.run_concurrent(name, get, user_uuids)]
+
+    def get_subscription_async(self) -> list[benchmark.BenchResult]:
+        return self.get_subscription("get_subscription_async", "/api/async/sub/")
+
+    def payment_notification(
+        self, name: str = "payment_notification", prefix: str = "/api/sub/"
+    ) -> list[benchmark.BenchResult]:
+        self.require_subscriptions()
+        yk_payment_ids = list(
+            Payment.objects.filter(subscription__plan=self.plan).values_list(
+                "yk_payment_id", flat=True
+            )
+        )
+        notifications = []
+        for yk_payment_id in yk_payment_ids:
+            payment = fake_yookassa.payments[yk_payment_id]
+            payment.update(status="succeeded", paid=True)
+            notifications.append(
+                {
+                    "type": "notification",
+                    "event": "payment.succeeded",
+                    "object": payment,
+                }
+            )
+
+        # Уведомления прошлого сценария, чтобы доля новых и повторов была та же
+        PaymentEvent.objects.filter(yk_payment_id__in=yk_payment_ids).delete()
+
+        storm = notifications * self.options["duplicates"]
+        random.shuffle(storm)
+
+        def notify(notification: dict) -> bool:
+            status = self.api.post(f"{prefix}payment_notification/", notification)
+            return status == 200
+
+        results = [self.run_concurrent(name, notify, storm)]
+
+        # Уведомления применяем явно, чтобы замерить время разбора очереди
+        started = time.perf_counter()
+        tasks.process_payment_events()
+        elapsed = time.perf_counter() - started
+        results.append(
+            benchmark.BenchResult(
+                name=name.replace("payment_notification", "payment_events_drain"),
+                elapsed=elapsed,
+                timings=[elapsed * 1000],
+                items=len(notifications),
+            )
+        )
+        return results
+
+    def payment_notification_async(self) -> list[benchmark.BenchResult]:
+        return self.payment_notification(
+            "payment_notification_async", "/api/async/sub/"
+        )
+
+    def renewal_sweep(self) -> list[benchmark.BenchResult]:
+        now = timezone.now()
+        subscriptions = Subscription.objects.bulk_create(
+            Subscription(
+                user_uuid=uuid.uuid4(),
+                plan=self.plan,
+                status="active",
+                start_date=now - timedelta(days=30),
+                end_date=now - timedelta(minutes=1),
+                auto_renew=True,
+            )
+            for _ in range(self.options["renewals"])
+        )
+        Payment.objects.bulk_create(
+            Payment(
+                subscription=subscription,
+                amount=self.plan.price,
+                user_uuid=subscription.user_uuid,
+                yk_payment_id=f"bench-{uuid.uuid4()}",
+                yk_payment_method_id=f"bench-pm-{uuid.uuid4()}",
+            )
+            for subscription in subscriptions
+        )
+
+        # Как renewal_sweep, только пачки выполняются в пуле потоков вместо воркеров Celery
+        batch_size = settings.RENEWAL_TASK_BATCH_SIZE
+        batches = []
+        started = time.perf_counter()
+        while claimed := RenewalLogic.claim_due_subscriptions(
+            settings.RENEWAL_SWEEP_CHUNK_SIZE
+        ):
+            renew_ids = [row.id for row in claimed]
+            batches += [
+                renew_ids[i : i + batch_size]
+                for i in range(0, len(renew_ids), batch_size)
+            ]
+        claim_elapsed = time.perf_counter() - started
+
+        result = self.run_concurrent("renewal_sweep", tasks.make_autopayment, batches)
+        result.elapsed += claim_elapsed
+        result.items = sum(len(batch) for batch in batches)
+        return [result]
+
+    def expiry_sweep(self) -> list[benchmark.BenchResult]:
+        now = timezone.now()
+        Subscription.objects.bulk_create(
+            Subscription(
+                user_uuid=uuid.uuid4(),
+                plan=self.plan,
+                status="active",
+                start_date=now - timedelta(days=30),
+                end_date=now - timedelta(minutes=1),
+                auto_renew=False,
+            )
+            for _ in range(self.options["renewals"])
+        )
+
+        # Как expiry_sweep: пачки выполняются последовательно, время - на пачку
+        chunk_size = settings.EXPIRY_SWEEP_CHUNK_SIZE
+        result = benchmark.BenchResult("expiry_sweep", elapsed=0.0, items=0)
+        started = time.perf_counter()
+        while True:
+            chunk_started = time.perf_counter()
+            expired = RenewalLogic.expire_due_subscriptions(chunk_size)
+            if expired:
+                result.timings.append((time.perf_counter() - chunk_started) * 1000)
+                result.items += expired
+            if expired < chunk_size:
+                break
+        result.elapsed = time.perf_counter() - started
+        return [result]
+
+    def export_stream(self) -> list[benchmark.BenchResult]:
+        now = timezone.now()
+        subscriptions = Subscription.objects.bulk_create(
+            Subscription(
+                user_uuid=uuid.uuid4(),
+                plan=self.plan,
+                status="active",
+                start_date=now,
+                end_date=now + timedelta(days=30),
+            )
+            for _ in range(self.options["n"])
+        )
+        # Строки моложе EXPORT_WATERMARK_LAG_SECONDS не выгружаются
+        Subscription.objects.filter(
+            id__in=[subscription.pk for subscription in subscriptions]
+        ).update(created_at=now - timedelta(days=1))
+
+        token = "bench"
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "GET",
+            "scheme": "http",
+            "path": "/api/export/subscriptions/",
+            "raw_path": b"/api/export/subscriptions/",
+            "query_string": b"format=ndjson",
+            "headers": [
+                (b"host", b"127.0.0.1"),
+                (b"authorization", f"Bearer {token}".encode()),
+            ],
+            "client": ("127.0.0.1", 0),
+            "server": ("127.0.0.1", 80),
+        }
+        body_sizes: list[int] = []
+        first_byte: list[float] = []
+
+        async def fetch() -> None:
+            request_sent = False
+
+            async def receive() -> dict:
+                nonlocal request_sent
+                if not request_sent:
+                    request_sent = True
+                    return {"type": "http.request", "body": b"", "more_body": False}
+                # Клиент не отключается до конца ответа
+                await asyncio.Event().wait()
+
+            async def send(message: dict) -> None:
+                if message["type"] == "http.response.body" and message.get("body"):
+                    if not first_byte:
+                        first_byte.append(time.perf_counter())
+                    body_sizes.append(len(message["body"]))
+
+            await application(scope, receive, send)
+
+        started = time.perf_counter()
+        with (
+            override_settings(
+                EXPORT_API_TOKEN=token,
+                ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "127.0.0.1"],
+            ),
+            warnings.catch_warnings(record=True) as caught,
+        ):
+            warnings.simplefilter("always")
+            asyncio.run(fetch())
+        elapsed = time.perf_counter() - started
+
+        # Синхронный итератор Django под ASGI читает целиком (sync_to_async(list))
+        buffered = [
+            warning
+            for warning in caught
+            if "StreamingHttpResponse must consume synchronous iterators"
+            in str(warning.message)
+        ]
+        if buffered or not first_byte:
+            raise SystemExit("export_stream: ответ выгрузки буферизуется целиком")
+
+        ttfb = first_byte[0] - started
+        return [
+            benchmark.BenchResult(
+                "export_first_byte", elapsed=ttfb, timings=[ttfb * 1000], items=1
+            ),
+            benchmark.BenchResult(
+                "export_stream",
+                elapsed=elapsed,
+                timings=[elapsed * 1000],
+                items=len(subscriptions),
+            ),
+        ]
+
+    def cleanup(self) -> None:
+        yk_payment_ids = Payment.objects.filter(
+            subscription__plan=self.plan
+        ).values_list("yk_payment_id", flat=True)
+        PaymentEvent.objects.filter(yk_payment_id__in=list(yk_payment_ids)).delete()
+        SubscriptionEvent.objects.filter(plan_id=self.plan.pk).delete()
+        # Подписки и платежи удаляются каскадно
+        self.plan.delete()
+
+
+def run(*args) -> None:  # type: ignore
+    options = parse_args(args)
+    scenarios = options["scenarios"].split(",")
+    baseline_path = Path(options["baseline"])
+
+    results: list[benchmark.BenchResult] = []
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(
+            FakeYooKassaServer(options["fake_port"], options["fake_config"])
+        )
+        if options["asgi_port"] and not options["base_url"]:
+            service = stack.enter_context(ServiceServer(options["asgi_port"]))
+            options["base_url"] = service.url
+
+        bench = Bench(options)
+        try:
+            for scenario in scenarios:
+                print(f"Сценарий {scenario}...")
+                results += getattr(bench, scenario)()
+        finally:
+            bench.cleanup()
+
+    summaries = {result.name: result.summary() for result in results}
+    baseline = benchmark.load_baseline(baseline_path)
+    benchmark.print_summaries(summaries, baseline)
+
+    if options["save"]:
+        benchmark.save_baseline(baseline_path, summaries)
+        print(f"Baseline сохранен в {baseline_path}")
+        return
+
+    regressions = benchmark.find_regressions(summaries, baseline, options["tolerance"])
+    if regressions:
+        print("Регрессии:")
+        for regression in regressions:
+            print(f" - {regression}")
+        raise SystemExit(1)
@@ -0,0 +1,145 @@
+"""
+Бенчмарк индексов таблицы payment.
+
+Засевает БД миллионами платежей, замеряет задержку запросов вебхука,
+истории платежей и поиска сохраненного способа оплаты с индексами (after),
+затем удаляет индексы и замеряет снова (before). Все изменения выполняются
+в одной транзакции и откатываются в конце.
+
+Запускать только на локальной или стендовой БД: на время замера без индексов
+таблица payment заблокирована.
+
+python3 manage.py runscript bench_payment_indexes --script-args 2000000 24 500
+    1 - количество платежей, 2 - платежей на пользователя, 3 - замеров на запрос
+"""
+
+import random
+import time
+from typing import Callable
+
+from django.db import connection, transaction
+
+from apps.sub.models import Payment, Plan
+from lib.benchmark import percentiles
+
+DROP_INDEXES_SQL = (
+    "ALTER TABLE payment DROP CONSTRAINT payment_yk_payment_id_uniq",
+    "DROP INDEX payment_user_history_idx",
+    "DROP INDEX payment_saved_method_idx",
+)
+
+
+def seed(payments: int, per_user: int) -> None:
+    """Засевает подписки и платежи через generate_series"""
+    plan = Plan.objects.create(name="bench", price=100, days=30)
+    users = max(payments // per_user, 1)
+
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT coalesce(max(id), 0) FROM subscription")
+        (min_id,) = cursor.fetchone()
+
+        cursor.execute(
+            """
+            INSERT INTO subscription
+                (user_uuid, plan_id, status, start_date, end_date, auto_renew, created_at)
+            SELECT gen_random_uuid(), %s, 'active', now(), now() + interval '30 days', true, now()
+            FROM generate_series(1, %s)
+            """,
+            [plan.pk, users],
+        )
+        cursor.execute(
+            """
+            INSERT INTO payment
+                (subscription_id, amount, payment_date, yk_payment_id, yk_payment_method_id, user_uuid)
+            SELECT
+                s.id,
+                100,
+                now() - g * interval '30 days',
+                'bench-' || s.id || '-' || g,
+                CASE WHEN g %% 2 = 0 THEN 'pm-' || s.id END,
+                s.user_uuid
+            FROM subscription s CROSS JOIN generate_series(1, %s) g
+            WHERE s.id > %s
+            """,
+            [per_user, min_id],
+        )
+        cursor.execute("ANALYZE subscription")
+        cursor.execute("ANALYZE payment")
+
+
+def sample_keys(samples: int) -> list[tuple[str, str, int]]:
+    """Случайные (yk_payment_id, user_uuid, subscription_id) из засеянных платежей"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT yk_payment_id, user_uuid, subscription_id
+            FROM payment TABLESAMPLE SYSTEM (1)
+            WHERE yk_payment_id LIKE 'bench-%%'
+            LIMIT %s
+            """,
+            [samples],
+        )
+        return cursor.fetchall()
+
+
+def measure(keys: list, query: Callable) -> dict[str, float]:
+    """Замер задержки запроса в миллисекундах"""
+    timings = []
+    for key in keys:
+        started = time.perf_counter()
+        query(key)
+        timings.append((time.perf_counter() - started) * 1000)
+
+    return percentiles(timings)
+
+
+QUERIES: dict[str, Callable] = {
+    # payment_notification
+    "webhook": lambda key: Payment.objects.filter(yk_payment_id=key[0]).first(),
+    # get_user_payment_history
+    "history": lambda key: list(Payment.objects.filter(user_uuid=key[1])),
+    # renew_subscription / cancel_subscription
+    "saved_method": lambda key: (
+        Payment.objects.filter(subscription_id=key[2])
+        .exclude(yk_payment_method_id__isnull=True)
+        .order_by("-id")
+        .first()
+    ),
+}
+
+
+def run_queries(keys: list) -> dict[str, dict[str, float]]:
+    return {name: measure(keys, query) for name, query in QUERIES.items()}
+
+
+def run(*args) -> None:  # type: ignore
+    payments = int(args[0]) if len(args) > 0 else 2_000_000
+    per_user = int(args[1]) if len(args) > 1 else 24
+    samples = int(args[2]) if len(args) > 2 else 500
+
+    with transaction.atomic():
+        started = time.perf_counter()
+        seed(payments, per_user)
+        print(f"Засеяно {payments} платежей за {time.perf_counter() - started:.1f} с")
+
+        keys = sample_keys(samples)
+        random.shuffle(keys)
+
+        after = run_queries(keys)
+
+        with connection.cursor() as cursor:
+            for sql in DROP_INDEXES_SQL:
+                cursor.execute(sql)
+            cursor.execute("ANALYZE payment")
+
+        before = run_queries(keys)
+
+        transaction.set_rollback(True)
+
+    print(f"{'запрос':<14}{'':<8}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}")
+    for name in QUERIES:
+        for label, result in (("before", before[name]), ("after", after[name])):
+            print(
+                f"{name:<14}{label:<8}"
+                f"{result['p50']:>10.2f}{result['p95']:>10.2f}{result['p99']:>10.2f}"
+            )
@@ -0,0 +1,48 @@
+"""
+Отчет о повторных списаниях подписок в past_due.
+
+python3 manage.py runscript dunning_report --script-args days=30
+    days - попытки, начатые за последние days дней, 0 - за все время
+"""
+
+from datetime import timedelta
+
+from django.utils import timezone
+
+from apps.sub.logic import DunningLogic
+
+DEFAULTS = {
+    "days": 30,
+}
+
+
+def parse_args(args: tuple) -> dict:
+    options = dict(DEFAULTS)
+    for arg in args:
+        key, _, value = arg.partition("=")
+        if key not in DEFAULTS:
+            raise SystemExit(f"Неизвестный параметр {key}")
+        options[key] = type(DEFAULTS[key])(value)
+    return options
+
+
+def run(*args):
+    options = parse_args(args)
+
+    since = None
+    if options["days"] > 0:
+        since = timezone.now() - timedelta(days=options["days"])
+    report = DunningLogic.report(since)
+
+    rate = report["recovery_rate"]
+    print(
+        f"Начато: {report['started']}, ожидают попытки: {report['scheduled']}, "
+        f"продлено: {report['recovered']}, отменено: {report['failed']}, "
+        f"закрыто без исхода: {report['cancelled']}"
+    )
+    print(f"Доля возврата: {f'{rate:.1%}' if rate is not None else '-'}")
+    for attempt, count in report["recovered_by_attempt"].items():
+        print(f"  продлено с попытки {attempt}: {count}")
+    print("Причины последнего отказа:")
+    for reason, count in report["decline_reasons"].items():
+        print(f"  {reason}: {count}")
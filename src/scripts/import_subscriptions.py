@@ -0,0 +1,66 @@
+"""
+Массовый импорт подписок партнера из CSV, см. apps.sub.importer.
+
+python3 manage.py runscript import_subscriptions --script-args plans=plans.csv subscriptions=subscriptions.csv dry_run=1
+    plans - CSV планов с колонками name, price, days (необязательный)
+    subscriptions - CSV подписок с колонками user_uuid, plan (название плана),
+        status (active, expired или cancelled), start_date, end_date (ISO 8601),
+        auto_renew (0/1), payment_method_id (сохраненный способ оплаты ЮKassa)
+    dry_run - только проверить файлы, ничего не записывая
+    batch_size - подписок в пачке, по умолчанию IMPORT_BATCH_SIZE
+"""
+
+import csv
+from pathlib import Path
+
+from apps.sub.importer import SubscriptionImport
+
+DEFAULTS = {
+    "plans": "",
+    "subscriptions": "",
+    "dry_run": 0,
+    "batch_size": 0,
+}
+
+
+def parse_args(args: tuple) -> dict:
+    options = dict(DEFAULTS)
+    for arg in args:
+        key, _, value = arg.partition("=")
+        if key not in DEFAULTS:
+            raise SystemExit(f"Неизвестный параметр {key}")
+        options[key] = type(DEFAULTS[key])(value)
+    return options
+
+
+def read_csv(path: str) -> list[dict]:
+    if not path:
+        return []
+    with open(path, newline="", encoding="utf-8") as f:
+        return list(csv.DictReader(f))
+
+
+def run(*args):
+    options = parse_args(args)
+    if not options["subscriptions"]:
+        raise SystemExit("Не указан файл подписок subscriptions")
+
+    importer = SubscriptionImport(
+        dry_run=bool(options["dry_run"]), batch_size=options["batch_size"] or None
+    )
+    with open(Path(options["subscriptions"]), newline="", encoding="utf-8") as f:
+        report = importer.run(read_csv(options["plans"]), csv.DictReader(f))
+
+    print(
+        f"{'Проверка' if options['dry_run'] else 'Импорт'}: строк {report.rows} "
+        f"за {report.elapsed:.2f} с ({report.rows_per_second:.0f} строк/с)\n"
+        f"  импортировано подписок: {report.imported}\n"
+        f"  сохраненных способов оплаты: {report.payment_methods}\n"
+        f"  создано планов: {report.plans_created}\n"
+        f"  повторов user_uuid в файле: {report.duplicates}\n"
+        f"  уже есть в БД: {report.existing}\n"
+        f"  способ оплаты уже импортировался: {report.imported_before}\n"
+        f"  невалидных строк: {report.invalid}"
+    )
+    for error in report.errors:
+        print(f"  {error}")
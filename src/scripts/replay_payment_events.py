@@ -0,0 +1,57 @@
+"""
+Повторное применение уведомлений ЮKassa пачками, например failed после
+исправления ошибки или skipped после загрузки потерянных платежей.
+
+python3 manage.py runscript replay_payment_events --script-args status=failed batch_size=500
+    status - статус уведомлений: failed, skipped или processed
+    batch_size - уведомлений в пачке, по умолчанию PAYMENT_EVENTS_BATCH_SIZE
+"""
+
+import time
+
+from apps.sub.logic import PaymentEventLogic
+from apps.sub.models import PaymentEvent
+
+DEFAULTS = {
+    "status": "failed",
+    "batch_size": 0,
+}
+
+
+def parse_args(args: tuple) -> dict:
+    options = dict(DEFAULTS)
+    for arg in args:
+        key, _, value = arg.partition("=")
+        if key not in DEFAULTS:
+            raise SystemExit(f"Неизвестный параметр {key}")
+        options[key] = type(DEFAULTS[key])(value)
+    return options
+
+
+def run(*args):
+    options = parse_args(args)
+    if options["status"] not in ("failed", "skipped", "processed"):
+        raise SystemExit(f"Неверный статус {options['status']}")
+
+    # Уведомления, получившие статус во время прохода, не применяются
+    events = PaymentEvent.objects.filter(status=options["status"])
+    last_id = events.order_by("-id").values_list("id", flat=True).first()
+    if last_id is None:
+        print("Нет уведомлений для повторного применения")
+        return
+    total = events.filter(id__lte=last_id).count()
+
+    started = time.perf_counter()
+    after_id = 0
+    while after_id is not None:
+        after_id = PaymentEventLogic.replay_events(
+            options["status"], after_id, last_id, options["batch_size"] or None
+        )
+    elapsed = time.perf_counter() - started
+
+    remaining = events.filter(id__lte=last_id).count()
+    print(
+        f"Применено уведомлений: {total} за {elapsed:.2f} с "
+        f"({total / elapsed if elapsed else 0:.0f} в секунду), "
+        f"осталось в статусе {options['status']}: {remaining}"
+    )